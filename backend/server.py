@@ -1,10 +1,28 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel, ASCENDING, DESCENDING, ReturnDocument, UpdateOne, UpdateMany, ReplaceOne
+from pymongo.errors import OperationFailure, DuplicateKeyError, BulkWriteError
 import os
+import re
+import socket
+import io
+import csv
+import json
+import zlib
+import hashlib
+import base64
+import bisect
+import heapq
+import time
+import asyncio
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional, Dict, Any
@@ -14,6 +32,9 @@ import jwt
 import bcrypt
 from bson import ObjectId
 import secrets
+from abc import ABC, abstractmethod
+import numpy as np
+import pandas as pd
 from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
 
 ROOT_DIR = Path(__file__).parent
@@ -219,6 +240,11 @@ class InvoiceCreate(BaseModel):
     num_installments: int = 1
     installment_dates: List[str] = []
 
+class InvoiceBatchCreate(InvoiceCreate):
+    """The same invoice issued to many campers"""
+    camper_id: Optional[str] = None
+    camper_ids: List[str]
+
 class InvoiceResponse(InvoiceBase):
     model_config = ConfigDict(extra="ignore")
     id: str
@@ -282,6 +308,7 @@ class RoomResponse(RoomBase):
     model_config = ConfigDict(extra="ignore")
     id: str
     assigned_campers: List[str] = []
+    occupancy: int = 0
 
 # Groups Model (for shiurim, trips, transportation, etc.)
 class GroupBase(BaseModel):
@@ -290,6 +317,7 @@ class GroupBase(BaseModel):
     capacity: Optional[int] = None
     description: Optional[str] = None
     parent_id: Optional[str] = None  # For hierarchical groups
+    ancestors: List[str] = []  # Materialized path, root first
 
 class GroupCreate(BaseModel):
     name: str
@@ -372,6 +400,7 @@ TEMPLATE_MERGE_FIELDS = {
         {"field": "{{camper_grade}}", "label": "Camper Grade"},
         {"field": "{{camper_yeshiva}}", "label": "Camper Yeshiva"},
         {"field": "{{camper_status}}", "label": "Camper Status"},
+        {"field": "{{status}}", "label": "New Status (status change emails)"},
     ],
     "billing": [
         {"field": "{{amount_due}}", "label": "Amount Due"},
@@ -506,12 +535,85 @@ KANBAN_STATUSES = [
 
 # ==================== AUTH HELPERS ====================
 
-def hash_password(password: str) -> str:
+# bcrypt is CPU-bound (~100-300 ms per call), so it runs on a dedicated pool instead of the event loop
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get("PASSWORD_HASH_MAX_QUEUE", "32"))
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+password_pool_stats = {"in_flight": 0, "peak_in_flight": 0, "completed": 0, "rejected": 0}
+
+async def run_password_work(fn, *args):
+    """Run a bcrypt call on the password pool, shedding load once the queue is full"""
+    if password_pool_stats["in_flight"] >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE:
+        password_pool_stats["rejected"] += 1
+        raise HTTPException(status_code=503, detail="Authentication is busy, please retry", headers={"Retry-After": "1"})
+    password_pool_stats["in_flight"] += 1
+    password_pool_stats["peak_in_flight"] = max(password_pool_stats["peak_in_flight"], password_pool_stats["in_flight"])
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, fn, *args)
+    finally:
+        password_pool_stats["in_flight"] -= 1
+        password_pool_stats["completed"] += 1
+
+def password_pool_metrics() -> Dict[str, Any]:
+    return {
+        **password_pool_stats,
+        "queue_depth": max(0, password_pool_stats["in_flight"] - PASSWORD_HASH_WORKERS),
+        "workers": PASSWORD_HASH_WORKERS,
+        "max_queue": PASSWORD_HASH_MAX_QUEUE
+    }
+
+def _hash_password_sync(password: str) -> str:
     return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
 
-def verify_password(password: str, hashed: str) -> bool:
+def _verify_password_sync(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode(), hashed.encode())
 
+async def hash_password(password: str) -> str:
+    return await run_password_work(_hash_password_sync, password)
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await run_password_work(_verify_password_sync, password, hashed)
+
+# Per-IP throttle on failed logins (sliding window); checked before any bcrypt work is queued
+LOGIN_ATTEMPTS_PER_WINDOW = int(os.environ.get("LOGIN_FAILURES_PER_MINUTE", "10"))
+LOGIN_WINDOW_SECONDS = 60
+# Behind an ingress every request comes from the proxy. Enable TRUST_FORWARDED_FOR there and set
+# TRUSTED_PROXY_HOPS to the number of proxies in front of the app: the client IP is the entry that
+# many places from the right of X-Forwarded-For. Entries further left are client-supplied and ignored.
+TRUST_FORWARDED_FOR = os.environ.get("TRUST_FORWARDED_FOR", "false").lower() == "true"
+TRUSTED_PROXY_HOPS = max(1, int(os.environ.get("TRUSTED_PROXY_HOPS", "1")))
+login_attempts: Dict[str, deque] = {}
+
+def client_ip(request: Request) -> str:
+    if TRUST_FORWARDED_FOR:
+        hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
+
+def check_login_throttle(ip: str):
+    now = time.monotonic()
+    attempts = login_attempts.get(ip)
+    if not attempts:
+        return
+    while attempts and attempts[0] <= now - LOGIN_WINDOW_SECONDS:
+        attempts.popleft()
+    if len(attempts) >= LOGIN_ATTEMPTS_PER_WINDOW:
+        retry_after = max(1, int(attempts[0] + LOGIN_WINDOW_SECONDS - now) + 1)
+        raise HTTPException(
+            status_code=429,
+            detail="Too many failed login attempts, please try again later",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+def record_failed_login(ip: str):
+    now = time.monotonic()
+    if len(login_attempts) > 10000:
+        # Forget IPs whose whole window has expired
+        for stale in [k for k, v in login_attempts.items() if not v or v[-1] <= now - LOGIN_WINDOW_SECONDS]:
+            del login_attempts[stale]
+    login_attempts.setdefault(ip, deque()).append(now)
+
 def create_token(admin_id: str, email: str) -> str:
     payload = {
         "sub": admin_id,
@@ -520,10 +622,111 @@ def create_token(admin_id: str, email: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+class TTLCache:
+    """Small in-process cache with per-entry expiry and hit/miss counters"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: Dict[Any, tuple] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self.hits += 1
+                return value
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        if key not in self._entries and len(self._entries) >= self.max_entries:
+            # Drop the oldest entry (dicts keep insertion order)
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+
+    def invalidate(self, key):
+        self.invalidations += 1
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self.invalidations += 1
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "invalidations": self.invalidations,
+            "ttl_seconds": self.ttl_seconds
+        }
+
+# Approved-admin lookups done on every authenticated request
+ADMIN_CACHE_TTL_SECONDS = float(os.environ.get("ADMIN_CACHE_TTL_SECONDS", "60"))
+admin_cache = TTLCache(ADMIN_CACHE_TTL_SECONDS)
+
+# Optional shared backend: with REDIS_URL set, invalidations are broadcast so every worker drops the entry
+# (search index changes travel the same way, see SEARCH_INDEX_CHANNEL)
+ADMIN_CACHE_CHANNEL = "campbaraisa:admin-cache-invalidate"
+redis_client = None
+if os.environ.get("REDIS_URL"):
+    try:
+        import redis.asyncio as aioredis
+        redis_client = aioredis.from_url(os.environ["REDIS_URL"])
+    except ImportError:
+        logging.warning("REDIS_URL is set but the redis package is not installed; admin cache and search index stay per-worker")
+
+async def invalidate_admin_cache(admin_id: str):
+    admin_cache.invalidate(admin_id)
+    actor_name_cache.invalidate(admin_id)
+    if redis_client is not None:
+        try:
+            await redis_client.publish(ADMIN_CACHE_CHANNEL, admin_id)
+        except Exception as e:
+            logging.error(f"Failed to broadcast admin cache invalidation: {e}")
+
+async def listen_for_cache_invalidations():
+    """Drop admin cache entries invalidated by other workers and apply their search index changes"""
+    while True:
+        try:
+            pubsub = redis_client.pubsub()
+            await pubsub.subscribe(ADMIN_CACHE_CHANNEL, SEARCH_INDEX_CHANNEL)
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                channel, data = (v.decode() if isinstance(v, bytes) else v for v in (message["channel"], message["data"]))
+                if channel == SEARCH_INDEX_CHANNEL:
+                    payload = json.loads(data)
+                    if payload.get("origin") != WORKER_ID:
+                        camper_search_index.apply(payload.get("changes", []))
+                else:
+                    admin_cache.invalidate(data)
+                    actor_name_cache.invalidate(data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Cache invalidation listener failed, retrying: {e}")
+            # Anything missed while disconnected may be stale, so start clean
+            admin_cache.clear()
+            camper_search_index.ready = False
+            await asyncio.sleep(5)
+
 async def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        admin = await db.admins.find_one({"id": payload["sub"]}, {"_id": 0})
+        admin = admin_cache.get(payload["sub"])
+        if admin is None:
+            admin = await db.admins.find_one({"id": payload["sub"]}, {"_id": 0, "password_hash": 0})
+            if admin:
+                admin_cache.set(payload["sub"], admin)
         if not admin:
             raise HTTPException(status_code=401, detail="Admin not found")
         if not admin.get("is_approved"):
@@ -534,6 +737,97 @@ async def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+# ==================== PAGINATION HELPERS ====================
+
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 5000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+_FIELD_NAME_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+def encode_cursor(sort_value: Any, doc_id: Optional[str]) -> str:
+    """Opaque keyset cursor: the sort key value and id of the last document on a page"""
+    raw = json.dumps([sort_value, doc_id], default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, doc_id = json.loads(raw)
+        return sort_value, doc_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_sort(sort: str, allowed: tuple) -> tuple:
+    """Parse "field" / "-field" into (field, direction), restricted to indexed sort keys.
+
+    Every key in an `allowed` whitelist needs a (key, id) index in REQUIRED_INDEXES, or keyset
+    pages on it fall back to an in-memory sort of the whole filtered set.
+    """
+    key = sort.lstrip("-")
+    if key not in allowed:
+        raise HTTPException(status_code=400, detail=f"Invalid sort key. Must be one of: {list(allowed)}")
+    return key, DESCENDING if sort.startswith("-") else ASCENDING
+
+def parse_fields(fields: Optional[str], *always: str) -> Optional[dict]:
+    """Turn a comma-separated fields= parameter into a Mongo projection"""
+    if not fields:
+        return None
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    invalid = [f for f in names if not _FIELD_NAME_RE.match(f)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid field names: {invalid}")
+    projection = {"_id": 0}
+    for name in [*always, *names]:
+        projection[name] = 1
+    return projection
+
+def keyset_filter(key: str, direction: int, cursor: str) -> dict:
+    """Filter selecting documents that sort strictly after the cursor position"""
+    value, last_id = decode_cursor(cursor)
+    op = "$lt" if direction == DESCENDING else "$gt"
+    if value is None:
+        # Nulls sort first ascending / last descending, so only ties (and, ascending, all non-nulls) remain
+        after = [{key: None, "id": {op: last_id}}]
+        if direction == ASCENDING:
+            after.append({key: {"$ne": None}})
+        return {"$or": after}
+    return {"$or": [{key: {op: value}}, {key: value, "id": {op: last_id}}]}
+
+async def paginate(
+    collection,
+    query: dict,
+    response: Response,
+    sort: tuple,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+) -> List[dict]:
+    """Fetch one keyset page sorted by (sort key, id).
+
+    Sets the X-Next-Cursor response header when more documents follow, so large
+    collections are walked page by page instead of being silently truncated.
+    """
+    key, direction = sort
+    limit = limit or DEFAULT_PAGE_SIZE
+    if cursor:
+        page_filter = keyset_filter(key, direction, cursor)
+        query = {"$and": [query, page_filter]} if query else page_filter
+    projection = parse_fields(fields, "id", key) or {"_id": 0}
+
+    docs = await collection.find(query, projection).sort([(key, direction), ("id", direction)]).limit(limit + 1).to_list(limit + 1)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(docs[-1].get(key), docs[-1].get("id"))
+    return docs
+
+def projected_response(docs: List[dict], response: Response) -> JSONResponse:
+    """Return projected documents as-is (bypassing the full response model), keeping the cursor header"""
+    headers = {}
+    if NEXT_CURSOR_HEADER in response.headers:
+        headers[NEXT_CURSOR_HEADER] = response.headers[NEXT_CURSOR_HEADER]
+    return JSONResponse(jsonable_encoder(docs), headers=headers)
+
 # ==================== AUTH ROUTES ====================
 
 @api_router.post("/auth/register", response_model=AdminResponse)
@@ -551,7 +845,7 @@ async def register_admin(data: AdminCreate):
         "email": data.email,
         "name": data.name,
         "role": data.role,
-        "password_hash": hash_password(data.password),
+        "password_hash": await hash_password(data.password),
         "is_approved": is_first_admin,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
@@ -567,12 +861,17 @@ async def register_admin(data: AdminCreate):
     )
 
 @api_router.post("/auth/login", response_model=TokenResponse)
-async def login_admin(data: AdminLogin):
+async def login_admin(data: AdminLogin, request: Request):
+    ip = client_ip(request)
+    check_login_throttle(ip)
+    
     admin = await db.admins.find_one({"email": data.email}, {"_id": 0})
     if not admin:
+        record_failed_login(ip)
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    if not verify_password(data.password, admin["password_hash"]):
+    if not await verify_password(data.password, admin["password_hash"]):
+        record_failed_login(ip)
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     if not admin.get("is_approved"):
@@ -623,6 +922,7 @@ async def approve_admin(admin_id: str, admin=Depends(get_current_admin)):
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Admin not found")
+    await invalidate_admin_cache(admin_id)
     return {"message": "Admin approved successfully"}
 
 @api_router.post("/auth/deny/{admin_id}")
@@ -631,6 +931,7 @@ async def deny_admin(admin_id: str, admin=Depends(get_current_admin)):
     result = await db.admins.delete_one({"id": admin_id, "is_approved": False})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Pending admin not found")
+    await invalidate_admin_cache(admin_id)
     return {"message": "Admin denied and removed"}
 
 # ==================== ADMIN MANAGEMENT ====================
@@ -662,7 +963,7 @@ async def create_admin(data: AdminCreate, admin=Depends(get_current_admin)):
         "id": str(uuid.uuid4()),
         "name": data.name,
         "email": data.email,
-        "password_hash": bcrypt.hashpw(data.password.encode(), bcrypt.gensalt()).decode(),
+        "password_hash": await hash_password(data.password),
         "role": data.role,
         "phone": data.phone,
         "is_approved": True,  # Auto-approve when created by admin
@@ -689,6 +990,7 @@ async def update_admin(admin_id: str, data: AdminUpdate, admin=Depends(get_curre
     result = await db.admins.update_one({"id": admin_id}, {"$set": update_data})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Admin not found")
+    await invalidate_admin_cache(admin_id)
     
     return {"message": "Admin updated successfully"}
 
@@ -701,6 +1003,7 @@ async def delete_admin(admin_id: str, admin=Depends(get_current_admin)):
     result = await db.admins.delete_one({"id": admin_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Admin not found")
+    await invalidate_admin_cache(admin_id)
     
     return {"message": "Admin deleted successfully"}
 
@@ -725,6 +1028,7 @@ async def update_account(data: AccountUpdate, admin=Depends(get_current_admin)):
             raise HTTPException(status_code=400, detail="Email already in use")
     
     await db.admins.update_one({"id": admin["id"]}, {"$set": update_data})
+    await invalidate_admin_cache(admin["id"])
     
     return {"message": "Account updated successfully"}
 
@@ -741,50 +1045,266 @@ async def change_password(data: PasswordChange, admin=Depends(get_current_admin)
         raise HTTPException(status_code=404, detail="Admin not found")
     
     # Verify current password
-    if not bcrypt.checkpw(data.current_password.encode(), admin_full["password_hash"].encode()):
+    if not await verify_password(data.current_password, admin_full["password_hash"]):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
     
     # Update password
-    new_hash = bcrypt.hashpw(data.new_password.encode(), bcrypt.gensalt()).decode()
+    new_hash = await hash_password(data.new_password)
     await db.admins.update_one({"id": admin["id"]}, {"$set": {"password_hash": new_hash}})
+    await invalidate_admin_cache(admin["id"])
     
     return {"message": "Password changed successfully"}
 
 # ==================== GLOBAL SEARCH ====================
 
+# Camper fields covered by the search index and how much a hit on each counts toward ranking
+SEARCH_FIELD_WEIGHTS = {
+    "first_name": 5,
+    "last_name": 5,
+    "father_first_name": 3,
+    "father_last_name": 3,
+    "mother_first_name": 3,
+    "mother_last_name": 3,
+    "yeshiva": 2,
+    "grade": 2,
+    "parent_email": 2,
+    "father_cell": 2,
+    "mother_cell": 2,
+}
+SEARCH_PHONE_FIELDS = ("father_cell", "mother_cell")
+SEARCH_RESULT_FIELDS = (
+    "id", "first_name", "last_name", "grade", "yeshiva", "status", "photo_url",
+    "father_first_name", "father_last_name", "mother_first_name", "mother_last_name",
+    "parent_email", "father_cell", "mother_cell", "portal_token",
+)
+# Other workers' changes arrive over Redis when it's configured; the periodic rebuild is only a backstop then.
+# Without Redis the rebuild is the only way they show up, so it runs much more often.
+SEARCH_INDEX_REFRESH_SECONDS = int(os.environ.get("SEARCH_INDEX_REFRESH_SECONDS", "300" if redis_client is not None else "30"))
+SEARCH_INDEX_CHANNEL = "campbaraisa:search-index"
+SEARCH_INDEX_OPS = ("upsert", "remove", "update_fields")
+
+_SEARCH_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def tokenize_search_text(text: str) -> List[str]:
+    return _SEARCH_TOKEN_RE.findall(text.lower())
+
+class CamperSearchIndex:
+    """In-memory inverted index over camper names, yeshiva, grade and parent contact info.
+
+    Tokens are kept in a sorted list so a prefix lookup is a bisect plus a scan over the
+    matching range, independent of roster size. Each posting carries the field weight of
+    its best-scoring source field, which drives ranking.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._sorted_tokens: List[str] = []
+        self._doc_tokens: Dict[str, Dict[str, int]] = {}
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self.ready = False
+        # Changes made while rebuild() is scanning, replayed after the swap so the snapshot doesn't undo them
+        self._changes_during_rebuild: Optional[List[tuple]] = None
+        self._rebuild_lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    @staticmethod
+    def _extract_tokens(camper: dict) -> Dict[str, int]:
+        tokens: Dict[str, int] = {}
+
+        def add(token: str, weight: int):
+            if token and tokens.get(token, 0) < weight:
+                tokens[token] = weight
+
+        for field, weight in SEARCH_FIELD_WEIGHTS.items():
+            value = camper.get(field)
+            if not value:
+                continue
+            value = str(value)
+            for token in tokenize_search_text(value):
+                add(token, weight)
+            if field == "parent_email":
+                add(value.lower(), weight)
+            elif field in SEARCH_PHONE_FIELDS:
+                add("".join(ch for ch in value if ch.isdigit()), weight)
+        return tokens
+
+    def _record(self, *change):
+        if self._changes_during_rebuild is not None:
+            self._changes_during_rebuild.append(change)
+
+    def upsert(self, camper: dict):
+        self._record("upsert", dict(camper))
+        self._upsert(camper)
+
+    def remove(self, camper_id: str):
+        self._record("remove", camper_id)
+        self._remove(camper_id)
+
+    def update_fields(self, camper_id: str, fields: dict):
+        """Apply a partial update (e.g. a status change) to an indexed camper"""
+        self._record("update_fields", camper_id, dict(fields))
+        self._update_fields(camper_id, fields)
+
+    def apply(self, changes: List[tuple]):
+        """Apply (op, *args) changes, e.g. ones broadcast by another worker"""
+        for op, *args in changes:
+            if op in SEARCH_INDEX_OPS:
+                getattr(self, op)(*args)
+
+    def _upsert(self, camper: dict):
+        camper_id = camper.get("id")
+        if not camper_id:
+            return
+        self._remove(camper_id)
+        tokens = self._extract_tokens(camper)
+        for token, weight in tokens.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                bisect.insort(self._sorted_tokens, token)
+            postings[camper_id] = weight
+        self._doc_tokens[camper_id] = tokens
+        self._docs[camper_id] = {field: camper.get(field) for field in SEARCH_RESULT_FIELDS}
+
+    def _remove(self, camper_id: str):
+        tokens = self._doc_tokens.pop(camper_id, None)
+        self._docs.pop(camper_id, None)
+        if not tokens:
+            return
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(camper_id, None)
+            if not postings:
+                del self._postings[token]
+                i = bisect.bisect_left(self._sorted_tokens, token)
+                if i < len(self._sorted_tokens) and self._sorted_tokens[i] == token:
+                    self._sorted_tokens.pop(i)
+
+    def _update_fields(self, camper_id: str, fields: dict):
+        doc = self._docs.get(camper_id)
+        if doc is None:
+            return
+        if any(field in SEARCH_FIELD_WEIGHTS for field in fields):
+            self._upsert({**doc, **fields})
+        else:
+            doc.update({k: v for k, v in fields.items() if k in SEARCH_RESULT_FIELDS})
+
+    def _match_token(self, query_token: str) -> Dict[str, int]:
+        """Scores for every camper with a token equal to or starting with query_token"""
+        scores: Dict[str, int] = {}
+        i = bisect.bisect_left(self._sorted_tokens, query_token)
+        while i < len(self._sorted_tokens) and self._sorted_tokens[i].startswith(query_token):
+            token = self._sorted_tokens[i]
+            # Whole-token matches rank above prefix completions
+            multiplier = 2 if token == query_token else 1
+            for camper_id, weight in self._postings[token].items():
+                score = weight * multiplier
+                if scores.get(camper_id, 0) < score:
+                    scores[camper_id] = score
+            i += 1
+        return scores
+
+    def search(self, query: str, limit: int = 30) -> List[Dict[str, Any]]:
+        query_tokens = tokenize_search_text(query)
+        if not query_tokens:
+            return []
+
+        # Every query token must match (AND); start from the rarest to keep intersections small
+        matches = sorted((self._match_token(t) for t in set(query_tokens)), key=len)
+        totals = dict(matches[0])
+        for scores in matches[1:]:
+            totals = {cid: total + scores[cid] for cid, total in totals.items() if cid in scores}
+            if not totals:
+                return []
+
+        top = heapq.nlargest(
+            limit,
+            totals.items(),
+            key=lambda item: (item[1], -len(self._doc_tokens.get(item[0], ()))),
+        )
+        return [self._docs[camper_id] for camper_id, _ in top]
+
+    async def rebuild(self):
+        async with self._rebuild_lock:
+            fresh = CamperSearchIndex()
+            projection = {"_id": 0, **{field: 1 for field in SEARCH_RESULT_FIELDS}}
+            self._changes_during_rebuild = []
+            try:
+                async for camper in db.campers.find({}, projection):
+                    fresh._upsert(camper)
+            finally:
+                changes, self._changes_during_rebuild = self._changes_during_rebuild, None
+            self._postings = fresh._postings
+            self._sorted_tokens = fresh._sorted_tokens
+            self._doc_tokens = fresh._doc_tokens
+            self._docs = fresh._docs
+            # The scan may have read a camper before a change made while it ran
+            for op, *args in changes:
+                getattr(self, f"_{op}")(*args)
+            self.ready = True
+
+camper_search_index = CamperSearchIndex()
+
+async def sync_search_index(*changes: tuple):
+    """Apply (op, *args) changes to this worker's search index and broadcast them to the others"""
+    camper_search_index.apply(changes)
+    if redis_client is not None:
+        # Only the indexed fields travel; that's all another worker's index keeps
+        changes = [
+            (op, {field: args[0].get(field) for field in SEARCH_RESULT_FIELDS}) if op == "upsert" else (op, *args)
+            for op, *args in changes
+        ]
+        try:
+            await redis_client.publish(SEARCH_INDEX_CHANNEL, json.dumps({"origin": WORKER_ID, "changes": changes}, default=str))
+        except Exception as e:
+            logging.error(f"Failed to broadcast search index changes: {e}")
+
+async def refresh_search_index_periodically():
+    """Rebuild the index on an interval so writes handled by other workers are picked up"""
+    while True:
+        await asyncio.sleep(SEARCH_INDEX_REFRESH_SECONDS)
+        try:
+            await camper_search_index.rebuild()
+        except Exception as e:
+            logging.error(f"Search index refresh failed: {e}")
+
 @api_router.get("/search")
-async def global_search(q: str = Query(..., min_length=2), admin=Depends(get_current_admin)):
+async def global_search(
+    q: str = Query(..., min_length=2),
+    limit: int = Query(30, ge=1, le=100),
+    admin=Depends(get_current_admin)
+):
     """Search across all campers (unified model - includes parent info)"""
-    search_query = q.lower()
-    
-    # Search campers (which now includes parent info)
-    campers = await db.campers.find({}, {"_id": 0}).to_list(1000)
+    if not camper_search_index.ready:
+        await camper_search_index.rebuild()
+
     matching_campers = []
-    for c in campers:
-        # Search in camper name, yeshiva, grade, parent info, email, phone
-        searchable = f"{c.get('first_name', '')} {c.get('last_name', '')} {c.get('yeshiva', '')} {c.get('grade', '')} {c.get('father_first_name', '')} {c.get('father_last_name', '')} {c.get('mother_first_name', '')} {c.get('mother_last_name', '')} {c.get('parent_email', '')} {c.get('father_cell', '')} {c.get('mother_cell', '')}".lower()
-        if search_query in searchable:
-            # Build parent display name
-            parent_name = f"{c.get('father_first_name', '')} {c.get('father_last_name', '')}".strip()
-            if not parent_name:
-                parent_name = f"{c.get('mother_first_name', '')} {c.get('mother_last_name', '')}".strip()
-            
-            matching_campers.append({
-                "id": c["id"],
-                "first_name": c.get("first_name"),
-                "last_name": c.get("last_name"),
-                "grade": c.get("grade"),
-                "yeshiva": c.get("yeshiva"),
-                "status": c.get("status"),
-                "photo_url": c.get("photo_url"),
-                "parent_name": parent_name,
-                "parent_email": c.get("parent_email"),
-                "parent_phone": c.get("father_cell") or c.get("mother_cell"),
-                "portal_token": c.get("portal_token")
-            })
-    
+    for c in camper_search_index.search(q, limit):
+        # Build parent display name
+        parent_name = f"{c.get('father_first_name') or ''} {c.get('father_last_name') or ''}".strip()
+        if not parent_name:
+            parent_name = f"{c.get('mother_first_name') or ''} {c.get('mother_last_name') or ''}".strip()
+
+        matching_campers.append({
+            "id": c["id"],
+            "first_name": c.get("first_name"),
+            "last_name": c.get("last_name"),
+            "grade": c.get("grade"),
+            "yeshiva": c.get("yeshiva"),
+            "status": c.get("status"),
+            "photo_url": c.get("photo_url"),
+            "parent_name": parent_name,
+            "parent_email": c.get("parent_email"),
+            "parent_phone": c.get("father_cell") or c.get("mother_cell"),
+            "portal_token": c.get("portal_token")
+        })
+
     return {
-        "campers": matching_campers[:30]  # Limit results
+        "campers": matching_campers
     }
 
 # ==================== PARENT ROUTES (DEPRECATED - Use Campers) ====================
@@ -875,6 +1395,8 @@ async def submit_application(data: ApplicationSubmission):
     }
     
     await db.campers.insert_one(camper_doc)
+    await sync_search_index(("upsert", camper_doc))
+    invalidate_dashboard_stats()
     
     # Log the activity
     await log_activity(
@@ -887,6 +1409,142 @@ async def submit_application(data: ApplicationSubmission):
     
     return {"message": "Application submitted successfully", "id": camper_doc["id"]}
 
+# ==================== TEMPLATE RENDERING ====================
+
+_MERGE_FIELD_RE = re.compile(r"\{\{\s*([A-Za-z0-9_]+)\s*\}\}")
+KNOWN_MERGE_FIELDS = frozenset(
+    item["field"].strip("{}") for group in TEMPLATE_MERGE_FIELDS.values() for item in group
+)
+# How long a worker trusts its (id, version) lookup before re-checking; edits on other workers show up within this
+TEMPLATE_CACHE_TTL_SECONDS = float(os.environ.get("TEMPLATE_CACHE_TTL_SECONDS", "5"))
+
+class CompiledTemplate:
+    """An email/SMS template split once into literal text and merge-field slots.
+
+    re.split with a capturing group yields [text, field, text, field, ..., text], so
+    rendering is a single pass that fills the odd slots.
+    """
+
+    def __init__(self, template: dict):
+        self.id = template.get("id")
+        self.version = template.get("version", 0)
+        self.name = template.get("name", "")
+        self.template_type = template.get("template_type", "email")
+        self.subject_parts = _MERGE_FIELD_RE.split(template.get("subject") or "")
+        self.body_parts = _MERGE_FIELD_RE.split(template.get("body") or "")
+
+    @staticmethod
+    def _render_parts(parts: List[str], data: Dict[str, Any]) -> str:
+        out = list(parts)
+        for i in range(1, len(parts), 2):
+            name = parts[i]
+            if name in data:
+                value = data[name]
+                out[i] = "" if value is None else str(value)
+            else:
+                # Leave fields we have no data for in place, as the old str.replace loop did
+                out[i] = "{{" + name + "}}"
+        return "".join(out)
+
+    def render(self, data: Dict[str, Any]) -> tuple:
+        return self._render_parts(self.subject_parts, data), self._render_parts(self.body_parts, data)
+
+def unknown_merge_fields(*texts: str) -> List[str]:
+    found = set()
+    for text in texts:
+        found.update(_MERGE_FIELD_RE.findall(text or ""))
+    return sorted(found - KNOWN_MERGE_FIELDS)
+
+def validate_template_fields(subject: str, body: str):
+    unknown = unknown_merge_fields(subject, body)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown merge fields: {', '.join('{{' + f + '}}' for f in unknown)}"
+        )
+
+# Compiled templates keyed by (id, version); the current (id, version) by id or trigger
+compiled_templates: Dict[tuple, CompiledTemplate] = {}
+template_cache = TTLCache(TEMPLATE_CACHE_TTL_SECONDS, max_entries=500)
+
+def compile_template(template: dict) -> CompiledTemplate:
+    key = (template.get("id"), template.get("version", 0))
+    compiled = compiled_templates.get(key)
+    if compiled is None:
+        # Older versions of the same template won't be asked for again
+        for stale in [k for k in compiled_templates if k[0] == key[0]]:
+            del compiled_templates[stale]
+        compiled = compiled_templates[key] = CompiledTemplate(template)
+    return compiled
+
+async def get_compiled_template(
+    template_id: Optional[str] = None,
+    trigger: Optional[str] = None,
+    template_type: Optional[str] = None
+) -> Optional[CompiledTemplate]:
+    """Look up a template by id or trigger (optionally of one type).
+
+    Only the template's id and version are looked up (and cached briefly); the body is
+    fetched and compiled once per version, so an edit made on any worker is picked up
+    by every worker within TEMPLATE_CACHE_TTL_SECONDS.
+    """
+    cache_key = ("id", template_id) if template_id else ("trigger", trigger, template_type)
+    cached = template_cache.get(cache_key)
+    if cached is None:
+        if template_id:
+            query = {"id": template_id}
+        else:
+            query = {"trigger": trigger}
+            if template_type:
+                query["template_type"] = template_type
+        head = await db.email_templates.find_one(query, {"_id": 0, "id": 1, "version": 1})
+        # Cache misses too, so statuses without a template don't query every time
+        cached = {"key": (head["id"], head.get("version", 0)) if head else None}
+        template_cache.set(cache_key, cached)
+    if cached["key"] is None:
+        return None
+    compiled = compiled_templates.get(cached["key"])
+    if compiled is None:
+        template = await db.email_templates.find_one({"id": cached["key"][0]}, {"_id": 0})
+        compiled = compile_template(template) if template else None
+    return compiled
+
+def invalidate_template_cache(template_id: Optional[str] = None):
+    template_cache.clear()
+    if template_id:
+        for key in [k for k in compiled_templates if k[0] == template_id]:
+            del compiled_templates[key]
+
+def camper_merge_data(camper: dict) -> Dict[str, Any]:
+    """Merge-field values that come straight from the camper (parent info is embedded)"""
+    return {
+        "camper_first_name": camper.get("first_name", ""),
+        "camper_last_name": camper.get("last_name", ""),
+        "camper_full_name": f"{camper.get('first_name', '')} {camper.get('last_name', '')}",
+        "camper_grade": camper.get("grade", ""),
+        "camper_yeshiva": camper.get("yeshiva", ""),
+        "camper_status": camper.get("status", ""),
+        "due_date": camper.get("due_date", ""),
+        "parent_father_title": camper.get("father_title", "Mr."),
+        "parent_father_first_name": camper.get("father_first_name", ""),
+        "parent_father_last_name": camper.get("father_last_name", ""),
+        "parent_father_cell": camper.get("father_cell", ""),
+        "parent_mother_first_name": camper.get("mother_first_name", ""),
+        "parent_mother_last_name": camper.get("mother_last_name", ""),
+        "parent_mother_cell": camper.get("mother_cell", ""),
+        "parent_email": camper.get("parent_email", ""),
+        "parent_address": camper.get("address", ""),
+        "payment_link": f"{os.environ.get('FRONTEND_URL', '')}/portal/{camper.get('portal_token', '')}",
+        "total_balance": f"${camper.get('total_balance', 0) or 0:,.2f}",
+    }
+
+# Camper status changes that send a templated message
+STATUS_TRIGGER_MAP = {
+    "Accepted": "status_accepted",
+    "Paid in Full": "status_paid_in_full",
+    "Invoice Sent": "invoice_sent"
+}
+
 # ==================== CAMPER ROUTES (Combined with Parent data) ====================
 
 def generate_portal_url(last_name: str) -> str:
@@ -910,6 +1568,8 @@ async def create_camper(data: CamperCreate, admin=Depends(get_current_admin)):
     }
     await db.campers.insert_one(camper_doc)
     camper_doc.pop("_id", None)
+    await sync_search_index(("upsert", camper_doc))
+    invalidate_dashboard_stats()
     camper_doc["created_at"] = datetime.fromisoformat(camper_doc["created_at"])
     
     # Log activity
@@ -925,9 +1585,14 @@ async def create_camper(data: CamperCreate, admin=Depends(get_current_admin)):
 
 @api_router.get("/campers", response_model=List[CamperResponse])
 async def get_campers(
+    response: Response,
     grade: Optional[str] = None,
     yeshiva: Optional[str] = None,
     status: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort: str = "-created_at",
+    fields: Optional[str] = None,
     admin=Depends(get_current_admin)
 ):
     query = {}
@@ -938,7 +1603,13 @@ async def get_campers(
     if status:
         query["status"] = status
     
-    campers = await db.campers.find(query, {"_id": 0}).to_list(1000)
+    campers = await paginate(
+        db.campers, query, response,
+        sort=parse_sort(sort, ("created_at", "last_name", "first_name", "status", "grade")),
+        limit=limit, cursor=cursor, fields=fields
+    )
+    if fields:
+        return projected_response(campers, response)
     for c in campers:
         c["created_at"] = datetime.fromisoformat(c["created_at"])
     return [CamperResponse(**c) for c in campers]
@@ -951,15 +1622,22 @@ async def get_camper(camper_id: str, admin=Depends(get_current_admin)):
     camper["created_at"] = datetime.fromisoformat(camper["created_at"])
     return CamperResponse(**camper)
 
+# Fields the camper form must not overwrite: balances are maintained only by the billing ledger,
+# and room back-references only by the room/allocation routes (they decide which bed to release)
+CAMPER_FORM_READONLY_FIELDS = {"total_balance", "total_paid", "room_id", "room_name"}
+
 @api_router.put("/campers/{camper_id}", response_model=CamperResponse)
 async def update_camper(camper_id: str, data: CamperBase, admin=Depends(get_current_admin)):
     result = await db.campers.update_one(
         {"id": camper_id},
-        {"$set": data.model_dump()}
+        {"$set": data.model_dump(exclude=CAMPER_FORM_READONLY_FIELDS)}
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Camper not found")
-    return await get_camper(camper_id, admin)
+    camper = await get_camper(camper_id, admin)
+    await sync_search_index(("upsert", camper.model_dump()))
+    invalidate_dashboard_stats()
+    return camper
 
 @api_router.put("/campers/{camper_id}/status")
 async def update_camper_status(
@@ -977,6 +1655,8 @@ async def update_camper_status(
     
     old_status = camper.get("status")
     await db.campers.update_one({"id": camper_id}, {"$set": {"status": status}})
+    await sync_search_index(("update_fields", camper_id, {"status": status}))
+    invalidate_dashboard_stats()
     
     # Log the activity
     await log_activity(
@@ -987,53 +1667,29 @@ async def update_camper_status(
         performed_by=admin.get("id")
     )
     
-    # Map status to trigger name
-    status_trigger_map = {
-        "Accepted": "status_accepted",
-        "Paid in Full": "status_paid_in_full",
-        "Invoice Sent": "invoice_sent"
-    }
-    
     email_triggered = False
     email_content = None
     
     # Check if there's a template for this status change
-    if status in status_trigger_map and old_status != status and not skip_email:
-        trigger_name = status_trigger_map[status]
-        template = await db.email_templates.find_one({"trigger": trigger_name}, {"_id": 0})
+    if status in STATUS_TRIGGER_MAP and old_status != status and not skip_email:
+        trigger_name = STATUS_TRIGGER_MAP[status]
+        template = await get_compiled_template(trigger=trigger_name)
         
         if template:
             # Render template with camper data
-            subject = template.get("subject", "")
-            body = template.get("body", "")
-            
-            # Replace merge fields
-            merge_data = {
-                "camper_first_name": camper.get("first_name", ""),
-                "camper_last_name": camper.get("last_name", ""),
-                "camper_full_name": f"{camper.get('first_name', '')} {camper.get('last_name', '')}",
-                "parent_father_first_name": camper.get("father_first_name", ""),
-                "parent_father_last_name": camper.get("father_last_name", ""),
-                "parent_email": camper.get("parent_email", ""),
-                "parent_father_cell": camper.get("father_cell", ""),
-                "status": status
-            }
-            
-            for key, value in merge_data.items():
-                subject = subject.replace("{{" + key + "}}", str(value))
-                body = body.replace("{{" + key + "}}", str(value))
+            subject, body = template.render({**camper_merge_data(camper), "camper_status": status, "status": status})
             
             comm_doc = {
                 "id": str(uuid.uuid4()),
                 "camper_id": camper_id,
-                "type": template.get("template_type", "email"),
+                "type": template.template_type,
                 "subject": subject,
                 "message": body,
                 "direction": "outbound",
                 "status": "pending",
                 "recipient_email": camper.get("parent_email"),
                 "recipient_phone": camper.get("father_cell") or camper.get("mother_cell"),
-                "template_id": template.get("id"),
+                "template_id": template.id,
                 "created_at": datetime.now(timezone.utc).isoformat()
             }
             await db.communications.insert_one(comm_doc)
@@ -1042,7 +1698,7 @@ async def update_camper_status(
                 entity_type="camper",
                 entity_id=camper_id,
                 action="email_queued",
-                details={"type": trigger_name, "email_id": comm_doc["id"], "template_name": template.get("name")},
+                details={"type": trigger_name, "email_id": comm_doc["id"], "template_name": template.name},
                 performed_by=admin.get("id")
             )
             
@@ -1055,6 +1711,103 @@ async def update_camper_status(
         "email_content": email_content
     }
 
+BULK_STATUS_MAX_CAMPERS = 1000
+
+class BulkStatusUpdate(BaseModel):
+    camper_ids: List[str]
+    status: str
+    skip_email: bool = False
+
+@api_router.post("/campers/status:bulk")
+async def bulk_update_camper_status(data: BulkStatusUpdate, admin=Depends(get_current_admin)):
+    """Move many campers to one status with a single update, template render pass and batched inserts"""
+    if data.status not in KANBAN_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Invalid status. Must be one of: {KANBAN_STATUSES}")
+    camper_ids = list(dict.fromkeys(data.camper_ids))
+    if len(camper_ids) > BULK_STATUS_MAX_CAMPERS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_STATUS_MAX_CAMPERS} campers per request")
+    
+    campers = await db.campers.find({"id": {"$in": camper_ids}}, {"_id": 0}).to_list(None)
+    campers_by_id = {c["id"]: c for c in campers}
+    to_change = [campers_by_id[cid] for cid in camper_ids if cid in campers_by_id and campers_by_id[cid].get("status") != data.status]
+    
+    if to_change:
+        await db.campers.update_many(
+            {"id": {"$in": [c["id"] for c in to_change]}, "status": {"$ne": data.status}},
+            {"$set": {"status": data.status}}
+        )
+        await sync_search_index(*[("update_fields", camper["id"], {"status": data.status}) for camper in to_change])
+        invalidate_dashboard_stats()
+    
+    template = None
+    trigger_name = STATUS_TRIGGER_MAP.get(data.status)
+    if trigger_name and to_change and not data.skip_email:
+        template = await get_compiled_template(trigger=trigger_name)
+    
+    now = datetime.now(timezone.utc).isoformat()
+    activity_entries = []
+    comm_docs = []
+    queued = set()
+    for camper in to_change:
+        activity_entries.append({
+            "entity_type": "camper",
+            "entity_id": camper["id"],
+            "action": "status_changed",
+            "details": {"old_status": camper.get("status"), "new_status": data.status, "bulk": True},
+            "performed_by": admin.get("id")
+        })
+        if template:
+            subject, body = template.render({**camper_merge_data(camper), "camper_status": data.status, "status": data.status})
+            comm_doc = {
+                "id": str(uuid.uuid4()),
+                "camper_id": camper["id"],
+                "type": template.template_type,
+                "subject": subject,
+                "message": body,
+                "direction": "outbound",
+                "status": "pending",
+                "recipient_email": camper.get("parent_email"),
+                "recipient_phone": camper.get("father_cell") or camper.get("mother_cell"),
+                "template_id": template.id,
+                "created_at": now
+            }
+            comm_docs.append(comm_doc)
+            queued.add(camper["id"])
+            activity_entries.append({
+                "entity_type": "camper",
+                "entity_id": camper["id"],
+                "action": "email_queued",
+                "details": {"type": trigger_name, "email_id": comm_doc["id"], "template_name": template.name},
+                "performed_by": admin.get("id")
+            })
+    
+    if comm_docs:
+        await db.communications.insert_many(comm_docs, ordered=False)
+    await log_activities(activity_entries)
+    
+    results = []
+    for camper_id in camper_ids:
+        camper = campers_by_id.get(camper_id)
+        if camper is None:
+            results.append({"camper_id": camper_id, "updated": False, "error": "Camper not found"})
+            continue
+        results.append({
+            "camper_id": camper_id,
+            "old_status": camper.get("status"),
+            "new_status": data.status,
+            "updated": camper.get("status") != data.status,
+            "email_queued": camper_id in queued
+        })
+    
+    return {
+        "message": f"Status updated to {data.status}",
+        "updated": len(to_change),
+        "unchanged": len(campers) - len(to_change),
+        "not_found": len(camper_ids) - len(campers),
+        "emails_queued": len(comm_docs),
+        "results": results
+    }
+
 # Get email preview for status change (used by confirmation popup)
 @api_router.get("/campers/{camper_id}/email-preview")
 async def get_status_email_preview(
@@ -1067,44 +1820,21 @@ async def get_status_email_preview(
     if not camper:
         raise HTTPException(status_code=404, detail="Camper not found")
     
-    status_trigger_map = {
-        "Accepted": "status_accepted",
-        "Paid in Full": "status_paid_in_full",
-        "Invoice Sent": "invoice_sent"
-    }
-    
-    if new_status not in status_trigger_map:
+    if new_status not in STATUS_TRIGGER_MAP:
         return {"has_template": False, "subject": "", "body": ""}
     
-    trigger_name = status_trigger_map[new_status]
-    template = await db.email_templates.find_one({"trigger": trigger_name}, {"_id": 0})
+    template = await get_compiled_template(trigger=STATUS_TRIGGER_MAP[new_status])
     
     if not template:
         return {"has_template": False, "subject": "", "body": ""}
     
     # Render template with camper data
-    subject = template.get("subject", "")
-    body = template.get("body", "")
-    
-    merge_data = {
-        "camper_first_name": camper.get("first_name", ""),
-        "camper_last_name": camper.get("last_name", ""),
-        "camper_full_name": f"{camper.get('first_name', '')} {camper.get('last_name', '')}",
-        "parent_father_first_name": camper.get("father_first_name", ""),
-        "parent_father_last_name": camper.get("father_last_name", ""),
-        "parent_email": camper.get("parent_email", ""),
-        "parent_father_cell": camper.get("father_cell", ""),
-        "status": new_status
-    }
-    
-    for key, value in merge_data.items():
-        subject = subject.replace("{{" + key + "}}", str(value))
-        body = body.replace("{{" + key + "}}", str(value))
+    subject, body = template.render({**camper_merge_data(camper), "camper_status": new_status, "status": new_status})
     
     return {
         "has_template": True,
-        "template_name": template.get("name", ""),
-        "template_type": template.get("template_type", "email"),
+        "template_name": template.name,
+        "template_type": template.template_type,
         "subject": subject,
         "body": body,
         "recipient_email": camper.get("parent_email"),
@@ -1125,6 +1855,8 @@ async def delete_camper(camper_id: str, admin=Depends(get_current_admin)):
     
     # Remove from campers
     await db.campers.delete_one({"id": camper_id})
+    await sync_search_index(("remove", camper_id))
+    invalidate_dashboard_stats()
     
     # Log activity
     await log_activity(
@@ -1138,9 +1870,18 @@ async def delete_camper(camper_id: str, admin=Depends(get_current_admin)):
     return {"message": "Camper moved to trash"}
 
 @api_router.get("/campers/trash/list")
-async def get_trash(admin=Depends(get_current_admin)):
+async def get_trash(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    admin=Depends(get_current_admin)
+):
     """Get all campers in trash"""
-    trash = await db.campers_trash.find({}, {"_id": 0}).sort("deleted_at", -1).to_list(1000)
+    trash = await paginate(
+        db.campers_trash, {}, response,
+        sort=("deleted_at", DESCENDING), limit=limit, cursor=cursor, fields=fields
+    )
     return trash
 
 @api_router.post("/campers/trash/{camper_id}/restore")
@@ -1157,6 +1898,8 @@ async def restore_camper(camper_id: str, admin=Depends(get_current_admin)):
     # Restore to campers
     await db.campers.insert_one(camper)
     await db.campers_trash.delete_one({"id": camper_id})
+    await sync_search_index(("upsert", camper))
+    invalidate_dashboard_stats()
     
     # Log activity
     await log_activity(
@@ -1241,39 +1984,328 @@ async def delete_fee(fee_id: str, admin=Depends(get_current_admin)):
 
 # ==================== KANBAN ROUTES ====================
 
+# Fields the Kanban cards render; everything else stays on the server
+KANBAN_CARD_FIELDS = [
+    "id", "first_name", "last_name", "photo_url", "grade", "yeshiva", "status", "due_date",
+    "parent_email", "father_title", "father_first_name", "father_last_name", "father_cell",
+    "mother_first_name", "mother_last_name", "mother_cell", "created_at",
+]
+
+def kanban_column_pipeline(status: str, skip: int, limit: Optional[int]) -> List[dict]:
+    """Facet stages for one column: page the campers and project the card fields"""
+    stages = [{"$match": {"status": status}}, {"$sort": {"created_at": 1, "id": 1}}]
+    if skip:
+        stages.append({"$skip": skip})
+    if limit:
+        stages.append({"$limit": limit})
+    # Balances are materialized on the camper by the billing ledger, so no invoice join is needed
+    stages.append({"$project": {
+        "_id": 0,
+        **{field: 1 for field in KANBAN_CARD_FIELDS},
+        "balance": {"$subtract": [{"$ifNull": ["$total_balance", 0]}, {"$ifNull": ["$total_paid", 0]}]}
+    }})
+    return stages
+
 @api_router.get("/kanban")
-async def get_kanban_board(admin=Depends(get_current_admin)):
-    campers = await db.campers.find({}, {"_id": 0}).to_list(1000)
-    
-    # Get invoice info for balance calculation
-    invoices = await db.invoices.find({}, {"_id": 0}).to_list(1000)
-    
-    board = {status: [] for status in KANBAN_STATUSES}
-    
-    for camper in campers:
-        # Calculate balance from invoices
-        camper_invoices = [i for i in invoices if i.get("camper_id") == camper["id"]]
-        total_due = sum(i.get("amount", 0) for i in camper_invoices)
-        total_paid = sum(i.get("paid_amount", 0) for i in camper_invoices)
-        balance = total_due - total_paid
-        
-        # Use embedded parent info from camper
-        parent_name = f"{camper.get('father_title', '')} {camper.get('father_first_name', '')} {camper.get('father_last_name', '')}".strip()
-        if not parent_name or parent_name == "":
-            parent_name = f"{camper.get('mother_first_name', '')} {camper.get('mother_last_name', '')}".strip()
-        
-        camper_data = {
-            **camper,
-            "parent_name": parent_name,
-            "parent_email": camper.get("parent_email", ""),
-            "parent_phone": camper.get("father_cell") or camper.get("mother_cell") or "",
-            "balance": balance
-        }
-        status = camper.get("status", "Applied")
-        if status in board:
-            board[status].append(camper_data)
-    
-    return {"statuses": KANBAN_STATUSES, "board": board}
+async def get_kanban_board(
+    status: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    skip: int = Query(0, ge=0),
+    admin=Depends(get_current_admin)
+):
+    """Build the board in one aggregation: per-column pages with each camper's outstanding balance.
+
+    limit/skip page every column (or only `status` when given); counts are always the column totals.
+    """
+    if status and status not in KANBAN_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Invalid status. Must be one of: {KANBAN_STATUSES}")
+    statuses = [status] if status else KANBAN_STATUSES
+
+    facets = {f"column_{i}": kanban_column_pipeline(s, skip, limit) for i, s in enumerate(statuses)}
+    facets["counts"] = [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+    pipeline = [{"$match": {"status": {"$in": statuses}}}, {"$facet": facets}]
+
+    result = await db.campers.aggregate(pipeline).to_list(1)
+    facet_result = result[0] if result else {}
+
+    board = {}
+    for i, column_status in enumerate(statuses):
+        cards = []
+        for camper in facet_result.get(f"column_{i}", []):
+            # Use embedded parent info from camper
+            parent_name = f"{camper.get('father_title') or ''} {camper.get('father_first_name') or ''} {camper.get('father_last_name') or ''}".strip()
+            if not parent_name:
+                parent_name = f"{camper.get('mother_first_name') or ''} {camper.get('mother_last_name') or ''}".strip()
+            cards.append({
+                **camper,
+                "parent_name": parent_name,
+                "parent_email": camper.get("parent_email") or "",
+                "parent_phone": camper.get("father_cell") or camper.get("mother_cell") or "",
+            })
+        board[column_status] = cards
+
+    counts = {s: 0 for s in statuses}
+    for row in facet_result.get("counts", []):
+        counts[row["_id"]] = row["count"]
+
+    return {"statuses": KANBAN_STATUSES, "board": board, "counts": counts}
+
+# ==================== SEQUENCES ====================
+
+# Counters live in db.counters as {"_id": name, "value": last number handed out}
+seeded_sequences: set = set()
+
+async def reserve_sequence(name: str, count: int = 1, floor: Optional[int] = None) -> int:
+    """Atomically reserve `count` consecutive numbers from a named counter; returns the first.
+
+    `floor` seeds a new counter so numbering continues after data that predates it; $max makes
+    seeding idempotent and it can never move a counter backwards.
+    """
+    if floor is not None and name not in seeded_sequences:
+        await db.counters.update_one({"_id": name}, {"$max": {"value": floor}}, upsert=True)
+        seeded_sequences.add(name)
+    counter = await db.counters.find_one_and_update(
+        {"_id": name},
+        {"$inc": {"value": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["value"] - count + 1
+
+def format_invoice_number(year: int, number: int) -> str:
+    return f"INV-{year}-{str(number).zfill(5)}"
+
+async def highest_invoice_number(year: int) -> int:
+    """Largest number already issued for a year (numbers are zero-padded, so the index order is numeric)"""
+    latest = await db.invoices.find_one(
+        {"invoice_number": {"$regex": f"^INV-{year}-"}},
+        {"_id": 0, "invoice_number": 1},
+        sort=[("invoice_number", DESCENDING)]
+    )
+    if not latest:
+        return 0
+    try:
+        return int(latest["invoice_number"].rsplit("-", 1)[1])
+    except ValueError:
+        return 0
+
+async def reserve_invoice_numbers(count: int = 1) -> List[str]:
+    """Reserve a block of invoice numbers from this year's sequence"""
+    year = datetime.now(timezone.utc).year
+    name = f"invoice_number:{year}"
+    floor = None if name in seeded_sequences else await highest_invoice_number(year)
+    first = await reserve_sequence(name, count, floor=floor)
+    return [format_invoice_number(year, n) for n in range(first, first + count)]
+
+# ==================== BILLING LEDGER ====================
+
+# Every money movement appends a ledger entry and applies the same deltas to the camper:
+#   charge -> camper.total_balance (amount billed), paid -> camper.total_paid
+RECONCILE_RUN_HOUR_UTC = int(os.environ.get("RECONCILE_RUN_HOUR_UTC", "7"))
+RECONCILE_APPLY = os.environ.get("RECONCILE_APPLY", "true").lower() == "true"
+# Campers with ledger activity this recent are reported but not corrected (their writes may be in flight)
+RECONCILE_SETTLE_SECONDS = 300
+BALANCE_TOLERANCE = 0.005
+
+def invoice_charge(invoice: dict) -> float:
+    """What an invoice contributes to total_balance; a deleted invoice keeps only what was paid on it"""
+    amount = invoice.get("amount") or 0
+    if invoice.get("is_deleted"):
+        return min(amount, invoice.get("paid_amount") or 0)
+    return amount
+
+async def record_ledger_entry(
+    camper_id: Optional[str],
+    entry_type: str,
+    charge: float = 0.0,
+    paid: float = 0.0,
+    invoice_id: Optional[str] = None,
+    payment_id: Optional[str] = None,
+    details: Optional[dict] = None,
+    performed_by: Optional[str] = None
+) -> Optional[dict]:
+    """Append a ledger entry and apply it to the camper's materialized balances"""
+    if not camper_id or (not charge and not paid):
+        return None
+    entry = {
+        "id": str(uuid.uuid4()),
+        "camper_id": camper_id,
+        "entry_type": entry_type,
+        "charge": round(charge, 2),
+        "paid": round(paid, 2),
+        "invoice_id": invoice_id,
+        "payment_id": payment_id,
+        "details": details or {},
+        "performed_by": performed_by,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.ledger_entries.insert_one(entry)
+    await db.campers.update_one(
+        {"id": camper_id},
+        {"$inc": {"total_balance": entry["charge"], "total_paid": entry["paid"]}}
+    )
+    invalidate_dashboard_stats()
+    entry.pop("_id", None)
+    return entry
+
+async def record_ledger_entries(entries: List[dict]) -> List[dict]:
+    """Batch form of record_ledger_entry: one insert_many plus one bulk_write of camper increments"""
+    now = datetime.now(timezone.utc).isoformat()
+    docs = [{
+        "id": str(uuid.uuid4()),
+        "camper_id": e["camper_id"],
+        "entry_type": e["entry_type"],
+        "charge": round(e.get("charge", 0.0), 2),
+        "paid": round(e.get("paid", 0.0), 2),
+        "invoice_id": e.get("invoice_id"),
+        "payment_id": e.get("payment_id"),
+        "details": e.get("details") or {},
+        "performed_by": e.get("performed_by"),
+        "created_at": now
+    } for e in entries if e.get("camper_id") and (e.get("charge") or e.get("paid"))]
+    if not docs:
+        return []
+    await db.ledger_entries.insert_many(docs, ordered=False)
+    await db.campers.bulk_write([
+        UpdateOne({"id": d["camper_id"]}, {"$inc": {"total_balance": d["charge"], "total_paid": d["paid"]}})
+        for d in docs
+    ], ordered=False)
+    invalidate_dashboard_stats()
+    for d in docs:
+        d.pop("_id", None)
+    return docs
+
+async def reconcile_camper_balances(apply: bool = False) -> Dict[str, Any]:
+    """Rebuild every camper's balances from invoices and compare with the camper fields and the ledger.
+
+    With apply=True, ledger gaps get an opening_balance/reconciliation_adjustment entry and camper
+    fields are corrected with a compare-and-swap, so concurrent payments are never overwritten.
+    """
+    started = datetime.now(timezone.utc)
+    invoices = await db.invoices.find(
+        {"camper_id": {"$ne": None}}, {"_id": 0, "camper_id": 1, "amount": 1, "paid_amount": 1, "is_deleted": 1}
+    ).to_list(None)
+    ledger = await db.ledger_entries.aggregate([
+        {"$group": {"_id": "$camper_id", "ledger_charge": {"$sum": "$charge"},
+                    "ledger_paid": {"$sum": "$paid"}, "ledger_entries": {"$sum": 1}}}
+    ]).to_list(None)
+    campers = await db.campers.find({}, {"_id": 0, "id": 1, "total_balance": 1, "total_paid": 1}).to_list(None)
+    if not campers:
+        return {"campers_checked": 0, "camper_drift": [], "ledger_drift": [], "applied": apply}
+
+    inv = pd.DataFrame(invoices, columns=["camper_id", "amount", "paid_amount", "is_deleted"])
+    amount = pd.to_numeric(inv["amount"], errors="coerce").fillna(0.0)
+    paid_amount = pd.to_numeric(inv["paid_amount"], errors="coerce").fillna(0.0)
+    deleted = inv["is_deleted"].fillna(False).astype(bool)
+    inv["expected_balance"] = np.where(deleted, np.minimum(amount, paid_amount), amount)
+    inv["expected_paid"] = paid_amount
+    expected = inv.groupby("camper_id")[["expected_balance", "expected_paid"]].sum()
+
+    frame = pd.DataFrame(campers, columns=["id", "total_balance", "total_paid"]).set_index("id")
+    frame = frame.join(expected, how="left")
+    frame = frame.join(pd.DataFrame(ledger, columns=["_id", "ledger_charge", "ledger_paid", "ledger_entries"]).set_index("_id"), how="left")
+    frame[["expected_balance", "expected_paid", "ledger_charge", "ledger_paid", "ledger_entries"]] = \
+        frame[["expected_balance", "expected_paid", "ledger_charge", "ledger_paid", "ledger_entries"]].fillna(0)
+    frame["current_balance"] = pd.to_numeric(frame["total_balance"], errors="coerce").fillna(0.0)
+    frame["current_paid"] = pd.to_numeric(frame["total_paid"], errors="coerce").fillna(0.0)
+
+    camper_drift = frame[
+        ((frame["current_balance"] - frame["expected_balance"]).abs() > BALANCE_TOLERANCE)
+        | ((frame["current_paid"] - frame["expected_paid"]).abs() > BALANCE_TOLERANCE)
+    ]
+    ledger_drift = frame[
+        ((frame["ledger_charge"] - frame["expected_balance"]).abs() > BALANCE_TOLERANCE)
+        | ((frame["ledger_paid"] - frame["expected_paid"]).abs() > BALANCE_TOLERANCE)
+    ]
+
+    def drift_rows(rows: pd.DataFrame, balance_col: str, paid_col: str) -> List[dict]:
+        return [{
+            "camper_id": camper_id,
+            "balance": round(float(row[balance_col]), 2),
+            "expected_balance": round(float(row["expected_balance"]), 2),
+            "paid": round(float(row[paid_col]), 2),
+            "expected_paid": round(float(row["expected_paid"]), 2),
+        } for camper_id, row in rows.iterrows()]
+
+    report = {
+        "campers_checked": len(frame),
+        "camper_drift": drift_rows(camper_drift, "current_balance", "current_paid"),
+        "ledger_drift": drift_rows(ledger_drift, "ledger_charge", "ledger_paid"),
+        "applied": apply
+    }
+    if not apply or (camper_drift.empty and ledger_drift.empty):
+        return report
+
+    settle_since = (started - timedelta(seconds=RECONCILE_SETTLE_SECONDS)).isoformat()
+    recent = set(await db.ledger_entries.distinct("camper_id", {"created_at": {"$gte": settle_since}}))
+    now = datetime.now(timezone.utc).isoformat()
+
+    ledger_docs = []
+    for camper_id, row in ledger_drift.iterrows():
+        if camper_id in recent:
+            continue
+        ledger_docs.append({
+            "id": str(uuid.uuid4()),
+            "camper_id": camper_id,
+            "entry_type": "reconciliation_adjustment" if row["ledger_entries"] else "opening_balance",
+            "charge": round(float(row["expected_balance"] - row["ledger_charge"]), 2),
+            "paid": round(float(row["expected_paid"] - row["ledger_paid"]), 2),
+            "invoice_id": None,
+            "payment_id": None,
+            "details": {"reconciled_at": now},
+            "performed_by": "system",
+            "created_at": now
+        })
+    if ledger_docs:
+        await db.ledger_entries.insert_many(ledger_docs, ordered=False)
+
+    def stored(value):
+        return None if pd.isna(value) else float(value)
+
+    camper_updates = [
+        UpdateOne(
+            # Only correct the value we read; a concurrent $inc makes this a no-op until the next run
+            {"id": camper_id, "total_balance": stored(row["total_balance"]), "total_paid": stored(row["total_paid"])},
+            {"$set": {"total_balance": round(float(row["expected_balance"]), 2),
+                      "total_paid": round(float(row["expected_paid"]), 2)}}
+        )
+        for camper_id, row in camper_drift.iterrows() if camper_id not in recent
+    ]
+    corrected = 0
+    if camper_updates:
+        result = await db.campers.bulk_write(camper_updates, ordered=False)
+        corrected = result.modified_count
+
+    report.update({
+        "ledger_adjustments": len(ledger_docs),
+        "campers_corrected": corrected,
+        "skipped_recent": sorted(recent & (set(camper_drift.index) | set(ledger_drift.index)))
+    })
+    return report
+
+@api_router.post("/billing/reconcile")
+async def reconcile_balances(apply: bool = False, admin=Depends(get_current_admin)):
+    """Report (and with apply=true, repair) drift between invoices, the ledger and camper balances"""
+    if not apply:
+        return await reconcile_camper_balances(apply=False)
+    result = await run_job_now("balance_reconciliation", lambda: reconcile_camper_balances(apply=True))
+    if result is None:
+        raise HTTPException(status_code=409, detail="Reconciliation is already running on another worker")
+    return result
+
+@api_router.get("/campers/{camper_id}/ledger")
+async def get_camper_ledger(
+    camper_id: str,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    admin=Depends(get_current_admin)
+):
+    """Ledger entries behind a camper's total_balance / total_paid, oldest first"""
+    return await paginate(
+        db.ledger_entries, {"camper_id": camper_id}, response,
+        sort=("created_at", ASCENDING), limit=limit, cursor=cursor
+    )
 
 # ==================== INVOICE ROUTES ====================
 
@@ -1284,8 +2316,9 @@ REMINDER_SCHEDULE = {
     "post_due": [3, 7, 15]  # Days after due date
 }
 
-def calculate_next_reminder(due_date_str: str, reminder_sent_dates: List[str]) -> Optional[str]:
+def calculate_next_reminder(due_date_str: str, reminder_sent_dates: List[str], schedule: Optional[dict] = None) -> Optional[str]:
     """Calculate when the next reminder should be sent"""
+    schedule = schedule or REMINDER_SCHEDULE
     if not due_date_str:
         return None
     
@@ -1298,7 +2331,7 @@ def calculate_next_reminder(due_date_str: str, reminder_sent_dates: List[str]) -
     days_until_due = (due_date - today).days
     
     # Check pre-due reminders (every 15 days before)
-    for days_before in sorted(REMINDER_SCHEDULE["pre_due"], reverse=True):
+    for days_before in sorted(schedule["pre_due"], reverse=True):
         reminder_date = due_date - timedelta(days=days_before)
         if reminder_date >= today and reminder_date.isoformat() not in reminder_sent_dates:
             return reminder_date.isoformat()
@@ -1308,22 +2341,22 @@ def calculate_next_reminder(due_date_str: str, reminder_sent_dates: List[str]) -
         return due_date.isoformat()
     
     # Check post-due reminders
-    for days_after in REMINDER_SCHEDULE["post_due"]:
+    for days_after in schedule["post_due"]:
         reminder_date = due_date + timedelta(days=days_after)
         if reminder_date >= today and reminder_date.isoformat() not in reminder_sent_dates:
             return reminder_date.isoformat()
     
     return None
 
-@api_router.post("/invoices", response_model=InvoiceResponse)
-async def create_invoice(data: InvoiceCreate, admin=Depends(get_current_admin)):
+def build_invoice_doc(data: InvoiceCreate, invoice_number: str) -> dict:
+    """Invoice document (with optional installment plan) for one camper"""
     # Calculate default due date (90 days from now) if not provided
     if not data.due_date:
         default_due = datetime.now(timezone.utc) + timedelta(days=90)
         data.due_date = default_due.strftime("%Y-%m-%d")
     
     # Calculate total from line items or use single amount
-    line_items = data.line_items or []
+    line_items = [item.model_copy() for item in data.line_items or []]
     if line_items:
         total_amount = sum(item.amount * item.quantity for item in line_items)
         # Assign IDs to line items
@@ -1336,10 +2369,6 @@ async def create_invoice(data: InvoiceCreate, admin=Depends(get_current_admin)):
     # Apply discount
     final_amount = total_amount - (data.discount_amount or 0)
     
-    # Generate invoice number
-    count = await db.invoices.count_documents({})
-    invoice_number = f"INV-{datetime.now().year}-{str(count + 1).zfill(5)}"
-    
     # Generate portal token
     portal_token = secrets.token_urlsafe(32)
     
@@ -1398,12 +2427,21 @@ async def create_invoice(data: InvoiceCreate, admin=Depends(get_current_admin)):
             "schedule": schedule
         }
     
+    return invoice_doc
+
+@api_router.post("/invoices", response_model=InvoiceResponse)
+async def create_invoice(data: InvoiceCreate, admin=Depends(get_current_admin)):
+    # Generate invoice number
+    invoice_number = (await reserve_invoice_numbers(1))[0]
+    invoice_doc = build_invoice_doc(data, invoice_number)
+    final_amount = invoice_doc["amount"]
+    
     await db.invoices.insert_one(invoice_doc)
     
     # Update camper balance
-    await db.campers.update_one(
-        {"id": data.camper_id},
-        {"$inc": {"total_balance": final_amount}}
+    await record_ledger_entry(
+        data.camper_id, "invoice_created", charge=final_amount,
+        invoice_id=invoice_doc["id"], performed_by=admin.get("id")
     )
     
     # Log activity
@@ -1426,11 +2464,73 @@ async def create_invoice(data: InvoiceCreate, admin=Depends(get_current_admin)):
     invoice_doc["created_at"] = datetime.fromisoformat(invoice_doc["created_at"])
     return InvoiceResponse(**invoice_doc)
 
+MAX_BATCH_INVOICES = 1000
+
+@api_router.post("/invoices/batch")
+async def create_invoices_batch(data: InvoiceBatchCreate, admin=Depends(get_current_admin)):
+    """Issue the same invoice to many campers, numbering them from one reserved block"""
+    camper_ids = list(dict.fromkeys(data.camper_ids))
+    if not camper_ids:
+        raise HTTPException(status_code=400, detail="camper_ids is required")
+    if len(camper_ids) > MAX_BATCH_INVOICES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_INVOICES} invoices per batch")
+    
+    found = set(await db.campers.distinct("id", {"id": {"$in": camper_ids}}))
+    missing = [cid for cid in camper_ids if cid not in found]
+    camper_ids = [cid for cid in camper_ids if cid in found]
+    if not camper_ids:
+        raise HTTPException(status_code=404, detail="None of the campers were found")
+    
+    invoice_numbers = await reserve_invoice_numbers(len(camper_ids))
+    invoice_docs = [
+        build_invoice_doc(data.model_copy(update={"camper_id": camper_id}), number)
+        for camper_id, number in zip(camper_ids, invoice_numbers)
+    ]
+    await db.invoices.insert_many(invoice_docs, ordered=False)
+    
+    await record_ledger_entries([
+        {"camper_id": inv["camper_id"], "entry_type": "invoice_created", "charge": inv["amount"],
+         "invoice_id": inv["id"], "performed_by": admin.get("id")}
+        for inv in invoice_docs
+    ])
+    await log_activities([
+        {
+            "entity_type": "camper",
+            "entity_id": inv["camper_id"],
+            "action": "invoice_created",
+            "details": {
+                "invoice_id": inv["id"],
+                "invoice_number": inv["invoice_number"],
+                "amount": inv["amount"],
+                "due_date": inv["due_date"],
+                "description": inv["description"],
+                "has_installments": data.create_installments,
+                "batch": True
+            },
+            "performed_by": admin.get("id")
+        }
+        for inv in invoice_docs
+    ])
+    
+    return {
+        "created": len(invoice_docs),
+        "missing_campers": missing,
+        "invoices": [
+            {"id": inv["id"], "camper_id": inv["camper_id"], "invoice_number": inv["invoice_number"], "amount": inv["amount"]}
+            for inv in invoice_docs
+        ]
+    }
+
 @api_router.get("/invoices")
 async def get_invoices(
+    response: Response,
     camper_id: Optional[str] = None,
     status: Optional[str] = None,
     include_deleted: bool = False,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort: str = "-created_at",
+    fields: Optional[str] = None,
     admin=Depends(get_current_admin)
 ):
     query = {}
@@ -1441,7 +2541,13 @@ async def get_invoices(
     if status:
         query["status"] = status
     
-    invoices = await db.invoices.find(query, {"_id": 0}).to_list(1000)
+    invoices = await paginate(
+        db.invoices, query, response,
+        sort=parse_sort(sort, ("created_at", "due_date", "invoice_number", "status")),
+        limit=limit, cursor=cursor, fields=fields
+    )
+    if fields:
+        return invoices
     for inv in invoices:
         if inv.get("created_at"):
             try:
@@ -1556,10 +2662,22 @@ async def update_invoice(invoice_id: str, data: dict, admin=Depends(get_current_
         update_data["amount"] = total - discount
     
     if update_data:
-        await db.invoices.update_one({"id": invoice_id}, {"$set": update_data})
+        updated = await db.invoices.find_one_and_update(
+            {"id": invoice_id}, {"$set": update_data},
+            projection={"_id": 0}, return_document=ReturnDocument.AFTER
+        )
+        if not updated:
+            raise HTTPException(status_code=404, detail="Invoice not found")
+        if "amount" in update_data:
+            delta = invoice_charge(updated) - invoice_charge(invoice)
+            await record_ledger_entry(
+                invoice["camper_id"], "invoice_adjusted", charge=delta, invoice_id=invoice_id,
+                details={"old_amount": invoice.get("amount"), "new_amount": updated.get("amount")},
+                performed_by=admin.get("id")
+            )
+        return updated
     
-    updated = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
-    return updated
+    return invoice
 
 @api_router.post("/invoices/{invoice_id}/send")
 async def send_invoice(invoice_id: str, admin=Depends(get_current_admin)):
@@ -1610,19 +2728,20 @@ async def delete_invoice(invoice_id: str, admin=Depends(get_current_admin)):
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
-    # Soft delete - mark as deleted
-    await db.invoices.update_one(
-        {"id": invoice_id},
-        {"$set": {"is_deleted": True, "deleted_at": datetime.now(timezone.utc).isoformat()}}
+    # Soft delete - mark as deleted (only once, so the balance is only reduced once)
+    deleted = await db.invoices.find_one_and_update(
+        {"id": invoice_id, "is_deleted": {"$ne": True}},
+        {"$set": {"is_deleted": True, "deleted_at": datetime.now(timezone.utc).isoformat()}},
+        projection={"_id": 0}, return_document=ReturnDocument.AFTER
     )
+    if not deleted:
+        return {"message": "Invoice deleted"}
     
-    # Reduce camper balance
-    unpaid = invoice["amount"] - invoice.get("paid_amount", 0)
-    if unpaid > 0:
-        await db.campers.update_one(
-            {"id": invoice["camper_id"]},
-            {"$inc": {"total_balance": -unpaid}}
-        )
+    # Reduce camper balance by whatever was still unpaid
+    await record_ledger_entry(
+        invoice["camper_id"], "invoice_deleted", charge=invoice_charge(deleted) - invoice_charge(invoice),
+        invoice_id=invoice_id, performed_by=admin.get("id")
+    )
     
     await log_activity(
         entity_type="camper",
@@ -1635,30 +2754,37 @@ async def delete_invoice(invoice_id: str, admin=Depends(get_current_admin)):
     return {"message": "Invoice deleted"}
 
 @api_router.get("/invoices/trash/list")
-async def list_deleted_invoices(admin=Depends(get_current_admin)):
+async def list_deleted_invoices(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    admin=Depends(get_current_admin)
+):
     """Get all deleted invoices"""
-    invoices = await db.invoices.find({"is_deleted": True}, {"_id": 0}).to_list(1000)
+    invoices = await paginate(
+        db.invoices, {"is_deleted": True}, response,
+        sort=("created_at", DESCENDING), limit=limit, cursor=cursor, fields=fields
+    )
     return invoices
 
 @api_router.post("/invoices/{invoice_id}/restore")
 async def restore_invoice(invoice_id: str, admin=Depends(get_current_admin)):
     """Restore a deleted invoice"""
-    invoice = await db.invoices.find_one({"id": invoice_id, "is_deleted": True}, {"_id": 0})
+    invoice = await db.invoices.find_one_and_update(
+        {"id": invoice_id, "is_deleted": True},
+        {"$set": {"is_deleted": False}, "$unset": {"deleted_at": ""}},
+        projection={"_id": 0}, return_document=ReturnDocument.BEFORE
+    )
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found in trash")
     
-    await db.invoices.update_one(
-        {"id": invoice_id},
-        {"$set": {"is_deleted": False}, "$unset": {"deleted_at": ""}}
-    )
-    
     # Restore camper balance
-    unpaid = invoice["amount"] - invoice.get("paid_amount", 0)
-    if unpaid > 0:
-        await db.campers.update_one(
-            {"id": invoice["camper_id"]},
-            {"$inc": {"total_balance": unpaid}}
-        )
+    await record_ledger_entry(
+        invoice["camper_id"], "invoice_restored",
+        charge=invoice_charge({**invoice, "is_deleted": False}) - invoice_charge(invoice),
+        invoice_id=invoice_id, performed_by=admin.get("id")
+    )
     
     return {"message": "Invoice restored"}
 
@@ -1708,6 +2834,31 @@ async def setup_installments(invoice_id: str, data: dict, admin=Depends(get_curr
 
 # ==================== PAYMENT ROUTES ====================
 
+async def apply_payment_to_invoice(invoice_id: str, amount: float, stripe_session_id: Optional[str] = None) -> Optional[dict]:
+    """Add a payment to an invoice and recompute its status in one atomic update.
+
+    The increment and the status are computed server-side from the stored values, so
+    concurrent payments (two admins, a webhook racing a status poll) can never overwrite each other.
+    With `stripe_session_id` the session is recorded on the invoice in the same update, and an
+    invoice that already has it isn't matched, so a retried settlement can't pay twice.
+    """
+    query = {"id": invoice_id}
+    stages = [
+        {"$set": {"paid_amount": {"$round": [{"$add": [{"$ifNull": ["$paid_amount", 0]}, amount]}, 2]}}},
+        {"$set": {"status": {"$cond": [{"$gte": ["$paid_amount", "$amount"]}, "paid", "partial"]}}}
+    ]
+    if stripe_session_id:
+        query["applied_stripe_sessions"] = {"$ne": stripe_session_id}
+        stages.append({"$set": {"applied_stripe_sessions": {
+            "$concatArrays": [{"$ifNull": ["$applied_stripe_sessions", []]}, [stripe_session_id]]
+        }}})
+    return await db.invoices.find_one_and_update(
+        query,
+        stages,
+        projection={"_id": 0, "applied_stripe_sessions": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
 @api_router.post("/payments", response_model=PaymentResponse)
 async def create_payment(data: PaymentCreate, admin=Depends(get_current_admin)):
     invoice = await db.invoices.find_one({"id": data.invoice_id}, {"_id": 0})
@@ -1725,50 +2876,383 @@ async def create_payment(data: PaymentCreate, admin=Depends(get_current_admin)):
     
     # Update invoice and camper if payment is completed (non-stripe)
     if data.method != "stripe":
-        new_paid = invoice["paid_amount"] + data.amount
-        new_status = "paid" if new_paid >= invoice["amount"] else "partial"
-        
-        await db.invoices.update_one(
-            {"id": data.invoice_id},
-            {"$set": {"paid_amount": new_paid, "status": new_status}}
-        )
+        await apply_payment_to_invoice(data.invoice_id, data.amount)
+        await bump_financial_rollup("payment", data.method, data.amount, payment_doc["created_at"])
         
         # Update camper's total_paid (parent info now embedded in camper)
-        if invoice.get("camper_id"):
-            await db.campers.update_one(
-                {"id": invoice["camper_id"]},
-                {"$inc": {"total_paid": data.amount}}
-            )
+        await record_ledger_entry(
+            invoice.get("camper_id"), "payment", paid=data.amount, invoice_id=data.invoice_id,
+            payment_id=payment_doc["id"], details={"method": data.method}, performed_by=admin.get("id")
+        )
     
     payment_doc.pop("_id", None)
     payment_doc["created_at"] = datetime.fromisoformat(payment_doc["created_at"])
     return PaymentResponse(**payment_doc)
 
 @api_router.get("/payments", response_model=List[PaymentResponse])
-async def get_payments(invoice_id: Optional[str] = None, admin=Depends(get_current_admin)):
+async def get_payments(
+    response: Response,
+    invoice_id: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort: str = "-created_at",
+    fields: Optional[str] = None,
+    admin=Depends(get_current_admin)
+):
     query = {}
     if invoice_id:
         query["invoice_id"] = invoice_id
     
-    payments = await db.payments.find(query, {"_id": 0}).to_list(1000)
+    payments = await paginate(
+        db.payments, query, response,
+        sort=parse_sort(sort, ("created_at", "amount")),
+        limit=limit, cursor=cursor, fields=fields
+    )
+    if fields:
+        return projected_response(payments, response)
     for p in payments:
         p["created_at"] = datetime.fromisoformat(p["created_at"])
     return [PaymentResponse(**p) for p in payments]
 
+# ==================== PAYMENT PROVIDER ====================
+
+# "stripe" (default) or "fake" for offline development and load tests
+PAYMENT_PROVIDER = os.environ.get("PAYMENT_PROVIDER", "stripe").lower()
+PAYMENT_PROVIDER_TIMEOUT_SECONDS = float(os.environ.get("PAYMENT_PROVIDER_TIMEOUT_SECONDS", "15"))
+# Webhook URL handed to Stripe; defaults to this API's own host on first use
+STRIPE_WEBHOOK_URL = os.environ.get("STRIPE_WEBHOOK_URL")
+
+class PaymentProviderUnavailable(Exception):
+    """The provider timed out or the circuit breaker is open"""
+
+class CircuitBreaker:
+    """Fail fast after repeated provider errors instead of stacking up slow requests.
+
+    After `failure_threshold` consecutive failures the circuit opens for `reset_seconds`;
+    then a single trial call is let through and its outcome closes or re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self.trial_in_flight):
+            self.rejected += 1
+            raise PaymentProviderUnavailable("Payment provider is temporarily unavailable")
+        if state == "half_open":
+            self.trial_in_flight = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def end_call(self):
+        # A trial that was cancelled never reaches record_*; without this the circuit would stay shut
+        self.trial_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self.failures, "rejected": self.rejected}
+
+class ProviderWebhookEvent(BaseModel):
+    event_type: str
+    event_id: str
+    session_id: Optional[str] = None
+    payment_status: Optional[str] = None
+    metadata: Dict[str, Any] = {}
+
+class PaymentProvider(ABC):
+    """Checkout sessions, status lookups and webhook parsing for one payment backend"""
+    name = "base"
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+
+    async def _call(self, operation):
+        self.breaker.before_call()
+        try:
+            result = await asyncio.wait_for(operation, timeout=PAYMENT_PROVIDER_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            raise PaymentProviderUnavailable("Payment provider timed out")
+        except HTTPException:
+            # A bad request (e.g. unknown session) says nothing about the provider's health
+            self.breaker.record_success()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        finally:
+            self.breaker.end_call()
+        self.breaker.record_success()
+        return result
+
+    async def create_checkout_session(self, checkout_request: CheckoutSessionRequest) -> CheckoutSessionResponse:
+        return await self._call(self._create_checkout_session(checkout_request))
+
+    async def get_checkout_status(self, session_id: str) -> CheckoutStatusResponse:
+        return await self._call(self._get_checkout_status(session_id))
+
+    @abstractmethod
+    async def handle_webhook(self, body: bytes, signature: Optional[str]):
+        """Verify and parse a webhook delivery"""
+
+    @abstractmethod
+    async def _create_checkout_session(self, checkout_request):
+        """Create a checkout session with the provider (called through the breaker)"""
+
+    @abstractmethod
+    async def _get_checkout_status(self, session_id):
+        """Look up a checkout session with the provider (called through the breaker)"""
+
+    def stats(self) -> Dict[str, Any]:
+        return {"provider": self.name, "circuit": self.breaker.stats()}
+
+class StripePaymentProvider(PaymentProvider):
+    """One StripeCheckout client for the life of the process, so its HTTP connections are reused"""
+    name = "stripe"
+
+    def __init__(self, api_key: str, webhook_url: str):
+        super().__init__()
+        self.checkout = StripeCheckout(api_key=api_key, webhook_url=webhook_url)
+
+    async def _create_checkout_session(self, checkout_request):
+        return await self.checkout.create_checkout_session(checkout_request)
+
+    async def _get_checkout_status(self, session_id):
+        return await self.checkout.get_checkout_status(session_id)
+
+    async def handle_webhook(self, body: bytes, signature: Optional[str]):
+        # Signature verification is local, so it isn't subject to the breaker
+        return await self.checkout.handle_webhook(body, signature)
+
+class FakePaymentProvider(PaymentProvider):
+    """Offline stand-in for Stripe. Sessions live in Mongo so every API worker sees them.
+
+    POST /api/payment/fake/sessions/{session_id}/complete plays the customer paying
+    and delivers the resulting webhook event.
+    """
+    name = "fake"
+
+    async def _create_checkout_session(self, checkout_request):
+        session_id = f"cs_fake_{uuid.uuid4().hex}"
+        await db.fake_checkout_sessions.insert_one({
+            "session_id": session_id,
+            "amount_total": int(round(checkout_request.amount * 100)),
+            "currency": checkout_request.currency,
+            "metadata": checkout_request.metadata or {},
+            "status": "open",
+            "payment_status": "unpaid",
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
+        url = checkout_request.success_url.replace("{CHECKOUT_SESSION_ID}", session_id)
+        return CheckoutSessionResponse(url=url, session_id=session_id)
+
+    async def _get_checkout_status(self, session_id):
+        session = await db.fake_checkout_sessions.find_one({"session_id": session_id}, {"_id": 0})
+        if not session:
+            raise HTTPException(status_code=404, detail="Checkout session not found")
+        return CheckoutStatusResponse(
+            status=session["status"],
+            payment_status=session["payment_status"],
+            amount_total=session["amount_total"],
+            currency=session["currency"],
+            metadata=session["metadata"]
+        )
+
+    async def handle_webhook(self, body: bytes, signature: Optional[str]):
+        return ProviderWebhookEvent(**json.loads(body))
+
+    async def complete_session(self, session_id: str, paid: bool = True) -> Optional[dict]:
+        session = await db.fake_checkout_sessions.find_one_and_update(
+            {"session_id": session_id, "status": "open"},
+            {"$set": {"status": "complete" if paid else "expired", "payment_status": "paid" if paid else "unpaid"}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if not session:
+            return None
+        event = ProviderWebhookEvent(
+            event_type="checkout.session.completed" if paid else "checkout.session.expired",
+            event_id=f"evt_fake_{uuid.uuid4().hex}",
+            session_id=session_id,
+            payment_status=session["payment_status"],
+            metadata=session["metadata"]
+        )
+        await ingest_checkout_webhook(event)
+        return session
+
+payment_provider: Optional[PaymentProvider] = None
+
+def get_payment_provider(request: Request) -> PaymentProvider:
+    """The process-wide provider, created on first use"""
+    global payment_provider
+    if payment_provider is None:
+        if PAYMENT_PROVIDER == "fake":
+            payment_provider = FakePaymentProvider()
+        else:
+            webhook_url = STRIPE_WEBHOOK_URL or f"{str(request.base_url).rstrip('/')}/api/webhook/stripe"
+            payment_provider = StripePaymentProvider(STRIPE_API_KEY, webhook_url)
+    return payment_provider
+
+async def create_checkout(request: Request, checkout_request: CheckoutSessionRequest) -> CheckoutSessionResponse:
+    try:
+        return await get_payment_provider(request).create_checkout_session(checkout_request)
+    except PaymentProviderUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@api_router.post("/payment/fake/sessions/{session_id}/complete")
+async def complete_fake_checkout(session_id: str, request: Request, paid: bool = True):
+    """Simulate the customer finishing a fake checkout (only with PAYMENT_PROVIDER=fake)"""
+    provider = get_payment_provider(request)
+    if not isinstance(provider, FakePaymentProvider):
+        raise HTTPException(status_code=404, detail="Not found")
+    session = await provider.complete_session(session_id, paid=paid)
+    if not session:
+        raise HTTPException(status_code=404, detail="Open checkout session not found")
+    return {"session_id": session_id, "status": session["status"], "payment_status": session["payment_status"]}
+
 # ==================== STRIPE ROUTES ====================
 
 # Credit card processing fee rate
 CREDIT_CARD_FEE_RATE = 0.035  # 3.5%
 
-@api_router.get("/payment/calculate-fee")
-async def calculate_payment_fee(amount: float, include_fee: bool = True):
-    """Calculate the credit card processing fee"""
-    if include_fee:
-        fee = round(amount * CREDIT_CARD_FEE_RATE, 2)
-        total = round(amount + fee, 2)
-        return {
-            "base_amount": amount,
-            "fee_rate": CREDIT_CARD_FEE_RATE,
+# A settlement that hasn't finished after this long (worker crashed mid-way) can be claimed again
+STRIPE_SETTLE_LEASE_SECONDS = 300
+
+async def claim_stripe_session(session_id: str, fallback: Optional[dict] = None) -> Optional[dict]:
+    """Mark a checkout session's transaction completed and settling; returns it only to the caller that claims it.
+
+    With `fallback` (invoice_id/amount from the event), a session with no transaction record is
+    claimed by inserting one. A session that is already completed collides on the unique
+    stripe_session_id index and is reported as already claimed, unless its settlement went stale.
+    """
+    now = datetime.now(timezone.utc)
+    stale = (now - timedelta(seconds=STRIPE_SETTLE_LEASE_SECONDS)).isoformat()
+    update = {"$set": {"status": "completed", "completed_at": now.isoformat(), "settling": True}}
+    if fallback:
+        update["$setOnInsert"] = {"id": str(uuid.uuid4()), "method": "stripe", "notes": None, "created_at": now.isoformat(), **fallback}
+    try:
+        return await db.payment_transactions.find_one_and_update(
+            {"stripe_session_id": session_id, "$or": [
+                {"status": {"$ne": "completed"}},
+                {"settling": True, "completed_at": {"$lt": stale}}
+            ]},
+            update,
+            projection={"_id": 0},
+            upsert=bool(fallback),
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        return None
+
+async def settle_stripe_payment(session_id: str, transaction: dict, performed_by: str) -> Optional[dict]:
+    """Record a claimed session against its invoice. Every step is keyed on the session, so it can be re-run."""
+    invoice = await apply_payment_to_invoice(transaction["invoice_id"], transaction["amount"], stripe_session_id=session_id)
+    newly_applied = invoice is not None
+    if not invoice:
+        # Either already applied by an earlier attempt, or the invoice is gone
+        invoice = await db.invoices.find_one({"id": transaction["invoice_id"]}, {"_id": 0, "applied_stripe_sessions": 0})
+        if not invoice:
+            logging.error(f"Stripe session {session_id} paid for missing invoice {transaction['invoice_id']}")
+            return None
+    
+    now = datetime.now(timezone.utc).isoformat()
+    payment = await db.payments.find_one_and_update(
+        {"stripe_session_id": session_id},
+        {"$setOnInsert": {
+            "id": str(uuid.uuid4()),
+            "invoice_id": invoice["id"],
+            "camper_id": invoice.get("camper_id"),
+            "amount": transaction["amount"],
+            "method": "stripe",
+            "status": "completed",
+            "notes": "Online payment via Stripe",
+            "created_at": now
+        }},
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    
+    # Each side effect is flagged on the payment once done, so a retry only redoes what failed
+    if not payment.get("rollup_applied"):
+        await bump_financial_rollup("payment", "stripe", transaction["amount"], payment["created_at"])
+        await db.payments.update_one({"id": payment["id"]}, {"$set": {"rollup_applied": True}})
+    if not payment.get("ledger_applied"):
+        # Update camper balance
+        await record_ledger_entry(
+            invoice.get("camper_id"), "payment", paid=transaction["amount"], invoice_id=invoice["id"],
+            payment_id=payment["id"], details={"method": "stripe", "stripe_session_id": session_id},
+            performed_by=performed_by
+        )
+        await db.payments.update_one({"id": payment["id"]}, {"$set": {"ledger_applied": True}})
+    
+    if newly_applied:
+        await log_activity(
+            entity_type="camper",
+            entity_id=invoice.get("camper_id"),
+            action="payment_received",
+            details={
+                "invoice_id": invoice["id"],
+                "amount": transaction["amount"],
+                "method": "stripe",
+                "new_status": invoice["status"]
+            },
+            performed_by=performed_by
+        )
+    return invoice
+
+async def complete_stripe_payment(session_id: str, performed_by: str, fallback: Optional[dict] = None) -> Optional[dict]:
+    """Apply a paid checkout session exactly once: claim it, then record the payment against its invoice"""
+    transaction = await claim_stripe_session(session_id, fallback)
+    if not transaction:
+        return None
+    
+    try:
+        invoice = await settle_stripe_payment(session_id, transaction, performed_by)
+    except BaseException:
+        # Release the claim so a webhook retry (or the next status poll) finishes the settlement
+        await db.payment_transactions.update_one(
+            {"stripe_session_id": session_id, "settling": True},
+            {"$set": {"status": "pending"}, "$unset": {"settling": ""}}
+        )
+        raise
+    await db.payment_transactions.update_one(
+        {"stripe_session_id": session_id},
+        {"$set": {"settled_at": datetime.now(timezone.utc).isoformat()}, "$unset": {"settling": ""}}
+    )
+    return invoice
+
+@api_router.get("/payment/calculate-fee")
+async def calculate_payment_fee(amount: float, include_fee: bool = True):
+    """Calculate the credit card processing fee"""
+    if include_fee:
+        fee = round(amount * CREDIT_CARD_FEE_RATE, 2)
+        total = round(amount + fee, 2)
+        return {
+            "base_amount": amount,
+            "fee_rate": CREDIT_CARD_FEE_RATE,
             "fee_amount": fee,
             "total_with_fee": total,
             "fee_description": f"3.5% credit card processing fee"
@@ -1798,11 +3282,6 @@ async def create_stripe_checkout(
     fee_amount = round(base_amount * CREDIT_CARD_FEE_RATE, 2) if include_fee else 0
     total_amount = round(base_amount + fee_amount, 2)
     
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    
-    stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
-    
     success_url = f"{origin_url}/payment/success?session_id={{CHECKOUT_SESSION_ID}}"
     cancel_url = f"{origin_url}/payment/cancel"
     
@@ -1813,14 +3292,14 @@ async def create_stripe_checkout(
         cancel_url=cancel_url,
         metadata={
             "invoice_id": invoice_id,
-            "parent_id": invoice["parent_id"],
+            "camper_id": invoice.get("camper_id") or "",
             "base_amount": str(base_amount),
             "fee_amount": str(fee_amount),
             "include_fee": str(include_fee)
         }
     )
     
-    session = await stripe_checkout.create_checkout_session(checkout_request)
+    session = await create_checkout(request, checkout_request)
     
     # Create payment transaction record
     payment_doc = {
@@ -1839,45 +3318,14 @@ async def create_stripe_checkout(
 
 @api_router.get("/stripe/status/{session_id}")
 async def get_stripe_status(session_id: str, request: Request):
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    
-    stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
-    status = await stripe_checkout.get_checkout_status(session_id)
+    try:
+        status = await get_payment_provider(request).get_checkout_status(session_id)
+    except PaymentProviderUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     
-    # Update payment transaction if paid
+    # Update payment transaction if paid (a no-op if the webhook already applied it)
     if status.payment_status == "paid":
-        transaction = await db.payment_transactions.find_one(
-            {"stripe_session_id": session_id},
-            {"_id": 0}
-        )
-        
-        if transaction and transaction["status"] != "completed":
-            await db.payment_transactions.update_one(
-                {"stripe_session_id": session_id},
-                {"$set": {"status": "completed"}}
-            )
-            
-            # Update invoice
-            invoice = await db.invoices.find_one(
-                {"id": transaction["invoice_id"]},
-                {"_id": 0}
-            )
-            if invoice:
-                new_paid = invoice["paid_amount"] + transaction["amount"]
-                new_status = "paid" if new_paid >= invoice["amount"] else "partial"
-                
-                await db.invoices.update_one(
-                    {"id": transaction["invoice_id"]},
-                    {"$set": {"paid_amount": new_paid, "status": new_status}}
-                )
-                
-                # Update camper's total_paid (parent info now embedded in camper)
-                if invoice.get("camper_id"):
-                    await db.campers.update_one(
-                        {"id": invoice["camper_id"]},
-                        {"$inc": {"total_paid": transaction["amount"]}}
-                    )
+        await complete_stripe_payment(session_id, performed_by="stripe_checkout")
     
     return {
         "status": status.status,
@@ -1891,24 +3339,22 @@ async def stripe_webhook(request: Request):
     body = await request.body()
     signature = request.headers.get("Stripe-Signature")
     
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    
-    stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
+    try:
+        webhook_response = await get_payment_provider(request).handle_webhook(body, signature)
+    except Exception as e:
+        # Bad signature or payload: redelivering it won't help
+        logging.error(f"Webhook rejected: {e}")
+        raise HTTPException(status_code=400, detail="Invalid webhook")
     
+    # Persist before acknowledging; the payment is applied by the webhook workers.
+    # If the event can't be stored, a 5xx makes Stripe deliver it again.
     try:
-        webhook_response = await stripe_checkout.handle_webhook(body, signature)
-        
-        if webhook_response.payment_status == "paid":
-            await db.payment_transactions.update_one(
-                {"stripe_session_id": webhook_response.session_id},
-                {"$set": {"status": "completed"}}
-            )
-        
-        return {"received": True}
+        await ingest_checkout_webhook(webhook_response)
     except Exception as e:
-        logging.error(f"Webhook error: {e}")
-        return {"received": True}
+        logging.error(f"Webhook event {webhook_response.event_id} not stored: {e}")
+        raise HTTPException(status_code=503, detail="Webhook could not be stored, please retry")
+    
+    return {"received": True}
 
 # ==================== COMMUNICATION ROUTES ====================
 
@@ -1927,8 +3373,12 @@ async def create_communication(data: CommunicationCreate, admin=Depends(get_curr
 
 @api_router.get("/communications", response_model=List[CommunicationResponse])
 async def get_communications(
+    response: Response,
     camper_id: Optional[str] = None,
     type: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
     admin=Depends(get_current_admin)
 ):
     query = {}
@@ -1937,7 +3387,12 @@ async def get_communications(
     if type:
         query["type"] = type
     
-    comms = await db.communications.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    comms = await paginate(
+        db.communications, query, response,
+        sort=("created_at", DESCENDING), limit=limit, cursor=cursor, fields=fields
+    )
+    if fields:
+        return projected_response(comms, response)
     result = []
     for c in comms:
         c["created_at"] = datetime.fromisoformat(c["created_at"])
@@ -1964,7 +3419,8 @@ async def create_room(data: RoomCreate, admin=Depends(get_current_admin)):
     room_doc = {
         "id": str(uuid.uuid4()),
         **data.model_dump(),
-        "assigned_campers": []
+        "assigned_campers": [],
+        "occupancy": 0
     }
     await db.rooms.insert_one(room_doc)
     room_doc.pop("_id", None)
@@ -1975,40 +3431,70 @@ async def get_rooms(admin=Depends(get_current_admin)):
     rooms = await db.rooms.find({}, {"_id": 0}).to_list(100)
     return [RoomResponse(**r) for r in rooms]
 
+def room_has_space(camper_id: str) -> dict:
+    """Match a room with a free bed that the camper isn't already in"""
+    return {
+        "assigned_campers": {"$ne": camper_id},
+        "$expr": {"$lt": [{"$size": {"$ifNull": ["$assigned_campers", []]}}, "$capacity"]}
+    }
+
+async def release_room_bed(room_id: Optional[str], camper_id: str):
+    if room_id:
+        await db.rooms.update_one(
+            {"id": room_id, "assigned_campers": camper_id},
+            {"$pull": {"assigned_campers": camper_id}, "$inc": {"occupancy": -1}}
+        )
+
+async def backfill_room_occupancy():
+    """Denormalize occupancy for rooms and room_id for campers written before either existed"""
+    await db.rooms.update_many({}, [{"$set": {"occupancy": {"$size": {"$ifNull": ["$assigned_campers", []]}}}}])
+    await db.campers.update_many(
+        {"room": {"$type": "string"}, "room_id": None},
+        [{"$set": {"room_id": "$room"}}]
+    )
+
 @api_router.put("/rooms/{room_id}/assign")
 async def assign_camper_to_room(room_id: str, camper_id: str, admin=Depends(get_current_admin)):
-    # Remove camper from any existing room
-    await db.rooms.update_many(
-        {},
-        {"$pull": {"assigned_campers": camper_id}}
-    )
+    """Move a camper into a room, touching only the old and new rooms.
+
+    The bed is claimed with a conditional update, so concurrent assignments can't
+    overfill a room.
+    """
+    if not await db.campers.find_one({"id": camper_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Camper not found")
     
-    # Assign to new room
-    result = await db.rooms.update_one(
-        {"id": room_id},
-        {"$addToSet": {"assigned_campers": camper_id}}
+    room = await db.rooms.find_one_and_update(
+        {"id": room_id, **room_has_space(camper_id)},
+        {"$push": {"assigned_campers": camper_id}, "$inc": {"occupancy": 1}},
+        projection={"_id": 0, "id": 1, "name": 1}
     )
-    
-    # Update camper's room field
-    await db.campers.update_one(
+    if not room:
+        room = await db.rooms.find_one({"id": room_id}, {"_id": 0, "id": 1, "name": 1, "assigned_campers": 1})
+        if not room:
+            raise HTTPException(status_code=404, detail="Room not found")
+        if camper_id not in room.get("assigned_campers", []):
+            raise HTTPException(status_code=409, detail="Room is full")
+    
+    # The camper's previous room comes from the same write that moves them, so two
+    # concurrent moves of one camper each release the room the other one claimed
+    previous = await db.campers.find_one_and_update(
         {"id": camper_id},
-        {"$set": {"room": room_id}}
+        {"$set": {"room_id": room_id, "room_name": room.get("name"), "room": room_id}},
+        projection={"_id": 0, "room_id": 1, "room": 1}
     )
+    previous_room = (previous or {}).get("room_id") or (previous or {}).get("room")
+    if previous_room != room_id:
+        await release_room_bed(previous_room, camper_id)
     
-    if result.modified_count == 0:
-        raise HTTPException(status_code=404, detail="Room not found")
     return {"message": "Camper assigned to room"}
 
 @api_router.put("/rooms/{room_id}/unassign")
 async def unassign_camper_from_room(room_id: str, camper_id: str, admin=Depends(get_current_admin)):
-    result = await db.rooms.update_one(
-        {"id": room_id},
-        {"$pull": {"assigned_campers": camper_id}}
-    )
+    await release_room_bed(room_id, camper_id)
     
     await db.campers.update_one(
-        {"id": camper_id},
-        {"$set": {"room": None}}
+        {"id": camper_id, "$or": [{"room_id": room_id}, {"room": room_id}]},
+        {"$set": {"room_id": None, "room_name": None, "room": None}}
     )
     
     return {"message": "Camper unassigned from room"}
@@ -2018,13 +3504,46 @@ async def unassign_camper_from_room(room_id: str, camper_id: str, admin=Depends(
 class GroupCampersUpdate(BaseModel):
     camper_ids: List[str]
 
+def compute_group_ancestors(parents: Dict[str, Optional[str]]) -> Dict[str, List[str]]:
+    """Ancestor paths (root first) from an id -> parent_id map; missing parents and cycles end the path"""
+    paths: Dict[str, List[str]] = {}
+    for group_id in parents:
+        path, seen = [], {group_id}
+        parent = parents.get(group_id)
+        while parent and parent in parents and parent not in seen:
+            path.append(parent)
+            seen.add(parent)
+            parent = parents.get(parent)
+        paths[group_id] = path[::-1]
+    return paths
+
+async def backfill_group_ancestors() -> int:
+    """Write ancestor paths for groups created before they were materialized (or left stale)"""
+    groups = await db.groups.find({}, {"_id": 0, "id": 1, "parent_id": 1, "ancestors": 1}).to_list(None)
+    paths = compute_group_ancestors({g["id"]: g.get("parent_id") for g in groups})
+    ops = [
+        UpdateOne({"id": g["id"]}, {"$set": {"ancestors": paths[g["id"]]}})
+        for g in groups if g.get("ancestors") != paths[g["id"]]
+    ]
+    if ops:
+        await db.groups.bulk_write(ops, ordered=False)
+    return len(ops)
+
 @api_router.post("/groups", response_model=GroupResponse)
 async def create_group(data: GroupCreate, admin=Depends(get_current_admin)):
+    ancestors = []
+    if data.parent_id:
+        parent = await db.groups.find_one({"id": data.parent_id}, {"_id": 0, "id": 1, "ancestors": 1})
+        if not parent:
+            raise HTTPException(status_code=400, detail="Parent group not found")
+        ancestors = parent.get("ancestors", []) + [parent["id"]]
+    
     group_doc = {
         "id": str(uuid.uuid4()),
         "name": data.name,
         "description": data.description,
         "parent_id": data.parent_id,
+        "ancestors": ancestors,
         "type": "custom",
         "assigned_campers": [],
         "camper_ids": [],
@@ -2048,6 +3567,29 @@ async def get_groups(type: Optional[str] = None, admin=Depends(get_current_admin
             g["created_at"] = datetime.fromisoformat(g["created_at"]) if isinstance(g["created_at"], str) else g["created_at"]
     return groups
 
+@api_router.get("/groups/tree")
+async def get_group_tree(admin=Depends(get_current_admin)):
+    """Full group hierarchy with direct and subtree membership counts"""
+    nodes = await db.groups.aggregate([
+        {"$project": {
+            "_id": 0, "id": 1, "name": 1, "type": 1, "capacity": 1, "parent_id": 1,
+            "ancestors": {"$ifNull": ["$ancestors", []]},
+            "member_count": {"$size": {"$ifNull": ["$assigned_campers", []]}}
+        }},
+        {"$sort": {"name": 1}}
+    ]).to_list(None)
+    
+    by_id = {node["id"]: {**node, "subtree_member_count": node["member_count"], "children": []} for node in nodes}
+    roots = []
+    for node in by_id.values():
+        # Each membership counts once towards every ancestor's subtree total
+        for ancestor in node["ancestors"]:
+            if ancestor in by_id:
+                by_id[ancestor]["subtree_member_count"] += node["member_count"]
+        parent = by_id.get(node.get("parent_id"))
+        (parent["children"] if parent else roots).append(node)
+    return roots
+
 @api_router.get("/groups/{group_id}")
 async def get_group(group_id: str, admin=Depends(get_current_admin)):
     group = await db.groups.find_one({"id": group_id}, {"_id": 0})
@@ -2075,51 +3617,69 @@ async def update_group(group_id: str, data: GroupUpdate, admin=Depends(get_curre
 
 @api_router.put("/groups/{group_id}/campers")
 async def update_group_campers(group_id: str, data: GroupCampersUpdate, admin=Depends(get_current_admin)):
-    """Update the list of campers assigned to a group"""
-    result = await db.groups.update_one(
-        {"id": group_id},
-        {"$set": {"assigned_campers": data.camper_ids, "camper_ids": data.camper_ids}}
-    )
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Group not found")
-    
-    # Also update the campers' group references
-    await db.campers.update_many(
-        {"groups": group_id},
-        {"$pull": {"groups": group_id}}
-    )
-    for camper_id in data.camper_ids:
-        await db.campers.update_one(
-            {"id": camper_id},
-            {"$addToSet": {"groups": group_id}}
+    """Update the list of campers assigned to a group.
+
+    Only campers that joined or left are written, in one bulk_write. The group is
+    swapped in only if its membership hasn't changed since it was read, so two
+    concurrent edits can't leave campers pointing at a mix of both lists.
+    """
+    camper_ids = list(dict.fromkeys(data.camper_ids))
+    for _ in range(3):
+        group = await db.groups.find_one({"id": group_id}, {"_id": 0, "assigned_campers": 1})
+        if not group:
+            raise HTTPException(status_code=404, detail="Group not found")
+        current = group.get("assigned_campers")
+        swapped = await db.groups.update_one(
+            {"id": group_id, "assigned_campers": current},
+            {"$set": {"assigned_campers": camper_ids, "camper_ids": camper_ids}}
         )
+        if swapped.matched_count:
+            break
+    else:
+        raise HTTPException(status_code=409, detail="Group membership changed concurrently, please retry")
+    
+    before = set(current or [])
+    added = [cid for cid in camper_ids if cid not in before]
+    removed = [cid for cid in before if cid not in set(camper_ids)]
+    
+    # Filters match only campers whose reference is actually missing or stale,
+    # which also repairs any drift between the group and its campers
+    ops = [UpdateMany({"groups": group_id, "id": {"$nin": camper_ids}}, {"$pull": {"groups": group_id}})]
+    if camper_ids:
+        ops.append(UpdateMany(
+            {"id": {"$in": camper_ids}, "groups": {"$ne": group_id}},
+            {"$addToSet": {"groups": group_id}}
+        ))
+    result = await db.campers.bulk_write(ops, ordered=False)
     
-    return {"message": "Group campers updated"}
+    return {
+        "message": "Group campers updated",
+        "added": len(added),
+        "removed": len(removed),
+        "campers_updated": result.modified_count
+    }
 
 @api_router.delete("/groups/{group_id}")
 async def delete_group(group_id: str, admin=Depends(get_current_admin)):
-    # Delete subgroups first
-    await db.groups.delete_many({"parent_id": group_id})
-    
-    # Remove group reference from all campers
-    group = await db.groups.find_one({"id": group_id}, {"_id": 0})
-    if group:
-        for camper_id in group.get("assigned_campers", []):
-            await db.campers.update_one(
-                {"id": camper_id},
-                {"$pull": {"groups": group_id}}
-            )
-    
-    result = await db.groups.delete_one({"id": group_id})
-    if result.deleted_count == 0:
+    """Delete a group together with every group below it"""
+    subtree = {"$or": [{"id": group_id}, {"ancestors": group_id}]}
+    group_ids = await db.groups.distinct("id", subtree)
+    if group_id not in group_ids:
         raise HTTPException(status_code=404, detail="Group not found")
-    return {"message": "Group deleted"}
+    
+    # Remove the deleted groups from all campers
+    await db.campers.update_many(
+        {"groups": {"$in": group_ids}},
+        {"$pull": {"groups": {"$in": group_ids}}}
+    )
+    result = await db.groups.delete_many(subtree)
+    return {"message": "Group deleted", "groups_deleted": result.deleted_count}
 
 @api_router.put("/groups/{group_id}/assign")
 async def assign_camper_to_group(group_id: str, camper_id: str, admin=Depends(get_current_admin)):
     result = await db.groups.update_one(
         {"id": group_id},
-        {"$addToSet": {"assigned_campers": camper_id}}
+        {"$addToSet": {"assigned_campers": camper_id, "camper_ids": camper_id}}
     )
     
     # Add group to camper's groups array
@@ -2146,7 +3706,7 @@ async def assign_camper_to_group(group_id: str, camper_id: str, admin=Depends(ge
 async def unassign_camper_from_group(group_id: str, camper_id: str, admin=Depends(get_current_admin)):
     result = await db.groups.update_one(
         {"id": group_id},
-        {"$pull": {"assigned_campers": camper_id}}
+        {"$pull": {"assigned_campers": camper_id, "camper_ids": camper_id}}
     )
     
     # Remove group from camper's groups array
@@ -2157,10 +3717,346 @@ async def unassign_camper_from_group(group_id: str, camper_id: str, admin=Depend
     
     return {"message": "Camper removed from group"}
 
+# ==================== ALLOCATION ====================
+# Fills rooms or groups for many campers at once. Campers tied by keep_together
+# are merged into clusters (union-find) and placed as a unit. Clusters are placed
+# greedily, largest preference bucket first, into the target that already holds
+# the most campers sharing their grade/yeshiva, and then into the one with the
+# most free space. keep_apart pairs are hard constraints.
+
+ALLOCATION_PREFERENCE_FIELDS = {"grade", "yeshiva"}
+MAX_ALLOCATION_CAMPERS = 2000
+
+class AllocationRequest(BaseModel):
+    target_type: str  # rooms, groups
+    target_ids: List[str]
+    camper_ids: List[str]
+    group_by: List[str] = []  # Prefer keeping campers with the same value together: grade, yeshiva
+    keep_together: List[List[str]] = []
+    keep_apart: List[List[str]] = []
+    dry_run: bool = True
+
+class DisjointSet:
+    def __init__(self, items):
+        self.parent = {item: item for item in items}
+
+    def find(self, item):
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, a, b):
+        self.parent[self.find(a)] = self.find(b)
+
+def solve_allocation(
+    campers: Dict[str, dict],
+    targets: List[dict],
+    group_by: List[str],
+    keep_together: List[List[str]],
+    keep_apart: List[List[str]]
+) -> Dict[str, Any]:
+    """Assign campers to targets. targets carry id, free (None = unlimited) and occupants (camper docs staying put)."""
+    clusters_of = DisjointSet(campers)
+    for ids in keep_together:
+        ids = [cid for cid in ids if cid in campers]
+        for other in ids[1:]:
+            clusters_of.union(ids[0], other)
+    clusters: Dict[str, List[str]] = {}
+    for cid in campers:
+        clusters.setdefault(clusters_of.find(cid), []).append(cid)
+    
+    apart: Dict[str, set] = {}
+    for ids in keep_apart:
+        for a in ids:
+            for b in ids:
+                if a != b:
+                    apart.setdefault(a, set()).add(b)
+    for members in clusters.values():
+        conflict = [cid for cid in members if apart.get(cid, set()) & set(members)]
+        if conflict:
+            raise HTTPException(status_code=400, detail=f"Campers {sorted(conflict)} are both kept together and apart")
+    
+    def pref_key(cid):
+        return tuple(campers[cid].get(field) or "" for field in group_by)
+    
+    # Per target: who is there and how many of each preference value
+    state = {}
+    for target in targets:
+        members = {c["id"] for c in target["occupants"]}
+        counts: Dict[tuple, int] = {}
+        for occupant in target["occupants"]:
+            for field in group_by:
+                key = (field, occupant.get(field) or "")
+                counts[key] = counts.get(key, 0) + 1
+        state[target["id"]] = {"free": target["free"], "members": members, "counts": counts, "placed": []}
+    
+    # Largest preference buckets first, largest clusters first within a bucket
+    buckets: Dict[tuple, List[List[str]]] = {}
+    for members in clusters.values():
+        buckets.setdefault(pref_key(members[0]), []).append(members)
+    ordered = []
+    for _, bucket in sorted(buckets.items(), key=lambda kv: (-sum(len(m) for m in kv[1]), kv[0])):
+        ordered.extend(sorted(bucket, key=len, reverse=True))
+    
+    unplaced = []
+    for members in ordered:
+        blocked = set().union(*(apart.get(cid, set()) for cid in members))
+        best, best_score = None, None
+        for target in targets:
+            slot = state[target["id"]]
+            if slot["free"] is not None and slot["free"] < len(members):
+                continue
+            if blocked & slot["members"]:
+                continue
+            matches = sum(
+                slot["counts"].get((field, campers[cid].get(field) or ""), 0)
+                for cid in members for field in group_by
+            )
+            score = (matches, float("inf") if slot["free"] is None else slot["free"])
+            if best_score is None or score > best_score:
+                best, best_score = target["id"], score
+        if best is None:
+            reason = "no target with room for the whole cluster" if len(members) > 1 else "no target with space that satisfies keep_apart"
+            unplaced.extend({"camper_id": cid, "reason": reason} for cid in members)
+            continue
+        slot = state[best]
+        if slot["free"] is not None:
+            slot["free"] -= len(members)
+        for cid in members:
+            slot["members"].add(cid)
+            slot["placed"].append(cid)
+            for field in group_by:
+                key = (field, campers[cid].get(field) or "")
+                slot["counts"][key] = slot["counts"].get(key, 0) + 1
+    
+    return {"placed": {tid: slot["placed"] for tid, slot in state.items()}, "unplaced": unplaced}
+
+@api_router.post("/allocations")
+async def allocate_campers(data: AllocationRequest, admin=Depends(get_current_admin)):
+    """Compute (dry_run) or commit a batch assignment of campers to rooms or groups"""
+    if data.target_type not in ("rooms", "groups"):
+        raise HTTPException(status_code=400, detail="target_type must be rooms or groups")
+    invalid = set(data.group_by) - ALLOCATION_PREFERENCE_FIELDS
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Unsupported group_by fields: {sorted(invalid)}")
+    camper_ids = list(dict.fromkeys(data.camper_ids))
+    target_ids = list(dict.fromkeys(data.target_ids))
+    if not camper_ids or not target_ids:
+        raise HTTPException(status_code=400, detail="camper_ids and target_ids are required")
+    if len(camper_ids) > MAX_ALLOCATION_CAMPERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_ALLOCATION_CAMPERS} campers per allocation")
+    
+    rooms = data.target_type == "rooms"
+    collection = db.rooms if rooms else db.groups
+    target_docs = await collection.find(
+        {"id": {"$in": target_ids}}, {"_id": 0, "id": 1, "name": 1, "capacity": 1, "assigned_campers": 1}
+    ).to_list(None)
+    if len(target_docs) != len(target_ids):
+        missing = set(target_ids) - {t["id"] for t in target_docs}
+        raise HTTPException(status_code=404, detail=f"Targets not found: {sorted(missing)}")
+    
+    fields = {"_id": 0, "id": 1, "grade": 1, "yeshiva": 1, "room_id": 1, "room": 1}
+    campers = {c["id"]: c for c in await db.campers.find({"id": {"$in": camper_ids}}, fields).to_list(None)}
+    missing = [cid for cid in camper_ids if cid not in campers]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Campers not found: {missing}")
+    
+    # Existing members that aren't being reallocated stay put and count towards capacity and preferences
+    staying_ids = {
+        cid for t in target_docs for cid in t.get("assigned_campers") or [] if cid not in campers
+    }
+    staying = {c["id"]: c for c in await db.campers.find({"id": {"$in": list(staying_ids)}}, fields).to_list(None)}
+    targets = []
+    for t in target_docs:
+        kept = [cid for cid in t.get("assigned_campers") or [] if cid not in campers]
+        capacity = t.get("capacity")
+        targets.append({
+            "id": t["id"],
+            "free": None if capacity is None else max(capacity - len(kept), 0),
+            "occupants": [staying[cid] for cid in kept if cid in staying]
+        })
+    
+    solution = solve_allocation(campers, targets, data.group_by, data.keep_together, data.keep_apart)
+    placed_in = {cid: tid for tid, cids in solution["placed"].items() for cid in cids}
+    
+    by_id = {t["id"]: t for t in target_docs}
+    assignments = []
+    for t in target_docs:
+        kept = [cid for cid in t.get("assigned_campers") or [] if cid not in campers]
+        assignments.append({
+            "target_id": t["id"],
+            "name": t.get("name"),
+            "capacity": t.get("capacity"),
+            "camper_ids": kept + solution["placed"][t["id"]],
+            "added": solution["placed"][t["id"]]
+        })
+    result = {
+        "dry_run": data.dry_run,
+        "target_type": data.target_type,
+        "placed": len(placed_in),
+        "unplaced": solution["unplaced"],
+        "assignments": assignments
+    }
+    if data.dry_run:
+        return result
+    
+    # Swap each target's member list only if it hasn't changed since it was read
+    def member_update(members):
+        return {"assigned_campers": members, **({"occupancy": len(members)} if rooms else {"camper_ids": members})}
+    swapped = []
+    for a in assignments:
+        before = by_id[a["target_id"]].get("assigned_campers")
+        res = await collection.update_one(
+            {"id": a["target_id"], "assigned_campers": before},
+            {"$set": member_update(a["camper_ids"])}
+        )
+        if not res.matched_count:
+            # Put back the targets already swapped and let the caller retry
+            for done in swapped:
+                await collection.update_one(
+                    {"id": done["target_id"], "assigned_campers": done["camper_ids"]},
+                    {"$set": member_update(by_id[done["target_id"]].get("assigned_campers") or [])}
+                )
+            raise HTTPException(status_code=409, detail="Assignments changed while allocating, please retry")
+        swapped.append(a)
+    
+    unplaced_ids = [u["camper_id"] for u in solution["unplaced"]]
+    if rooms:
+        names = {t["id"]: t.get("name") for t in target_docs}
+        ops = [
+            UpdateOne({"id": cid}, {"$set": {"room_id": tid, "room_name": names[tid], "room": tid}})
+            for cid, tid in placed_in.items()
+        ]
+        if unplaced_ids:
+            ops.append(UpdateMany(
+                {"id": {"$in": unplaced_ids}, "room_id": {"$in": target_ids}},
+                {"$set": {"room_id": None, "room_name": None, "room": None}}
+            ))
+        await db.campers.bulk_write(ops, ordered=False)
+        # Release beds in rooms outside this allocation that moved campers came from
+        previous_rooms: Dict[str, List[str]] = {}
+        for cid in placed_in:
+            previous = campers[cid].get("room_id") or campers[cid].get("room")
+            if previous and previous not in by_id:
+                previous_rooms.setdefault(previous, []).append(cid)
+        if previous_rooms:
+            await db.rooms.bulk_write([
+                UpdateOne({"id": rid}, {"$pull": {"assigned_campers": {"$in": cids}}})
+                for rid, cids in previous_rooms.items()
+            ] + [
+                UpdateOne({"id": rid}, [{"$set": {"occupancy": {"$size": {"$ifNull": ["$assigned_campers", []]}}}}])
+                for rid in previous_rooms
+            ], ordered=True)
+    else:
+        # A camper ends up in exactly one of the target groups
+        ops = [UpdateMany({"id": {"$in": camper_ids}}, {"$pull": {"groups": {"$in": target_ids}}})]
+        ops.extend(
+            UpdateMany({"id": {"$in": cids}}, {"$addToSet": {"groups": tid}})
+            for tid, cids in solution["placed"].items() if cids
+        )
+        await db.campers.bulk_write(ops, ordered=True)
+    
+    await log_activities([{
+        "entity_type": "camper",
+        "entity_id": cid,
+        "action": "room_assigned" if rooms else "group_assigned",
+        "details": {
+            ("room_id" if rooms else "group_id"): tid,
+            ("room_name" if rooms else "group_name"): by_id[tid].get("name"),
+            "allocation": True
+        },
+        "performed_by": admin.get("id")
+    } for cid, tid in placed_in.items()])
+    return result
+
 # ==================== ACTIVITY LOG ====================
 
-async def log_activity(entity_type: str, entity_id: str, action: str, details: dict = None, performed_by: str = None):
-    """Helper to log activities"""
+ACTIVITY_BUFFER_SIZE = int(os.environ.get("ACTIVITY_BUFFER_SIZE", "10000"))
+ACTIVITY_FLUSH_BATCH = 500
+ACTIVITY_FLUSH_SECONDS = float(os.environ.get("ACTIVITY_FLUSH_SECONDS", "1"))
+# Written before the request returns, never buffered
+AUDIT_CRITICAL_ACTIONS = {"payment_received", "payment_failed", "invoice_deleted", "camper_deleted", "camper_restored"}
+
+class ActivityLogWriter:
+    """Write-behind buffer for activity logs, flushed with insert_many.
+
+    Flushes when ACTIVITY_FLUSH_BATCH entries are waiting or every ACTIVITY_FLUSH_SECONDS.
+    When the buffer is full, writers wait for the next flush instead of growing it without bound.
+    Until run() is started (and after drain()), entries are inserted directly.
+    """
+
+    def __init__(self, max_buffer: int, batch_size: int, flush_seconds: float):
+        self.max_buffer = max_buffer
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.buffer: List[dict] = []
+        self.running = False
+        self.lock = asyncio.Lock()
+        self.wake = asyncio.Event()
+        self.space = asyncio.Event()
+        self.counters = {"buffered": 0, "written": 0, "flushes": 0, "backpressure_waits": 0, "errors": 0}
+
+    async def write(self, docs: List[dict]):
+        if not docs:
+            return
+        if not self.running:
+            await db.activity_logs.insert_many(docs, ordered=False)
+            self.counters["written"] += len(docs)
+            return
+        while len(self.buffer) >= self.max_buffer:
+            self.counters["backpressure_waits"] += 1
+            self.space.clear()
+            self.wake.set()
+            await self.space.wait()
+        self.buffer.extend(docs)
+        self.counters["buffered"] += len(docs)
+        if len(self.buffer) >= self.batch_size:
+            self.wake.set()
+
+    async def flush(self):
+        """Write everything buffered so far"""
+        async with self.lock:
+            while self.buffer:
+                batch = self.buffer[:self.batch_size]
+                try:
+                    await db.activity_logs.insert_many(batch, ordered=False)
+                except BulkWriteError as e:
+                    # Only duplicates of already-written entries are expected here; the rest were inserted
+                    logging.error(f"Activity log flush had write errors: {e.details.get('writeErrors', [])[:3]}")
+                    self.counters["errors"] += 1
+                except Exception as e:
+                    # Keep the batch and retry on the next flush
+                    logging.error(f"Activity log flush failed: {e}")
+                    self.counters["errors"] += 1
+                    return
+                del self.buffer[:len(batch)]
+                self.counters["written"] += len(batch)
+                self.counters["flushes"] += 1
+                self.space.set()
+
+    async def run(self):
+        self.running = True
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            await self.flush()
+
+    async def drain(self):
+        """Stop buffering and write whatever is left (called at shutdown)"""
+        self.running = False
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "pending": len(self.buffer), "running": self.running}
+
+activity_writer = ActivityLogWriter(ACTIVITY_BUFFER_SIZE, ACTIVITY_FLUSH_BATCH, ACTIVITY_FLUSH_SECONDS)
+
+async def log_activity(entity_type: str, entity_id: str, action: str, details: dict = None, performed_by: str = None, sync: Optional[bool] = None):
+    """Helper to log activities. Buffered unless sync=True or the action is audit-critical."""
     log_doc = {
         "id": str(uuid.uuid4()),
         "entity_type": entity_type,
@@ -2170,48 +4066,260 @@ async def log_activity(entity_type: str, entity_id: str, action: str, details: d
         "performed_by": performed_by,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.activity_logs.insert_one(log_doc)
+    if sync or (sync is None and action in AUDIT_CRITICAL_ACTIONS):
+        await db.activity_logs.insert_one(log_doc)
+    else:
+        await activity_writer.write([log_doc])
     return log_doc
 
-@api_router.get("/activities")
-async def get_activities(
+async def log_activities(entries: List[dict], sync: bool = False) -> List[dict]:
+    """Batch form of log_activity"""
+    now = datetime.now(timezone.utc).isoformat()
+    log_docs = [{
+        "id": str(uuid.uuid4()),
+        "entity_type": entry["entity_type"],
+        "entity_id": entry["entity_id"],
+        "action": entry["action"],
+        "details": entry.get("details") or {},
+        "performed_by": entry.get("performed_by"),
+        "created_at": now
+    } for entry in entries]
+    critical = [doc for doc in log_docs if sync or doc["action"] in AUDIT_CRITICAL_ACTIONS]
+    if critical:
+        await db.activity_logs.insert_many(critical, ordered=False)
+    await activity_writer.write([doc for doc in log_docs if not (sync or doc["action"] in AUDIT_CRITICAL_ACTIONS)])
+    return log_docs
+
+# performed_by values written by background processes rather than an admin
+SYSTEM_ACTORS = {
+    "system": "System",
+    "stripe_webhook": "Stripe",
+    "stripe_checkout": "Stripe Checkout",
+    "reminder_scheduler": "Automatic Reminders",
+}
+
+# Display names for activity actors, kept apart from admin_cache so feed reads never put admin
+# documents (including pending or rejected admins) into the cache that authenticates requests
+ACTOR_NAME_CACHE_TTL_SECONDS = float(os.environ.get("ACTOR_NAME_CACHE_TTL_SECONDS", "300"))
+actor_name_cache = TTLCache(ACTOR_NAME_CACHE_TTL_SECONDS)
+
+async def resolve_actor_names(actor_ids) -> Dict[str, str]:
+    """Display names for performed_by values: system actors from the map, admins from the
+    name cache, and any remaining admins with a single $in query (which also warms the cache)"""
+    names, missing = {}, []
+    for actor_id in set(filter(None, actor_ids)):
+        if actor_id in SYSTEM_ACTORS:
+            names[actor_id] = SYSTEM_ACTORS[actor_id]
+            continue
+        cached = actor_name_cache.get(actor_id)
+        if cached is not None:
+            names[actor_id] = cached
+        else:
+            missing.append(actor_id)
+    
+    if missing:
+        admins = await db.admins.find({"id": {"$in": missing}}, {"_id": 0, "id": 1, "name": 1}).to_list(len(missing))
+        for admin_user in admins:
+            names[admin_user["id"]] = admin_user.get("name") or "Unknown"
+            actor_name_cache.set(admin_user["id"], names[admin_user["id"]])
+    
+    return names
+
+async def enrich_activity_logs(logs: List[dict]) -> List[dict]:
+    """Add performed_by_name to each log and parse created_at"""
+    names = await resolve_actor_names(log.get("performed_by") for log in logs)
+    for log in logs:
+        if log.get("performed_by"):
+            log["performed_by_name"] = names.get(log["performed_by"], "Unknown")
+        log["created_at"] = datetime.fromisoformat(log["created_at"]) if isinstance(log["created_at"], str) else log["created_at"]
+    return logs
+
+def parse_activity_time(value: Optional[str], name: str) -> Optional[str]:
+    """Normalize a since/until value (date or ISO datetime) to the stored created_at format"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO date or datetime")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat()
+
+def activity_query(
     entity_type: Optional[str] = None,
     entity_id: Optional[str] = None,
-    admin=Depends(get_current_admin)
-):
-    """Get activity logs with flexible filtering"""
+    action: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None
+) -> dict:
     query = {}
     if entity_type:
         query["entity_type"] = entity_type
     if entity_id:
         query["entity_id"] = entity_id
-    
-    logs = await db.activity_logs.find(query, {"_id": 0}).sort("created_at", -1).to_list(100)
-    
+    if action:
+        actions = [a.strip() for a in action.split(",") if a.strip()]
+        query["action"] = actions[0] if len(actions) == 1 else {"$in": actions}
+    since, until = parse_activity_time(since, "since"), parse_activity_time(until, "until")
+    if since or until:
+        query["created_at"] = {}
+        if since:
+            query["created_at"]["$gte"] = since
+        if until:
+            query["created_at"]["$lt"] = until
+    return query
+
+async def activity_page(query: dict, response: Response, limit: int, cursor: Optional[str]) -> List[dict]:
+    # Make this worker's buffered entries visible first
+    await activity_writer.flush()
+    logs = await paginate(
+        db.activity_logs, query, response,
+        sort=("created_at", DESCENDING), limit=limit, cursor=cursor
+    )
     # Enrich with admin names
-    for log in logs:
-        if log.get("performed_by"):
-            admin_user = await db.admins.find_one({"id": log["performed_by"]}, {"_id": 0})
-            log["performed_by_name"] = admin_user.get("name") if admin_user else "Unknown"
-        log["created_at"] = datetime.fromisoformat(log["created_at"]) if isinstance(log["created_at"], str) else log["created_at"]
-    
-    return logs
+    return await enrich_activity_logs(logs)
+
+@api_router.get("/activities")
+async def get_activities(
+    response: Response,
+    entity_type: Optional[str] = None,
+    entity_id: Optional[str] = None,
+    action: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    admin=Depends(get_current_admin)
+):
+    """Get activity logs with flexible filtering, newest first (follow X-Next-Cursor for older pages)"""
+    query = activity_query(entity_type, entity_id, action, since, until)
+    return await activity_page(query, response, limit, cursor)
 
 @api_router.get("/activity/{entity_type}/{entity_id}")
-async def get_activity_log(entity_type: str, entity_id: str, admin=Depends(get_current_admin)):
-    logs = await db.activity_logs.find(
-        {"entity_type": entity_type, "entity_id": entity_id},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(100)
-    
-    # Enrich with admin names
-    for log in logs:
-        if log.get("performed_by"):
-            admin_user = await db.admins.find_one({"id": log["performed_by"]}, {"_id": 0})
-            log["performed_by_name"] = admin_user.get("name") if admin_user else "Unknown"
-        log["created_at"] = datetime.fromisoformat(log["created_at"]) if isinstance(log["created_at"], str) else log["created_at"]
-    
-    return logs
+async def get_activity_log(
+    entity_type: str,
+    entity_id: str,
+    response: Response,
+    action: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    admin=Depends(get_current_admin)
+):
+    query = activity_query(entity_type, entity_id, action, since, until)
+    return await activity_page(query, response, limit, cursor)
+
+# Entries older than this move from activity_logs into compressed monthly buckets in activity_log_archive
+ACTIVITY_ARCHIVE_AFTER_DAYS = int(os.environ.get("ACTIVITY_ARCHIVE_AFTER_DAYS", "365"))
+ACTIVITY_ARCHIVE_BUCKET_SIZE = 1000
+ACTIVITY_ARCHIVE_RUN_HOUR_UTC = int(os.environ.get("ACTIVITY_ARCHIVE_RUN_HOUR_UTC", "8"))
+
+def pack_activity_bucket(month: str, logs: List[dict]) -> dict:
+    ids = [log["id"] for log in logs]
+    return {
+        # Derived from the entries, so re-archiving the same batch after a crash is a no-op
+        "_id": f"{month}|{hashlib.sha1(','.join(ids).encode()).hexdigest()}",
+        "month": month,
+        "count": len(logs),
+        "first_created_at": logs[0]["created_at"],
+        "last_created_at": logs[-1]["created_at"],
+        "entity_ids": sorted({log["entity_id"] for log in logs if log.get("entity_id")}),
+        "actions": sorted({log["action"] for log in logs if log.get("action")}),
+        "data": zlib.compress(json.dumps(logs, default=str).encode(), 6),
+        "archived_at": datetime.now(timezone.utc).isoformat()
+    }
+
+def unpack_activity_bucket(bucket: dict) -> List[dict]:
+    return json.loads(zlib.decompress(bucket["data"]))
+
+async def archive_activity_logs() -> Dict[str, Any]:
+    """Move entries older than ACTIVITY_ARCHIVE_AFTER_DAYS into monthly buckets, oldest first"""
+    await activity_writer.flush()
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=ACTIVITY_ARCHIVE_AFTER_DAYS)).isoformat()
+    archived, buckets = 0, 0
+    while True:
+        batch = await db.activity_logs.find(
+            {"created_at": {"$lt": cutoff}}, {"_id": 0}
+        ).sort([("created_at", ASCENDING), ("id", ASCENDING)]).limit(ACTIVITY_ARCHIVE_BUCKET_SIZE).to_list(ACTIVITY_ARCHIVE_BUCKET_SIZE)
+        if not batch:
+            break
+        by_month: Dict[str, List[dict]] = {}
+        for log in batch:
+            by_month.setdefault(str(log.get("created_at", ""))[:7], []).append(log)
+        for month, logs in by_month.items():
+            try:
+                await db.activity_log_archive.insert_one(pack_activity_bucket(month, logs))
+                buckets += 1
+            except DuplicateKeyError:
+                pass  # Archived on a previous run that stopped before deleting
+            await db.activity_logs.delete_many({"id": {"$in": [log["id"] for log in logs]}})
+            archived += len(logs)
+    return {"archived": archived, "buckets": buckets, "cutoff": cutoff}
+
+@api_router.post("/activities/archive/run")
+async def run_activity_archival(admin=Depends(get_current_admin)):
+    """Archive old activity entries now instead of waiting for the nightly job"""
+    result = await run_job_now("activity_archival", archive_activity_logs)
+    if result is None:
+        raise HTTPException(status_code=409, detail="Archival is already running on another worker")
+    return result
+
+@api_router.get("/activities/archive")
+async def get_archived_activities(
+    response: Response,
+    month: Optional[str] = None,
+    entity_type: Optional[str] = None,
+    entity_id: Optional[str] = None,
+    action: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    admin=Depends(get_current_admin)
+):
+    """Read archived entries for a month (YYYY-MM) and/or an entity, newest first (follow X-Next-Cursor for older pages)"""
+    if not month and not entity_id:
+        raise HTTPException(status_code=400, detail="month or entity_id is required")
+    if month and not re.fullmatch(r"\d{4}-\d{2}", month):
+        raise HTTPException(status_code=400, detail="month must be YYYY-MM")
+    
+    bucket_query = {}
+    if month:
+        bucket_query["month"] = month
+    if entity_id:
+        bucket_query["entity_ids"] = entity_id
+    actions = {a.strip() for a in action.split(",")} if action else None
+    after = decode_cursor(cursor) if cursor else None
+    if after:
+        # Only buckets reaching back past the cursor can hold older entries
+        bucket_query["first_created_at"] = {"$lte": after[0]}
+    
+    def sort_key(log: dict) -> tuple:
+        return log.get("created_at") or "", log.get("id") or ""
+    
+    # Walk buckets newest first and stop once the next one is entirely older than a full page
+    logs = []
+    async for bucket in db.activity_log_archive.find(bucket_query).sort("last_created_at", DESCENDING):
+        if len(logs) > limit:
+            logs.sort(key=sort_key, reverse=True)
+            del logs[limit + 1:]
+            if bucket["last_created_at"] < logs[-1]["created_at"]:
+                break
+        for log in unpack_activity_bucket(bucket):
+            if entity_type and log.get("entity_type") != entity_type:
+                continue
+            if entity_id and log.get("entity_id") != entity_id:
+                continue
+            if actions and log.get("action") not in actions:
+                continue
+            if after and sort_key(log) >= tuple(after):
+                continue
+            logs.append(log)
+    logs.sort(key=sort_key, reverse=True)
+    if len(logs) > limit:
+        logs = logs[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(logs[-1].get("created_at"), logs[-1].get("id"))
+    return await enrich_activity_logs(logs)
 
 class NoteRequest(BaseModel):
     entity_type: str
@@ -2252,20 +4360,32 @@ async def create_expense(data: ExpenseCreate, admin=Depends(get_current_admin)):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.expenses.insert_one(expense_doc)
+    await bump_financial_rollup("expense", data.category, data.amount, data.date, expense_doc["created_at"])
     expense_doc.pop("_id", None)
     expense_doc["created_at"] = datetime.fromisoformat(expense_doc["created_at"])
     return ExpenseResponse(**expense_doc)
 
 @api_router.get("/expenses", response_model=List[ExpenseResponse])
 async def get_expenses(
+    response: Response,
     category: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort: str = "-created_at",
+    fields: Optional[str] = None,
     admin=Depends(get_current_admin)
 ):
     query = {}
     if category:
         query["category"] = category
     
-    expenses = await db.expenses.find(query, {"_id": 0}).to_list(1000)
+    expenses = await paginate(
+        db.expenses, query, response,
+        sort=parse_sort(sort, ("created_at", "date", "amount")),
+        limit=limit, cursor=cursor, fields=fields
+    )
+    if fields:
+        return projected_response(expenses, response)
     for e in expenses:
         e["created_at"] = datetime.fromisoformat(e["created_at"])
     return [ExpenseResponse(**e) for e in expenses]
@@ -2285,6 +4405,94 @@ class SavedReportCreate(BaseModel):
     sort_by: Optional[str] = None
     sort_order: Optional[str] = "asc"
 
+# Saved reports run against campers; filters, sort and columns are limited to these fields
+REPORT_FIELDS = frozenset(CamperResponse.model_fields)
+REPORT_OPERATORS = {"$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin", "$exists"}
+# Scalar camper fields with a (key, id) index, so keyset pages never sort in memory or walk array values
+REPORT_SORT_KEYS = ("last_name", "first_name", "status", "grade", "created_at")
+REPORT_DEFAULT_SORT = "last_name"
+_REPORT_SCALARS = (str, int, float, bool, type(None))
+
+def compile_report_filters(filters: Optional[dict]) -> dict:
+    """Compile saved filters into a Mongo query.
+
+    Accepts {field: value}, {field: [values]} and {field: {"$op": value}} with
+    operators from REPORT_OPERATORS and scalar values only, so a report can't
+    smuggle in $where, $regex, $expr or nested documents.
+    """
+    query = {}
+    for field, condition in (filters or {}).items():
+        if field not in REPORT_FIELDS:
+            raise HTTPException(status_code=400, detail=f"Cannot filter on '{field}'")
+        if isinstance(condition, list):
+            condition = {"$in": condition}
+        elif not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        compiled = {}
+        for op, value in condition.items():
+            if op not in REPORT_OPERATORS:
+                raise HTTPException(status_code=400, detail=f"Unsupported operator '{op}' on '{field}'")
+            if (op in ("$in", "$nin")) != isinstance(value, list):
+                raise HTTPException(status_code=400, detail=f"'{op}' on '{field}' needs {'a list' if op in ('$in', '$nin') else 'a single value'}")
+            if op == "$exists" and not isinstance(value, bool):
+                raise HTTPException(status_code=400, detail=f"'$exists' on '{field}' must be true or false")
+            if not all(isinstance(v, _REPORT_SCALARS) for v in (value if isinstance(value, list) else [value])):
+                raise HTTPException(status_code=400, detail=f"Filter values for '{field}' must be plain values")
+            compiled[op] = value
+        query[field] = compiled["$eq"] if list(compiled) == ["$eq"] else compiled
+    return query
+
+def compile_report(report: dict, strict: bool = True) -> tuple:
+    """(query, sort, columns) for a saved report, validated against REPORT_FIELDS.
+
+    Saves and updates run strict, so a new report can't pick an unindexed sort key. Reports
+    saved before REPORT_SORT_KEYS existed still run (strict=False), on the default sort.
+    """
+    query = compile_report_filters(report.get("filters"))
+    sort_by = report.get("sort_by") or REPORT_DEFAULT_SORT
+    if not strict and sort_by not in REPORT_SORT_KEYS:
+        logger.warning(f"Saved report '{report.get('name')}' sorts on unindexed '{sort_by}'; using '{REPORT_DEFAULT_SORT}'")
+        sort_by = REPORT_DEFAULT_SORT
+    sort_by, direction = parse_sort(
+        ("-" if report.get("sort_order") == "desc" else "") + sort_by, REPORT_SORT_KEYS
+    )
+    columns = report.get("columns") or []
+    unknown = [c for c in columns if c not in REPORT_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown columns: {unknown}")
+    return query, (sort_by, direction), columns
+
+async def explain_report_query(query: dict, sort: tuple) -> Dict[str, Any]:
+    """Summarize the winning plan for a report query: which indexes it uses and whether it scans or sorts in memory"""
+    key, direction = sort
+    explained = await db.command({
+        "explain": {"find": "campers", "filter": query, "sort": {key: direction, "id": direction}},
+        "verbosity": "queryPlanner"
+    })
+    winning = explained["queryPlanner"]["winningPlan"]
+    stages, indexes = [], []
+    pending = [winning.get("queryPlan", winning)]
+    while pending:
+        node = pending.pop()
+        stages.append(node.get("stage"))
+        if node.get("indexName"):
+            indexes.append(node["indexName"])
+        pending.extend(filter(None, [node.get("inputStage"), *node.get("inputStages", [])]))
+    return {
+        "indexes": indexes,
+        "collection_scan": "COLLSCAN" in stages,
+        "in_memory_sort": "SORT" in stages,
+        "stages": stages
+    }
+
+async def check_report_plan(report: dict, strict: bool = True) -> Dict[str, Any]:
+    query, sort, _ = compile_report(report, strict)
+    plan = await explain_report_query(query, sort)
+    # The sort key always has an index; a selective filter may still make the planner prefer another one
+    if plan["collection_scan"] or plan["in_memory_sort"]:
+        logger.warning(f"Saved report '{report.get('name')}' is not fully index-backed: {plan['stages']}")
+    return plan
+
 @api_router.get("/reports")
 async def get_saved_reports(admin=Depends(get_current_admin)):
     """Get all saved reports/lists"""
@@ -2300,28 +4508,31 @@ async def create_saved_report(data: SavedReportCreate, admin=Depends(get_current
         "created_by": admin.get("id"),
         "created_at": datetime.now(timezone.utc).isoformat()
     }
+    report_doc["plan"] = await check_report_plan(report_doc)
     await db.saved_reports.insert_one(report_doc)
     return {"message": "Report saved", "id": report_doc["id"]}
 
 @api_router.get("/reports/{report_id}")
-async def get_saved_report(report_id: str, admin=Depends(get_current_admin)):
-    """Get a specific saved report with data"""
+async def get_saved_report(
+    report_id: str,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    admin=Depends(get_current_admin)
+):
+    """Get a specific saved report with one page of data (follow X-Next-Cursor for more)"""
     report = await db.saved_reports.find_one({"id": report_id}, {"_id": 0})
     if not report:
         raise HTTPException(status_code=404, detail="Report not found")
     
-    # Get camper data based on report config
-    query = report.get("filters", {}) or {}
-    campers = await db.campers.find(query, {"_id": 0}).to_list(1000)
-    
-    # Sort if configured
-    if report.get("sort_by"):
-        reverse = report.get("sort_order", "asc") == "desc"
-        sort_key = report["sort_by"]
-        campers.sort(key=lambda x: (x.get(sort_key) is None, x.get(sort_key, "") or ""), reverse=reverse)
+    # Filter, sort, project and limit on the server
+    query, sort, columns = compile_report(report, strict=False)
+    campers = await paginate(
+        db.campers, query, response, sort=sort, limit=limit, cursor=cursor,
+        fields=",".join(columns) if columns else None
+    )
     
-    # Filter to only requested columns
-    columns = report.get("columns", [])
+    # Shape rows to exactly the requested columns
     if columns:
         filtered_data = []
         for camper in campers:
@@ -2336,14 +4547,24 @@ async def get_saved_report(report_id: str, admin=Depends(get_current_admin)):
 @api_router.put("/reports/{report_id}")
 async def update_saved_report(report_id: str, data: SavedReportCreate, admin=Depends(get_current_admin)):
     """Update a saved report"""
+    update = data.model_dump()
+    update["plan"] = await check_report_plan(update)
     result = await db.saved_reports.update_one(
         {"id": report_id},
-        {"$set": data.model_dump()}
+        {"$set": update}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Report not found")
     return {"message": "Report updated"}
 
+@api_router.get("/reports/{report_id}/explain")
+async def explain_saved_report(report_id: str, admin=Depends(get_current_admin)):
+    """Show how a saved report's query is executed (index use, collection scans, in-memory sorts)"""
+    report = await db.saved_reports.find_one({"id": report_id}, {"_id": 0})
+    if not report:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return await check_report_plan(report, strict=False)
+
 @api_router.delete("/reports/{report_id}")
 async def delete_saved_report(report_id: str, admin=Depends(get_current_admin)):
     """Delete a saved report"""
@@ -2354,48 +4575,213 @@ async def delete_saved_report(report_id: str, admin=Depends(get_current_admin)):
 
 # ==================== FINANCIAL ROUTES ====================
 
+# Payments and expenses are rolled up per day into db.financial_rollups as
+# {"_id": "<kind>|<day>|<key>", "kind": "payment"|"expense", "day", "key": method/category, "amount", "count"}
+# so summaries over any date range are a small $group instead of a scan of every document.
+SEASON_START_MONTH = int(os.environ.get("SEASON_START_MONTH", "1"))
+
+def rollup_day(day: Optional[str], created_at: Optional[str] = None) -> str:
+    """The day a payment/expense is rolled up under: its date, else its created_at, else today"""
+    return (day or created_at or datetime.now(timezone.utc).isoformat())[:10]
+
+def rollup_day_expr(day_field: str, created_field: str = "$created_at") -> dict:
+    """rollup_day as an aggregation expression, so rebuilds bucket exactly like bumps"""
+    def present(field):
+        return {"$ne": [{"$ifNull": [field, ""]}, ""]}
+    today = {"$dateToString": {"format": "%Y-%m-%d", "date": "$$NOW"}}
+    return {"$substrCP": [
+        {"$cond": [present(day_field), day_field, {"$cond": [present(created_field), created_field, today]}]}, 0, 10
+    ]}
+
+async def bump_financial_rollup(kind: str, key: Optional[str], amount: float, day: Optional[str], created_at: Optional[str] = None):
+    """Apply one payment/expense to its day's rollup"""
+    day = rollup_day(day, created_at)
+    key = key or "other"
+    await db.financial_rollups.update_one(
+        {"_id": f"{kind}|{day}|{key}"},
+        {"$inc": {"amount": amount, "count": 1}, "$set": {"kind": kind, "day": day, "key": key}},
+        upsert=True
+    )
+
+ROLLUP_STAGING_COLLECTION = "financial_rollups_staging"
+
+def rollup_pipeline(kind: str, day_expr: dict, key_field: str, match: dict) -> List[dict]:
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": {"day": day_expr, "key": {"$ifNull": [key_field, "other"]}},
+            "amount": {"$sum": {"$ifNull": ["$amount", 0]}},
+            "count": {"$sum": 1}
+        }},
+        {"$project": {
+            "_id": {"$concat": [kind, "|", "$_id.day", "|", "$_id.key"]},
+            "kind": kind, "day": "$_id.day", "key": "$_id.key", "amount": 1, "count": 1
+        }}
+    ]
+
+ROLLUP_SOURCES = {
+    # kind: (collection, day expression, key field, base match)
+    "payment": ("payments", rollup_day_expr("$created_at"), "$method", {"status": "completed"}),
+    "expense": ("expenses", rollup_day_expr("$date"), "$category", {}),
+}
+
+async def _rebuild_financial_rollups() -> Dict[str, Any]:
+    cutoff = datetime.now(timezone.utc).isoformat()
+    staging = db[ROLLUP_STAGING_COLLECTION]
+    await staging.drop()
+    
+    # Build the new rollups server-side in a staging collection; readers keep the old ones meanwhile
+    for kind, (source, day_expr, key_field, match) in ROLLUP_SOURCES.items():
+        await db[source].aggregate(
+            rollup_pipeline(kind, day_expr, key_field, {**match, "created_at": {"$lt": cutoff}})
+            + [{"$merge": {"into": ROLLUP_STAGING_COLLECTION, "whenMatched": "replace"}}]
+        ).to_list(None)
+    
+    rollups = await staging.estimated_document_count()
+    if rollups:
+        await staging.create_indexes([
+            IndexModel(keys, name=name, **options) for name, keys, options in REQUIRED_INDEXES["financial_rollups"]
+        ])
+        await staging.rename("financial_rollups", dropTarget=True)
+    else:
+        await db.financial_rollups.delete_many({})
+    
+    # Bumps for records created while the staging copy was built went to the replaced collection;
+    # recompute the days they touched straight from source
+    caught_up = 0
+    for kind, (source, day_expr, key_field, match) in ROLLUP_SOURCES.items():
+        days = await db[source].aggregate([
+            {"$match": {**match, "created_at": {"$gte": cutoff}}},
+            {"$group": {"_id": day_expr}}
+        ]).to_list(None)
+        days = [d["_id"] for d in days]
+        if not days:
+            continue
+        fresh = await db[source].aggregate(
+            rollup_pipeline(kind, day_expr, key_field, {**match, "$expr": {"$in": [day_expr, days]}})
+        ).to_list(None)
+        await db.financial_rollups.delete_many({
+            "kind": kind, "day": {"$in": days}, "_id": {"$nin": [r["_id"] for r in fresh]}
+        })
+        if fresh:
+            await db.financial_rollups.bulk_write(
+                [ReplaceOne({"_id": r["_id"]}, r, upsert=True) for r in fresh], ordered=False
+            )
+        caught_up += len(days)
+    return {"rollups": rollups, "days_caught_up": caught_up, "cutoff": cutoff}
+
+async def rebuild_financial_rollups() -> Optional[Dict[str, Any]]:
+    """Recompute every rollup from payments and expenses (backfill, or repair after manual edits).
+
+    Runs under a lease so two workers never rebuild at once; None if another worker is rebuilding.
+    """
+    return await run_job_now("financial_rollups_rebuild", _rebuild_financial_rollups)
+
+def season_date_range(season: int) -> tuple:
+    """First and last day of a season; with SEASON_START_MONTH=9, season 2026 runs Sep 2025 - Aug 2026"""
+    if SEASON_START_MONTH == 1:
+        return f"{season}-01-01", f"{season}-12-31"
+    start = datetime(season - 1, SEASON_START_MONTH, 1)
+    end = datetime(season, SEASON_START_MONTH, 1) - timedelta(days=1)
+    return start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+
+def financial_date_range(start_date: Optional[str], end_date: Optional[str], season: Optional[int]) -> tuple:
+    if season is not None:
+        season_start, season_end = season_date_range(season)
+        start_date = max(start_date or season_start, season_start)
+        end_date = min(end_date or season_end, season_end)
+    for value in (start_date, end_date):
+        if value:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    return start_date, end_date
+
 @api_router.get("/financial/summary")
-async def get_financial_summary(admin=Depends(get_current_admin)):
-    # Get all invoices
-    invoices = await db.invoices.find({}, {"_id": 0}).to_list(1000)
-    total_invoiced = sum(inv["amount"] for inv in invoices)
-    total_collected = sum(inv["paid_amount"] for inv in invoices)
-    total_outstanding = total_invoiced - total_collected
-    
-    # Get all expenses
-    expenses = await db.expenses.find({}, {"_id": 0}).to_list(1000)
-    total_expenses = sum(exp["amount"] for exp in expenses)
-    
-    # Expenses by category
-    expense_by_category = {}
-    for exp in expenses:
-        cat = exp["category"]
-        expense_by_category[cat] = expense_by_category.get(cat, 0) + exp["amount"]
+async def get_financial_summary(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    season: Optional[int] = None,
+    admin=Depends(get_current_admin)
+):
+    """Billing totals (invoices created in the range) plus payment and expense breakdowns (dated in the range)"""
+    start_date, end_date = financial_date_range(start_date, end_date, season)
+    
+    invoice_match, rollup_match = {}, {}
+    if start_date:
+        invoice_match.setdefault("created_at", {})["$gte"] = start_date
+        rollup_match.setdefault("day", {})["$gte"] = start_date
+    if end_date:
+        next_day = (datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+        invoice_match.setdefault("created_at", {})["$lt"] = next_day
+        rollup_match.setdefault("day", {})["$lte"] = end_date
+    
+    invoice_totals, rollups = await asyncio.gather(
+        db.invoices.aggregate([
+            {"$match": invoice_match},
+            # Same rules as the ledger: a deleted invoice still counts for whatever was paid on it
+            {"$group": {
+                "_id": None,
+                "invoiced": {"$sum": {"$cond": [
+                    {"$eq": ["$is_deleted", True]},
+                    {"$min": [{"$ifNull": ["$amount", 0]}, {"$ifNull": ["$paid_amount", 0]}]},
+                    {"$ifNull": ["$amount", 0]}
+                ]}},
+                "collected": {"$sum": {"$ifNull": ["$paid_amount", 0]}}
+            }}
+        ]).to_list(1),
+        db.financial_rollups.aggregate([
+            {"$match": rollup_match},
+            {"$group": {"_id": {"kind": "$kind", "key": "$key"}, "amount": {"$sum": "$amount"}}}
+        ]).to_list(None)
+    )
     
-    # Payment method breakdown
-    payments = await db.payments.find({"status": "completed"}, {"_id": 0}).to_list(1000)
-    payment_by_method = {}
-    for pay in payments:
-        method = pay["method"]
-        payment_by_method[method] = payment_by_method.get(method, 0) + pay["amount"]
+    totals = invoice_totals[0] if invoice_totals else {}
+    total_invoiced = round(totals.get("invoiced", 0), 2)
+    total_collected = round(totals.get("collected", 0), 2)
+    expense_by_category, payment_by_method = {}, {}
+    for row in rollups:
+        target = expense_by_category if row["_id"]["kind"] == "expense" else payment_by_method
+        target[row["_id"]["key"]] = round(row["amount"], 2)
+    total_expenses = round(sum(expense_by_category.values()), 2)
     
     return {
         "total_invoiced": total_invoiced,
         "total_collected": total_collected,
-        "total_outstanding": total_outstanding,
+        "total_outstanding": round(total_invoiced - total_collected, 2),
         "total_expenses": total_expenses,
-        "net_income": total_collected - total_expenses,
+        "net_income": round(total_collected - total_expenses, 2),
         "expense_by_category": expense_by_category,
-        "payment_by_method": payment_by_method
+        "payment_by_method": payment_by_method,
+        "start_date": start_date,
+        "end_date": end_date,
+        "season": season
     }
 
+@api_router.post("/financial/rollups/rebuild")
+async def rebuild_rollups(admin=Depends(get_current_admin)):
+    """Recompute the payment/expense rollups from source documents"""
+    result = await rebuild_financial_rollups()
+    if result is None:
+        raise HTTPException(status_code=409, detail="A rollup rebuild is already running on another worker")
+    return result
+
 @api_router.get("/financial/quickbooks-export")
-async def export_quickbooks(admin=Depends(get_current_admin)):
-    """Export financial data in QuickBooks-compatible format (IIF)"""
-    invoices = await db.invoices.find({}, {"_id": 0}).to_list(1000)
-    payments = await db.payments.find({}, {"_id": 0}).to_list(1000)
-    expenses = await db.expenses.find({}, {"_id": 0}).to_list(1000)
-    campers = await db.campers.find({}, {"_id": 0}).to_list(1000)
+async def export_quickbooks(format: str = "json", gzip: bool = False, admin=Depends(get_current_admin)):
+    """Export financial data for QuickBooks. format=iif streams a real IIF import file."""
+    if format == "iif":
+        return streaming_export_response(iter_quickbooks_iif(), "quickbooks_export.iif", "text/plain; charset=utf-8", gzip)
+    if format != "json":
+        raise HTTPException(status_code=400, detail="Invalid format. Must be one of: ['json', 'iif']")
+
+    invoices = await db.invoices.find({}, {"_id": 0}).to_list(None)
+    payments = await db.payments.find({}, {"_id": 0}).to_list(None)
+    expenses = await db.expenses.find({}, {"_id": 0}).to_list(None)
+    camper_ids = list({inv.get("camper_id") for inv in invoices if inv.get("camper_id")})
+    campers = await db.campers.find(
+        {"id": {"$in": camper_ids}}, {"_id": 0, "id": 1, "first_name": 1, "last_name": 1}
+    ).to_list(None)
     
     camper_map = {c["id"]: c for c in campers}
     
@@ -2545,6 +4931,136 @@ async def send_invoice_reminder(invoice_id: str, reminder_type: str = "manual",
         "camper": f"{camper.get('first_name', '')} {camper.get('last_name', '')}".strip()
     }
 
+# ==================== AUTOMATIC REMINDERS ====================
+
+REMINDER_SCHEDULER_ENABLED = os.environ.get("REMINDER_SCHEDULER_ENABLED", "true").lower() == "true"
+REMINDER_RUN_HOUR_UTC = int(os.environ.get("REMINDER_RUN_HOUR_UTC", "13"))
+REMINDER_BATCH_SIZE = 200
+
+def reminder_schedule_from_settings(settings: dict) -> dict:
+    """Reminder cadence from settings: every N days before the due date, then the configured days after"""
+    days_before = settings.get("reminder_days_before") or REMINDER_SCHEDULE["pre_due"][0]
+    max_days_before = max(REMINDER_SCHEDULE["pre_due"])
+    return {
+        "pre_due": list(range(days_before, max_days_before + 1, days_before)),
+        "on_due": 0,
+        "post_due": settings.get("reminder_days_after") or REMINDER_SCHEDULE["post_due"]
+    }
+
+def camp_merge_data(settings: dict) -> Dict[str, Any]:
+    return {
+        "camp_name": settings.get("camp_name") or "Camp Baraisa",
+        "camp_email": settings.get("camp_email") or "",
+        "camp_phone": settings.get("camp_phone") or "",
+    }
+
+async def _send_reminder_batch(invoices: List[dict], template, settings: dict, schedule: dict, today: str, dry_run: bool) -> List[dict]:
+    camper_ids = list({inv["camper_id"] for inv in invoices if inv.get("camper_id")})
+    campers = await db.campers.find({"id": {"$in": camper_ids}}, {"_id": 0}).to_list(None)
+    campers_by_id = {c["id"]: c for c in campers}
+    now = datetime.now(timezone.utc).isoformat()
+
+    comm_docs, invoice_updates, activity_entries, sent = [], [], [], []
+    for inv in invoices:
+        camper = campers_by_id.get(inv.get("camper_id"))
+        amount_due = (inv.get("amount") or 0) - (inv.get("paid_amount") or 0)
+        reminder_sent_dates = [*(inv.get("reminder_sent_dates") or []), today]
+        next_reminder = calculate_next_reminder(inv.get("due_date"), reminder_sent_dates, schedule)
+
+        if not camper or amount_due <= 0:
+            # Nothing to remind about; just stop this invoice from matching again
+            invoice_updates.append(UpdateOne({"id": inv["id"]}, {"$set": {"next_reminder_date": None}}))
+            continue
+
+        merge_data = {
+            **camp_merge_data(settings),
+            **camper_merge_data(camper),
+            "amount_due": f"${amount_due:,.2f}",
+            "due_date": inv.get("due_date", ""),
+            "invoice_number": inv.get("invoice_number", ""),
+            "invoice_amount": f"${inv.get('amount', 0):,.2f}",
+        }
+        if template:
+            subject, body = template.render(merge_data)
+        else:
+            subject = f"Payment Reminder - {camper.get('first_name')} {camper.get('last_name')}"
+            body = f"Reminder for invoice ${inv['amount']} - Due: {inv.get('due_date')}"
+
+        comm_doc = {
+            "id": str(uuid.uuid4()),
+            "camper_id": camper["id"],
+            "type": template.template_type if template else "email",
+            "subject": subject,
+            "message": body,
+            "direction": "outbound",
+            "status": "pending",
+            "recipient_email": camper.get("parent_email"),
+            "recipient_phone": camper.get("father_cell") or camper.get("mother_cell"),
+            "template_id": template.id if template else None,
+            "invoice_id": inv["id"],
+            "created_at": now
+        }
+        comm_docs.append(comm_doc)
+        invoice_updates.append(UpdateOne(
+            {"id": inv["id"]},
+            {"$push": {"reminder_sent_dates": today},
+             "$set": {"next_reminder_date": next_reminder, "last_reminder_sent": now}}
+        ))
+        activity_entries.append({
+            "entity_type": "camper",
+            "entity_id": camper["id"],
+            "action": "reminder_sent",
+            "details": {"invoice_id": inv["id"], "reminder_date": today, "next_reminder": next_reminder,
+                        "email_id": comm_doc["id"], "automatic": True},
+            "performed_by": "reminder_scheduler"
+        })
+        sent.append({"invoice_id": inv["id"], "camper_id": camper["id"], "amount_due": amount_due,
+                     "recipient_email": camper.get("parent_email"), "next_reminder_date": next_reminder})
+
+    if not dry_run:
+        if comm_docs:
+            await db.communications.insert_many(comm_docs, ordered=False)
+        if invoice_updates:
+            await db.invoices.bulk_write(invoice_updates, ordered=False)
+        await log_activities(activity_entries)
+    return sent
+
+async def send_due_invoice_reminders(dry_run: bool = False) -> Dict[str, Any]:
+    """Queue reminders for every open invoice whose next_reminder_date has arrived, in batches"""
+    settings = await db.settings.find_one({}, {"_id": 0}) or {}
+    if not settings.get("auto_reminders_enabled", True) and not dry_run:
+        return {"sent": 0, "skipped": "Automatic reminders are disabled in settings"}
+
+    schedule = reminder_schedule_from_settings(settings)
+    today = datetime.now(timezone.utc).date().isoformat()
+    template = await get_compiled_template(trigger="payment_reminder", template_type="email")
+    query = {
+        "next_reminder_date": {"$ne": None, "$lte": today},
+        "status": {"$nin": ["paid", "cancelled"]},
+        "is_deleted": {"$ne": True}
+    }
+
+    # Walk by id so batches stay consistent while processed invoices drop out of the query
+    sent, last_id = [], ""
+    while True:
+        batch = await db.invoices.find({**query, "id": {"$gt": last_id}}, {"_id": 0}).sort("id", 1).limit(REMINDER_BATCH_SIZE).to_list(REMINDER_BATCH_SIZE)
+        if not batch:
+            break
+        sent.extend(await _send_reminder_batch(batch, template, settings, schedule, today, dry_run))
+        last_id = batch[-1]["id"]
+
+    return {"sent": len(sent), "dry_run": dry_run, "date": today, "reminders": sent}
+
+@api_router.post("/invoices/reminders/run")
+async def run_invoice_reminders(dry_run: bool = False, admin=Depends(get_current_admin)):
+    """Run the automatic reminder job now (dry_run previews without queueing anything)"""
+    if dry_run:
+        return await send_due_invoice_reminders(dry_run=True)
+    result = await run_job_now("invoice_reminders", send_due_invoice_reminders)
+    if result is None:
+        raise HTTPException(status_code=409, detail="Reminder job is already running on another worker")
+    return result
+
 # ==================== EMAIL TEMPLATE ROUTES ====================
 
 @api_router.get("/template-merge-fields")
@@ -2563,6 +5079,7 @@ async def seed_default_templates(admin=Depends(get_current_admin)):
                 **template
             }
             await db.email_templates.insert_one(template_doc)
+        invalidate_template_cache()
         return {"message": f"Created {len(DEFAULT_TEMPLATES)} default templates"}
     return {"message": "Templates already exist"}
 
@@ -2577,14 +5094,12 @@ async def preview_template(
     """Preview a template with real data from a camper"""
     # Get template content
     if template_id:
-        template = await db.email_templates.find_one({"id": template_id}, {"_id": 0})
+        template = await get_compiled_template(template_id=template_id)
         if not template:
             raise HTTPException(status_code=404, detail="Template not found")
-        subject = template.get("subject", "")
-        body = template.get("body", "")
     elif custom_subject is not None or custom_body is not None:
-        subject = custom_subject or ""
-        body = custom_body or ""
+        # Ad-hoc content is compiled per request and never cached
+        template = CompiledTemplate({"subject": custom_subject or "", "body": custom_body or ""})
     else:
         raise HTTPException(status_code=400, detail="Either template_id or custom content required")
     
@@ -2606,26 +5121,7 @@ async def preview_template(
     if camper_id:
         camper = await db.campers.find_one({"id": camper_id}, {"_id": 0})
         if camper:
-            merge_data["camper_first_name"] = camper.get("first_name", "")
-            merge_data["camper_last_name"] = camper.get("last_name", "")
-            merge_data["camper_full_name"] = f"{camper.get('first_name', '')} {camper.get('last_name', '')}"
-            merge_data["camper_grade"] = camper.get("grade", "")
-            merge_data["camper_yeshiva"] = camper.get("yeshiva", "")
-            merge_data["camper_status"] = camper.get("status", "")
-            merge_data["due_date"] = camper.get("due_date", "")
-            
-            # Parent data is now embedded in camper
-            merge_data["parent_father_title"] = camper.get("father_title", "Mr.")
-            merge_data["parent_father_first_name"] = camper.get("father_first_name", "")
-            merge_data["parent_father_last_name"] = camper.get("father_last_name", "")
-            merge_data["parent_father_cell"] = camper.get("father_cell", "")
-            merge_data["parent_mother_first_name"] = camper.get("mother_first_name", "")
-            merge_data["parent_mother_last_name"] = camper.get("mother_last_name", "")
-            merge_data["parent_mother_cell"] = camper.get("mother_cell", "")
-            merge_data["parent_email"] = camper.get("parent_email", "")
-            merge_data["parent_address"] = camper.get("address", "")
-            merge_data["payment_link"] = f"{os.environ.get('FRONTEND_URL', '')}/portal/{camper.get('portal_token', '')}"
-            merge_data["total_balance"] = f"${camper.get('total_balance', 0):,.2f}"
+            merge_data.update(camper_merge_data(camper))
             
             # Calculate amount due from invoices (now linked by camper_id)
             invoices = await db.invoices.find({"camper_id": camper["id"], "status": {"$ne": "paid"}}, {"_id": 0}).to_list(100)
@@ -2655,13 +5151,8 @@ async def preview_template(
             "due_date": "March 15, 2026"
         })
     
-    # Replace merge fields in subject and body
-    rendered_subject = subject
-    rendered_body = body
-    for key, value in merge_data.items():
-        placeholder = "{{" + key + "}}"
-        rendered_subject = rendered_subject.replace(placeholder, str(value) if value else "")
-        rendered_body = rendered_body.replace(placeholder, str(value) if value else "")
+    # Fill merge fields in subject and body
+    rendered_subject, rendered_body = template.render(merge_data)
     
     return {
         "subject": rendered_subject,
@@ -2674,16 +5165,20 @@ async def delete_email_template(template_id: str, admin=Depends(get_current_admi
     result = await db.email_templates.delete_one({"id": template_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Template not found")
+    invalidate_template_cache(template_id)
     return {"message": "Template deleted"}
 
 @api_router.post("/email-templates", response_model=EmailTemplateResponse)
 async def create_email_template(data: EmailTemplateCreate, admin=Depends(get_current_admin)):
+    validate_template_fields(data.subject, data.body)
     template_doc = {
         "id": str(uuid.uuid4()),
-        **data.model_dump()
+        **data.model_dump(),
+        "version": 1
     }
     await db.email_templates.insert_one(template_doc)
     template_doc.pop("_id", None)
+    invalidate_template_cache()
     return EmailTemplateResponse(**template_doc)
 
 @api_router.get("/email-templates", response_model=List[EmailTemplateResponse])
@@ -2697,17 +5192,20 @@ async def get_email_templates(admin=Depends(get_current_admin)):
                 **template
             }
             await db.email_templates.insert_one(template_doc)
+        invalidate_template_cache()
         templates = await db.email_templates.find({}, {"_id": 0}).to_list(100)
     return [EmailTemplateResponse(**t) for t in templates]
 
 @api_router.put("/email-templates/{template_id}", response_model=EmailTemplateResponse)
 async def update_email_template(template_id: str, data: EmailTemplateCreate, admin=Depends(get_current_admin)):
+    validate_template_fields(data.subject, data.body)
     result = await db.email_templates.update_one(
         {"id": template_id},
-        {"$set": data.model_dump()}
+        {"$set": data.model_dump(), "$inc": {"version": 1}}
     )
-    if result.modified_count == 0:
+    if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Template not found")
+    invalidate_template_cache(template_id)
     template = await db.email_templates.find_one({"id": template_id}, {"_id": 0})
     return EmailTemplateResponse(**template)
 
@@ -2745,6 +5243,193 @@ async def update_settings(data: SettingsBase, admin=Depends(get_current_admin)):
 
 # ==================== STRIPE WEBHOOK ====================
 
+# Events are stored under a unique event_id and acknowledged right away; workers apply them.
+# Each invoice hashes to one worker queue, so its events are applied in arrival order.
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = 10000
+WEBHOOK_MAX_ATTEMPTS = 8
+WEBHOOK_LOCK_SECONDS = 120
+WEBHOOK_SWEEP_SECONDS = 30
+webhook_queues: List[asyncio.Queue] = []
+webhook_stats = {"received": 0, "duplicates": 0, "processed": 0, "retried": 0, "failed": 0}
+
+async def ingest_checkout_webhook(webhook_response) -> bool:
+    """Store a parsed checkout webhook (from the payment provider) for the workers"""
+    metadata = webhook_response.metadata or {}
+    return await ingest_stripe_event(
+        event_id=webhook_response.event_id,
+        event_type=webhook_response.event_type,
+        source="checkout",
+        payload=json.dumps({
+            "session_id": webhook_response.session_id,
+            "payment_status": webhook_response.payment_status,
+            "metadata": metadata
+        }),
+        ordering_key=metadata.get("invoice_id") or webhook_response.session_id
+    )
+
+def webhook_shard(ordering_key: str) -> int:
+    return zlib.crc32(ordering_key.encode()) % WEBHOOK_WORKERS
+
+def enqueue_stripe_event(event_id: str, ordering_key: str):
+    """Hand an event to its worker; if the queue is full (or workers aren't running) the sweeper picks it up"""
+    if not webhook_queues:
+        return
+    try:
+        webhook_queues[webhook_shard(ordering_key)].put_nowait(event_id)
+    except asyncio.QueueFull:
+        pass
+
+async def ingest_stripe_event(event_id: str, event_type: str, source: str, payload: str, ordering_key: Optional[str] = None) -> bool:
+    """Persist a webhook event once; returns False for a redelivery of an event already stored"""
+    now = datetime.now(timezone.utc).isoformat()
+    ordering_key = ordering_key or event_id
+    try:
+        await db.stripe_events.insert_one({
+            "id": str(uuid.uuid4()),
+            "event_id": event_id,
+            "event_type": event_type,
+            "source": source,
+            "payload": payload,
+            "ordering_key": ordering_key,
+            "status": "pending",
+            "attempts": 0,
+            # Queued right away; the sweeper only requeues it if it's still pending after the lock window
+            "next_attempt_at": (datetime.now(timezone.utc) + timedelta(seconds=WEBHOOK_LOCK_SECONDS)).isoformat(),
+            "received_at": now
+        })
+    except DuplicateKeyError:
+        webhook_stats["duplicates"] += 1
+        return False
+    webhook_stats["received"] += 1
+    enqueue_stripe_event(event_id, ordering_key)
+    return True
+
+async def process_stripe_event(event: dict):
+    """Apply one stored event; payment application is itself idempotent per checkout session"""
+    payload = json.loads(event["payload"])
+    
+    if event["source"] == "checkout":
+        if payload.get("payment_status") == "paid" and payload.get("session_id"):
+            await complete_stripe_payment(payload["session_id"], performed_by="stripe_webhook")
+        return
+    
+    event_type = event["event_type"]
+    if event_type == "checkout.session.completed":
+        session = payload.get("data", {}).get("object", {})
+        metadata = session.get("metadata") or {}
+        invoice_id = metadata.get("invoice_id")
+        amount = (session.get("amount_total") or 0) / 100  # Convert from cents
+        
+        if invoice_id and session.get("id"):
+            # Claims the checkout's transaction (or records one), so a racing status poll can't apply it twice
+            await complete_stripe_payment(
+                session["id"], performed_by="stripe_webhook",
+                fallback={"invoice_id": invoice_id, "amount": amount}
+            )
+    
+    elif event_type == "payment_intent.payment_failed":
+        # Log failed payment
+        intent = payload.get("data", {}).get("object", {})
+        metadata = intent.get("metadata") or {}
+        invoice_id = metadata.get("invoice_id")
+        
+        if invoice_id:
+            await log_activity(
+                entity_type="invoice",
+                entity_id=invoice_id,
+                action="payment_failed",
+                details={
+                    "error": (intent.get("last_payment_error") or {}).get("message", "Unknown error")
+                },
+                performed_by="stripe_webhook"
+            )
+
+async def handle_stripe_event(event_id: str):
+    """Claim a pending event, process it, and schedule a retry with backoff if it fails"""
+    now = datetime.now(timezone.utc)
+    event = await db.stripe_events.find_one_and_update(
+        {"event_id": event_id, "status": "pending"},
+        {"$set": {"status": "processing", "locked_by": WORKER_ID,
+                  "locked_until": (now + timedelta(seconds=WEBHOOK_LOCK_SECONDS)).isoformat()},
+         "$inc": {"attempts": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not event:
+        return  # Already processed, or claimed by another worker
+    
+    try:
+        await process_stripe_event(event)
+    except Exception as e:
+        failed = event["attempts"] >= WEBHOOK_MAX_ATTEMPTS
+        retry_at = now + timedelta(seconds=min(2 ** event["attempts"], 300))
+        await db.stripe_events.update_one(
+            {"event_id": event_id},
+            {"$set": {"status": "failed" if failed else "pending", "last_error": str(e),
+                      "next_attempt_at": retry_at.isoformat()},
+             "$unset": {"locked_by": "", "locked_until": ""}}
+        )
+        webhook_stats["failed" if failed else "retried"] += 1
+        logging.error(f"Stripe event {event_id} failed (attempt {event['attempts']}): {e}")
+        return
+    
+    await db.stripe_events.update_one(
+        {"event_id": event_id},
+        {"$set": {"status": "processed", "processed_at": datetime.now(timezone.utc).isoformat()},
+         "$unset": {"locked_by": "", "locked_until": ""}}
+    )
+    webhook_stats["processed"] += 1
+
+async def stripe_event_worker(queue: asyncio.Queue):
+    while True:
+        event_id = await queue.get()
+        try:
+            await handle_stripe_event(event_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Stripe event worker error on {event_id}: {e}")
+        finally:
+            queue.task_done()
+
+async def sweep_stripe_events():
+    """Requeue events that are due for a retry, were never processed, or were left locked by a dead worker.
+
+    The first pass (at startup) requeues everything still pending, e.g. events received before a restart.
+    """
+    first_pass = True
+    while True:
+        try:
+            now = datetime.now(timezone.utc).isoformat()
+            # Release locks held past their expiry so the events can be claimed again
+            await db.stripe_events.update_many(
+                {"status": "processing", "locked_until": {"$lt": now}},
+                {"$set": {"status": "pending"}, "$unset": {"locked_by": "", "locked_until": ""}}
+            )
+            query = {"status": "pending"} if first_pass else {"status": "pending", "next_attempt_at": {"$lte": now}}
+            first_pass = False
+            due = db.stripe_events.find(
+                query,
+                {"_id": 0, "event_id": 1, "ordering_key": 1}
+            ).sort("received_at", 1).limit(WEBHOOK_QUEUE_SIZE)
+            async for event in due:
+                enqueue_stripe_event(event["event_id"], event.get("ordering_key") or event["event_id"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Stripe event sweep failed: {e}")
+        await asyncio.sleep(WEBHOOK_SWEEP_SECONDS)
+
+def start_webhook_workers() -> List[asyncio.Task]:
+    webhook_queues[:] = [asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE) for _ in range(WEBHOOK_WORKERS)]
+    tasks = [asyncio.create_task(stripe_event_worker(queue)) for queue in webhook_queues]
+    tasks.append(asyncio.create_task(sweep_stripe_events()))
+    return tasks
+
+def webhook_metrics() -> Dict[str, Any]:
+    return {**webhook_stats, "workers": len(webhook_queues), "queued": sum(q.qsize() for q in webhook_queues)}
+
 @api_router.post("/stripe/webhook")
 async def stripe_webhook(request: Request):
     """Handle Stripe webhook events for payment confirmations"""
@@ -2752,85 +5437,52 @@ async def stripe_webhook(request: Request):
     
     try:
         # Parse the event (in production, verify signature)
-        import json
         event = json.loads(payload)
-        
-        event_type = event.get("type", "")
-        
-        if event_type == "checkout.session.completed":
-            session = event.get("data", {}).get("object", {})
-            metadata = session.get("metadata", {})
-            invoice_id = metadata.get("invoice_id")
-            amount = session.get("amount_total", 0) / 100  # Convert from cents
-            
-            if invoice_id:
-                invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
-                if invoice:
-                    new_paid = invoice.get("paid_amount", 0) + amount
-                    new_status = "paid" if new_paid >= invoice["amount"] else "partial"
-                    
-                    await db.invoices.update_one(
-                        {"id": invoice_id},
-                        {"$set": {
-                            "paid_amount": new_paid,
-                            "status": new_status
-                        }}
-                    )
-                    
-                    # Update camper balance
-                    await db.campers.update_one(
-                        {"id": invoice["camper_id"]},
-                        {"$inc": {"total_paid": amount}}
-                    )
-                    
-                    # Create payment record
-                    payment_doc = {
-                        "id": str(uuid.uuid4()),
-                        "invoice_id": invoice_id,
-                        "amount": amount,
-                        "method": "stripe",
-                        "status": "completed",
-                        "stripe_session_id": session.get("id"),
-                        "notes": "Online payment via Stripe",
-                        "created_at": datetime.now(timezone.utc).isoformat()
-                    }
-                    await db.payments.insert_one(payment_doc)
-                    
-                    # Log activity
-                    await log_activity(
-                        entity_type="camper",
-                        entity_id=invoice["camper_id"],
-                        action="payment_received",
-                        details={
-                            "invoice_id": invoice_id,
-                            "amount": amount,
-                            "method": "stripe",
-                            "new_status": new_status
-                        },
-                        performed_by="stripe_webhook"
-                    )
-        
-        elif event_type == "payment_intent.payment_failed":
-            # Log failed payment
-            intent = event.get("data", {}).get("object", {})
-            metadata = intent.get("metadata", {})
-            invoice_id = metadata.get("invoice_id")
-            
-            if invoice_id:
-                await log_activity(
-                    entity_type="invoice",
-                    entity_id=invoice_id,
-                    action="payment_failed",
-                    details={
-                        "error": intent.get("last_payment_error", {}).get("message", "Unknown error")
-                    },
-                    performed_by="stripe_webhook"
-                )
-        
-        return {"status": "success"}
-    
-    except Exception as e:
+    except ValueError as e:
         return {"status": "error", "message": str(e)}
+    
+    # Events without an id (hand-built test events) are deduplicated by content
+    event_id = event.get("id") or f"sha256:{hashlib.sha256(payload).hexdigest()}"
+    data_object = event.get("data", {}).get("object", {}) or {}
+    ordering_key = (data_object.get("metadata") or {}).get("invoice_id") or data_object.get("id")
+    
+    await ingest_stripe_event(
+        event_id=event_id,
+        event_type=event.get("type", ""),
+        source="stripe",
+        payload=payload.decode("utf-8"),
+        ordering_key=ordering_key
+    )
+    return {"status": "success"}
+
+@api_router.get("/stripe/events")
+async def list_stripe_events(
+    response: Response,
+    status: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    admin=Depends(get_current_admin)
+):
+    """Stored webhook events, newest first (filter by pending/processing/processed/failed)"""
+    query = {"status": status} if status else {}
+    return await paginate(
+        db.stripe_events, query, response,
+        sort=("received_at", DESCENDING), limit=limit, cursor=cursor,
+        fields="event_id,event_type,source,status,attempts,last_error,ordering_key,received_at,processed_at"
+    )
+
+@api_router.post("/stripe/events/{event_id}/retry")
+async def retry_stripe_event(event_id: str, admin=Depends(get_current_admin)):
+    """Put a failed event back in the queue"""
+    event = await db.stripe_events.find_one_and_update(
+        {"event_id": event_id, "status": "failed"},
+        {"$set": {"status": "pending", "attempts": 0, "next_attempt_at": datetime.now(timezone.utc).isoformat()}},
+        projection={"_id": 0, "ordering_key": 1}
+    )
+    if not event:
+        raise HTTPException(status_code=404, detail="Failed event not found")
+    enqueue_stripe_event(event_id, event.get("ordering_key") or event_id)
+    return {"message": "Event requeued"}
 
 @api_router.get("/portal/check/{portal_token}")
 async def check_portal_access(portal_token: str):
@@ -2858,65 +5510,266 @@ async def check_portal_access(portal_token: str):
 
 # ==================== EXPORT ROUTES ====================
 
+EXPORT_FORMATS = ("json", "csv", "ndjson")
+EXPORT_BATCH_SIZE = 500
+# Rows buffered before a CSV chunk is flushed to the client
+EXPORT_FLUSH_ROWS = 200
+
+CAMPER_EXPORT_COLUMNS = [
+    "Camper ID", "First Name", "Last Name", "Hebrew Name", "Grade", "Yeshiva", "Status", "Room",
+    "Parent Name", "Parent Email", "Parent Phone", "Due Date", "Total Balance", "Total Paid", "Portal Link",
+]
+BILLING_EXPORT_COLUMNS = [
+    "Invoice ID", "Camper Name", "Parent Name", "Parent Email", "Amount", "Paid Amount",
+    "Status", "Description", "Due Date", "Created",
+]
+
+# Accounts used when generating QuickBooks IIF transactions
+QUICKBOOKS_ACCOUNTS = {
+    "receivable": os.environ.get("QB_AR_ACCOUNT", "Accounts Receivable"),
+    "income": os.environ.get("QB_INCOME_ACCOUNT", "Camp Tuition Income"),
+    "deposit": os.environ.get("QB_DEPOSIT_ACCOUNT", "Undeposited Funds"),
+    "bank": os.environ.get("QB_BANK_ACCOUNT", "Checking"),
+}
+
+def camper_export_row(camper: dict) -> dict:
+    # Parent info is now embedded in camper
+    parent_name = f"{camper.get('father_first_name') or ''} {camper.get('father_last_name') or ''}".strip()
+    if not parent_name:
+        parent_name = f"{camper.get('mother_first_name') or ''} {camper.get('mother_last_name') or ''}".strip()
+    return {
+        "Camper ID": camper["id"],
+        "First Name": camper.get("first_name", ""),
+        "Last Name": camper.get("last_name", ""),
+        "Hebrew Name": camper.get("hebrew_name", ""),
+        "Grade": camper.get("grade", ""),
+        "Yeshiva": camper.get("yeshiva", ""),
+        "Status": camper.get("status", ""),
+        "Room": camper.get("room_name", ""),
+        "Parent Name": parent_name,
+        "Parent Email": camper.get("parent_email", ""),
+        "Parent Phone": camper.get("father_cell") or camper.get("mother_cell") or "",
+        "Due Date": camper.get("due_date", ""),
+        "Total Balance": camper.get("total_balance", 0),
+        "Total Paid": camper.get("total_paid", 0),
+        "Portal Link": f"/portal/{camper.get('portal_token', '')}" if camper.get("portal_token") else ""
+    }
+
+def billing_export_row(inv: dict) -> dict:
+    camper = inv.get("camper") or {}
+    parent_name = f"{camper.get('father_first_name') or ''} {camper.get('father_last_name') or ''}".strip()
+    return {
+        "Invoice ID": inv["id"],
+        "Camper Name": f"{camper.get('first_name') or ''} {camper.get('last_name') or ''}".strip(),
+        "Parent Name": parent_name,
+        "Parent Email": camper.get("parent_email", ""),
+        "Amount": inv.get("amount", 0),
+        "Paid Amount": inv.get("paid_amount", 0),
+        "Status": inv.get("status", ""),
+        "Description": inv.get("description", ""),
+        "Due Date": inv.get("due_date", ""),
+        "Created": inv.get("created_at", "")
+    }
+
+def invoices_with_campers_pipeline(match: dict) -> List[dict]:
+    """Join each invoice to the few camper fields exports need, streamed from the server"""
+    return [
+        {"$match": match},
+        {"$lookup": {"from": "campers", "localField": "camper_id", "foreignField": "id", "as": "camper"}},
+        {"$project": {
+            "_id": 0, "id": 1, "invoice_number": 1, "camper_id": 1, "amount": 1, "paid_amount": 1,
+            "status": 1, "description": 1, "due_date": 1, "created_at": 1,
+            "camper": {"$arrayElemAt": [{"$map": {"input": "$camper", "as": "c", "in": {
+                "first_name": "$$c.first_name", "last_name": "$$c.last_name",
+                "father_first_name": "$$c.father_first_name", "father_last_name": "$$c.father_last_name",
+                "parent_email": "$$c.parent_email"
+            }}}, 0]}
+        }}
+    ]
+
+def parse_export_columns(columns: Optional[str], available: List[str]) -> List[str]:
+    if not columns:
+        return available
+    selected = [c.strip() for c in columns.split(",") if c.strip()]
+    unknown = [c for c in selected if c not in available]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown columns: {unknown}. Available: {available}")
+    return selected
+
+async def encode_export_rows(rows, fmt: str, columns: List[str]):
+    """Encode an async iterator of row dicts as CSV or NDJSON text chunks"""
+    if fmt == "ndjson":
+        async for row in rows:
+            yield json.dumps({c: row.get(c) for c in columns}, default=str) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    pending = 0
+    async for row in rows:
+        writer.writerow(["" if row.get(c) is None else row.get(c) for c in columns])
+        pending += 1
+        if pending >= EXPORT_FLUSH_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue()
+
+async def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+async def encode_chunks(chunks):
+    async for chunk in chunks:
+        yield chunk.encode()
+
+def streaming_export_response(chunks, filename: str, media_type: str, gzip: bool) -> StreamingResponse:
+    if gzip:
+        body = gzip_chunks(chunks)
+        filename += ".gz"
+        media_type = "application/gzip"
+    else:
+        body = encode_chunks(chunks)
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+async def mapped_rows(cursor, row_fn):
+    async for doc in cursor:
+        yield row_fn(doc)
+
+def export_rows_response(cursor, row_fn, fmt: str, columns: List[str], basename: str, gzip: bool):
+    """Stream rows from a Motor cursor in the requested format with constant memory"""
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Must be one of: {list(EXPORT_FORMATS)}")
+    media_type = "application/x-ndjson" if fmt == "ndjson" else "text/csv; charset=utf-8"
+    chunks = encode_export_rows(mapped_rows(cursor, row_fn), fmt, columns)
+    return streaming_export_response(chunks, f"{basename}.{fmt}", media_type, gzip)
+
 @api_router.get("/exports/campers")
-async def export_campers(admin=Depends(get_current_admin)):
-    campers = await db.campers.find({}, {"_id": 0}).to_list(1000)
-    
-    export_data = []
-    for camper in campers:
-        # Parent info is now embedded in camper
-        parent_name = f"{camper.get('father_first_name', '')} {camper.get('father_last_name', '')}".strip()
-        if not parent_name:
-            parent_name = f"{camper.get('mother_first_name', '')} {camper.get('mother_last_name', '')}".strip()
-        
-        export_data.append({
-            "Camper ID": camper["id"],
-            "First Name": camper["first_name"],
-            "Last Name": camper["last_name"],
-            "Hebrew Name": camper.get("hebrew_name", ""),
-            "Grade": camper.get("grade", ""),
-            "Yeshiva": camper.get("yeshiva", ""),
-            "Status": camper.get("status", ""),
-            "Room": camper.get("room_name", ""),
-            "Parent Name": parent_name,
-            "Parent Email": camper.get("parent_email", ""),
-            "Parent Phone": camper.get("father_cell") or camper.get("mother_cell") or "",
-            "Due Date": camper.get("due_date", ""),
-            "Total Balance": camper.get("total_balance", 0),
-            "Total Paid": camper.get("total_paid", 0),
-            "Portal Link": f"/portal/{camper.get('portal_token', '')}" if camper.get("portal_token") else ""
-        })
-    
-    return {"data": export_data, "filename": "campers_export.csv"}
+async def export_campers(
+    format: str = "json",
+    columns: Optional[str] = None,
+    gzip: bool = False,
+    admin=Depends(get_current_admin)
+):
+    """Export campers. format=csv|ndjson streams the full roster; json keeps the legacy payload."""
+    selected = parse_export_columns(columns, CAMPER_EXPORT_COLUMNS)
+    cursor = db.campers.find({}, {"_id": 0}).sort("created_at", 1).batch_size(EXPORT_BATCH_SIZE)
+    if format == "json":
+        export_data = [camper_export_row(c) async for c in cursor]
+        return {"data": [{k: row[k] for k in selected} for row in export_data], "filename": "campers_export.csv"}
+    return export_rows_response(cursor, camper_export_row, format, selected, "campers_export", gzip)
 
 @api_router.get("/exports/billing")
-async def export_billing(admin=Depends(get_current_admin)):
-    invoices = await db.invoices.find({}, {"_id": 0}).to_list(1000)
-    
-    # Get campers for enrichment
-    camper_ids = list(set(inv.get("camper_id") for inv in invoices if inv.get("camper_id")))
-    campers = await db.campers.find({"id": {"$in": camper_ids}}, {"_id": 0}).to_list(1000)
-    camper_map = {c["id"]: c for c in campers}
-    
-    export_data = []
-    for inv in invoices:
-        camper = camper_map.get(inv.get("camper_id"), {})
-        parent_name = f"{camper.get('father_first_name', '')} {camper.get('father_last_name', '')}".strip()
-        
-        export_data.append({
-            "Invoice ID": inv["id"],
-            "Camper Name": f"{camper.get('first_name', '')} {camper.get('last_name', '')}".strip(),
-            "Parent Name": parent_name,
-            "Parent Email": camper.get("parent_email", ""),
-            "Amount": inv["amount"],
-            "Paid Amount": inv["paid_amount"],
-            "Status": inv["status"],
-            "Description": inv["description"],
-            "Due Date": inv.get("due_date", ""),
-            "Created": inv["created_at"]
-        })
-    
-    return {"data": export_data, "filename": "billing_export.csv"}
+async def export_billing(
+    format: str = "json",
+    columns: Optional[str] = None,
+    gzip: bool = False,
+    admin=Depends(get_current_admin)
+):
+    """Export invoices joined to their campers. format=csv|ndjson streams; json keeps the legacy payload."""
+    selected = parse_export_columns(columns, BILLING_EXPORT_COLUMNS)
+    cursor = db.invoices.aggregate(invoices_with_campers_pipeline({}), batchSize=EXPORT_BATCH_SIZE)
+    if format == "json":
+        export_data = [billing_export_row(inv) async for inv in cursor]
+        return {"data": [{k: row[k] for k in selected} for row in export_data], "filename": "billing_export.csv"}
+    return export_rows_response(cursor, billing_export_row, format, selected, "billing_export", gzip)
+
+def _iif_value(value: Any) -> str:
+    return str(value if value is not None else "").replace("\t", " ").replace("\r", " ").replace("\n", " ")
+
+def _iif_date(value: Optional[str]) -> str:
+    """IIF dates are MM/DD/YYYY"""
+    if not value:
+        return ""
+    try:
+        return datetime.fromisoformat(str(value)[:10]).strftime("%m/%d/%Y")
+    except ValueError:
+        return ""
+
+def _iif_line(*values) -> str:
+    return "\t".join(_iif_value(v) for v in values) + "\r\n"
+
+IIF_HEADER = (
+    _iif_line("!TRNS", "TRNSID", "TRNSTYPE", "DATE", "ACCNT", "NAME", "AMOUNT", "DOCNUM", "MEMO")
+    + _iif_line("!SPL", "SPLID", "TRNSTYPE", "DATE", "ACCNT", "NAME", "AMOUNT", "DOCNUM", "MEMO")
+    + _iif_line("!ENDTRNS")
+)
+
+# Sign of the TRNS line per transaction type; the SPL line always carries the opposite amount.
+# A CHECK's TRNS line is the bank account (money out, negative) and its SPL line the expense account.
+IIF_TRNS_SIGN = {"INVOICE": 1, "PAYMENT": 1, "CHECK": -1}
+
+def _iif_transaction(trns_type: str, date: str, name: str, amount: float, docnum: str, memo: str,
+                     trns_account: str, spl_account: str) -> str:
+    amount = round(float(amount or 0), 2) * IIF_TRNS_SIGN[trns_type]
+    return (
+        _iif_line("TRNS", "", trns_type, date, trns_account, name, f"{amount or 0.0:.2f}", docnum, memo)
+        + _iif_line("SPL", "", trns_type, date, spl_account, name, f"{(-amount) or 0.0:.2f}", docnum, memo)
+        + _iif_line("ENDTRNS")
+    )
+
+def _iif_name(camper: Optional[dict]) -> str:
+    camper = camper or {}
+    return f"{camper.get('last_name') or ''}, {camper.get('first_name') or ''}".strip(", ") or "Unknown"
+
+def payments_with_campers_pipeline(match: dict) -> List[dict]:
+    """Join each payment to its camper's name (through the invoice when the payment has no camper_id)"""
+    return [
+        {"$match": match},
+        {"$lookup": {"from": "invoices", "localField": "invoice_id", "foreignField": "id", "as": "invoice"}},
+        {"$set": {"camper_id": {"$ifNull": ["$camper_id", {"$arrayElemAt": ["$invoice.camper_id", 0]}]}}},
+        {"$lookup": {"from": "campers", "localField": "camper_id", "foreignField": "id", "as": "camper"}},
+        {"$project": {
+            "_id": 0, "amount": 1, "method": 1, "notes": 1, "payment_date": 1, "created_at": 1,
+            "camper": {"$arrayElemAt": [{"$map": {"input": "$camper", "as": "c", "in": {
+                "first_name": "$$c.first_name", "last_name": "$$c.last_name"
+            }}}, 0]}
+        }}
+    ]
+
+async def iter_quickbooks_iif():
+    """Yield a QuickBooks IIF file: invoices, completed payments, then expenses"""
+    yield IIF_HEADER
+
+    invoices = db.invoices.aggregate(
+        invoices_with_campers_pipeline({"is_deleted": {"$ne": True}}), batchSize=EXPORT_BATCH_SIZE
+    )
+    async for inv in invoices:
+        yield _iif_transaction(
+            "INVOICE", _iif_date(inv.get("created_at")), _iif_name(inv.get("camper")), inv.get("amount", 0),
+            inv.get("invoice_number") or inv["id"][:8], inv.get("description") or "Camp Fee",
+            QUICKBOOKS_ACCOUNTS["receivable"], QUICKBOOKS_ACCOUNTS["income"]
+        )
+
+    payments = db.payments.aggregate(
+        payments_with_campers_pipeline({"status": "completed"}), batchSize=EXPORT_BATCH_SIZE
+    )
+    async for pay in payments:
+        yield _iif_transaction(
+            "PAYMENT", _iif_date(pay.get("payment_date") or pay.get("created_at")),
+            _iif_name(pay.get("camper")), pay.get("amount", 0),
+            pay.get("method", ""), pay.get("notes") or "",
+            QUICKBOOKS_ACCOUNTS["deposit"], QUICKBOOKS_ACCOUNTS["receivable"]
+        )
+
+    expenses = db.expenses.find({}, {"_id": 0}).batch_size(EXPORT_BATCH_SIZE)
+    async for exp in expenses:
+        yield _iif_transaction(
+            "CHECK", _iif_date(exp.get("date") or exp.get("created_at")), exp.get("vendor") or "",
+            exp.get("amount", 0), "", exp.get("description") or "",
+            QUICKBOOKS_ACCOUNTS["bank"], exp.get("category") or "Expenses"
+        )
 
 # ==================== PARENT PORTAL ROUTES (NO AUTH) ====================
 
@@ -2998,11 +5851,6 @@ async def portal_create_payment(
     # Get origin from request
     origin = request.headers.get("origin", str(request.base_url).rstrip('/'))
     
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    
-    stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
-    
     success_url = f"{origin}/portal/{access_token}?payment=success&session_id={{CHECKOUT_SESSION_ID}}"
     cancel_url = f"{origin}/portal/{access_token}?payment=cancelled"
     
@@ -3020,7 +5868,7 @@ async def portal_create_payment(
         }
     )
     
-    session = await stripe_checkout.create_checkout_session(checkout_request)
+    session = await create_checkout(request, checkout_request)
     
     # Create payment transaction record
     payment_doc = {
@@ -3042,36 +5890,329 @@ async def portal_create_payment(
 
 # ==================== DASHBOARD STATS ====================
 
-@api_router.get("/dashboard/stats")
-async def get_dashboard_stats(admin=Depends(get_current_admin)):
-    # Camper counts
-    total_campers = await db.campers.count_documents({})
-    campers_by_status = {}
-    for status in KANBAN_STATUSES:
-        count = await db.campers.count_documents({"status": status})
-        campers_by_status[status] = count
-    
-    # Financial summary
-    invoices = await db.invoices.find({}, {"_id": 0}).to_list(1000)
-    total_invoiced = sum(inv["amount"] for inv in invoices)
-    total_collected = sum(inv["paid_amount"] for inv in invoices)
-    
-    # Recent activity
-    recent_campers = await db.campers.find({}, {"_id": 0}).sort("created_at", -1).limit(5).to_list(5)
-    recent_payments = await db.payments.find({"status": "completed"}, {"_id": 0}).sort("created_at", -1).limit(5).to_list(5)
-    
-    # Pending communications
-    pending_comms = await db.communications.count_documents({"status": "pending"})
+# One snapshot per worker; writes on this worker clear it, other workers pick changes up within the TTL
+DASHBOARD_CACHE_TTL_SECONDS = int(os.environ.get("DASHBOARD_CACHE_TTL_SECONDS", "30"))
+dashboard_cache = TTLCache(DASHBOARD_CACHE_TTL_SECONDS, max_entries=1)
+
+def invalidate_dashboard_stats():
+    dashboard_cache.clear()
+
+async def compute_dashboard_stats() -> Dict[str, Any]:
+    """All dashboard figures in four concurrent round trips"""
+    campers_pipeline = [{"$facet": {
+        "total": [{"$count": "count"}],
+        "by_status": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}],
+        "recent": [{"$sort": {"created_at": -1}}, {"$limit": 5}, {"$project": {"_id": 0}}]
+    }}]
+    # Same rules as the ledger: a deleted invoice still counts for whatever was paid on it
+    invoices_pipeline = [{"$group": {
+        "_id": None,
+        "invoiced": {"$sum": {"$cond": [
+            {"$eq": ["$is_deleted", True]},
+            {"$min": [{"$ifNull": ["$amount", 0]}, {"$ifNull": ["$paid_amount", 0]}]},
+            {"$ifNull": ["$amount", 0]}
+        ]}},
+        "collected": {"$sum": {"$ifNull": ["$paid_amount", 0]}}
+    }}]
+    campers_result, invoice_totals, recent_payments, pending_comms = await asyncio.gather(
+        db.campers.aggregate(campers_pipeline).to_list(1),
+        db.invoices.aggregate(invoices_pipeline).to_list(1),
+        db.payments.find({"status": "completed"}, {"_id": 0}).sort("created_at", -1).limit(5).to_list(5),
+        db.communications.count_documents({"status": "pending"})
+    )
+    
+    campers = campers_result[0] if campers_result else {}
+    campers_by_status = {status: 0 for status in KANBAN_STATUSES}
+    for row in campers.get("by_status", []):
+        if row["_id"] in campers_by_status:
+            campers_by_status[row["_id"]] = row["count"]
+    totals = invoice_totals[0] if invoice_totals else {}
+    total_invoiced = round(totals.get("invoiced", 0), 2)
+    total_collected = round(totals.get("collected", 0), 2)
     
     return {
-        "total_campers": total_campers,
+        "total_campers": campers["total"][0]["count"] if campers.get("total") else 0,
         "campers_by_status": campers_by_status,
         "total_invoiced": total_invoiced,
         "total_collected": total_collected,
-        "outstanding": total_invoiced - total_collected,
-        "recent_campers": recent_campers,
+        "outstanding": round(total_invoiced - total_collected, 2),
+        "recent_campers": campers.get("recent", []),
         "recent_payments": recent_payments,
-        "pending_communications": pending_comms
+        "pending_communications": pending_comms,
+        "generated_at": datetime.now(timezone.utc).isoformat()
+    }
+
+@api_router.get("/dashboard/stats")
+async def get_dashboard_stats(refresh: bool = False, admin=Depends(get_current_admin)):
+    """Dashboard snapshot, served from cache; refresh=true recomputes it"""
+    stats = None if refresh else dashboard_cache.get("stats")
+    if stats is None:
+        stats = await compute_dashboard_stats()
+        dashboard_cache.set("stats", stats)
+    return stats
+
+# ==================== BACKGROUND JOBS ====================
+
+# Identifies this process when holding job leases
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+JOB_CHECK_INTERVAL_SECONDS = int(os.environ.get("JOB_CHECK_INTERVAL_SECONDS", "600"))
+JOB_LEASE_SECONDS = 1800
+job_stats: Dict[str, Dict[str, Any]] = {}
+
+async def acquire_job_lease(name: str, lease_seconds: int = JOB_LEASE_SECONDS) -> bool:
+    """Take (or renew) the lease for a job; only the holder may run it"""
+    now = datetime.now(timezone.utc)
+    try:
+        lease = await db.job_leases.find_one_and_update(
+            {"_id": name, "$or": [{"expires_at": {"$lt": now}}, {"owner": WORKER_ID}]},
+            {"$set": {"owner": WORKER_ID, "expires_at": now + timedelta(seconds=lease_seconds), "acquired_at": now}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # The lease document exists and is held by someone else, so the upsert collided
+        return False
+    return lease is not None and lease.get("owner") == WORKER_ID
+
+async def release_job_lease(name: str):
+    await db.job_leases.delete_one({"_id": name, "owner": WORKER_ID})
+
+async def run_job_now(name: str, job) -> Optional[Any]:
+    """Run a job under its lease and record the outcome; None if another worker holds the lease"""
+    if not await acquire_job_lease(name):
+        return None
+    stats = job_stats.setdefault(name, {"runs": 0, "failures": 0})
+    started = datetime.now(timezone.utc)
+    try:
+        result = await job()
+        stats["runs"] += 1
+        stats["last_result"] = {k: v for k, v in (result or {}).items() if not isinstance(v, list)}
+        await db.job_runs.update_one(
+            {"_id": name},
+            {"$set": {"last_run_at": started.isoformat(), "last_run_by": WORKER_ID, "last_result": stats["last_result"]}},
+            upsert=True
+        )
+        return result
+    except Exception:
+        stats["failures"] += 1
+        raise
+    finally:
+        stats["last_started_at"] = started.isoformat()
+        await release_job_lease(name)
+
+async def run_scheduled_job(name: str, job, every: timedelta, at_hour_utc: Optional[int] = None):
+    """Run `job` once per `every` (not before at_hour_utc), coordinated across workers via job_runs + a lease"""
+    while True:
+        try:
+            now = datetime.now(timezone.utc)
+            state = await db.job_runs.find_one({"_id": name}) or {}
+            last_run = datetime.fromisoformat(state["last_run_at"]) if state.get("last_run_at") else None
+            # Allow one check interval of slack so a daily job doesn't drift later every day
+            due = last_run is None or now - last_run >= every - timedelta(seconds=JOB_CHECK_INTERVAL_SECONDS)
+            if due and (at_hour_utc is None or now.hour >= at_hour_utc):
+                result = await run_job_now(name, job)
+                if result is not None:
+                    logger.info(f"Job {name} finished: {job_stats[name].get('last_result')}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Job {name} failed: {e}")
+        await asyncio.sleep(JOB_CHECK_INTERVAL_SECONDS)
+
+# ==================== DATABASE INDEXES ====================
+
+# Indexes every collection needs for the lookups done by the handlers above.
+# Each entry is (name, keys, options); the name is what drift detection compares against.
+REQUIRED_INDEXES = {
+    "admins": [
+        ("id_unique", [("id", ASCENDING)], {"unique": True}),
+        ("email_unique", [("email", ASCENDING)], {"unique": True}),
+        ("is_approved", [("is_approved", ASCENDING)], {}),
+    ],
+    "campers": [
+        ("id_unique", [("id", ASCENDING)], {"unique": True}),
+        ("portal_token_unique", [("portal_token", ASCENDING)], {"unique": True, "partialFilterExpression": {"portal_token": {"$type": "string"}}}),
+        ("status_created_at", [("status", ASCENDING), ("created_at", DESCENDING)], {}),
+        ("created_at_id", [("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ("last_name_id", [("last_name", ASCENDING), ("id", ASCENDING)], {}),
+        ("first_name_id", [("first_name", ASCENDING), ("id", ASCENDING)], {}),
+        ("status_id", [("status", ASCENDING), ("id", ASCENDING)], {}),
+        ("grade_id", [("grade", ASCENDING), ("id", ASCENDING)], {}),
+        ("grade_yeshiva", [("grade", ASCENDING), ("yeshiva", ASCENDING)], {}),
+        ("parent_email", [("parent_email", ASCENDING)], {}),
+        ("groups", [("groups", ASCENDING)], {}),
+        ("room_id", [("room_id", ASCENDING)], {}),
+    ],
+    "campers_trash": [
+        ("id", [("id", ASCENDING)], {}),
+        ("deleted_at_id", [("deleted_at", DESCENDING), ("id", DESCENDING)], {}),
+    ],
+    "invoices": [
+        ("id_unique", [("id", ASCENDING)], {"unique": True}),
+        ("camper_id_is_deleted", [("camper_id", ASCENDING), ("is_deleted", ASCENDING)], {}),
+        ("status_is_deleted", [("status", ASCENDING), ("is_deleted", ASCENDING)], {}),
+        ("portal_token_unique", [("portal_token", ASCENDING)], {"unique": True, "partialFilterExpression": {"portal_token": {"$type": "string"}}}),
+        ("invoice_number_unique", [("invoice_number", ASCENDING)], {"unique": True, "partialFilterExpression": {"invoice_number": {"$type": "string"}}}),
+        ("next_reminder_date", [("next_reminder_date", ASCENDING)], {}),
+        ("created_at_id", [("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ("due_date_id", [("due_date", ASCENDING), ("id", ASCENDING)], {}),
+        # The unique index above is partial, so it can't serve an unfiltered sort
+        ("invoice_number_id", [("invoice_number", ASCENDING), ("id", ASCENDING)], {}),
+        ("status_id", [("status", ASCENDING), ("id", ASCENDING)], {}),
+    ],
+    "payments": [
+        ("id_unique", [("id", ASCENDING)], {"unique": True}),
+        ("invoice_id", [("invoice_id", ASCENDING)], {}),
+        ("status_created_at", [("status", ASCENDING), ("created_at", DESCENDING)], {}),
+        ("created_at_id", [("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ("amount_id", [("amount", ASCENDING), ("id", ASCENDING)], {}),
+        ("stripe_session_id", [("stripe_session_id", ASCENDING)], {"sparse": True}),
+    ],
+    "ledger_entries": [
+        ("id_unique", [("id", ASCENDING)], {"unique": True}),
+        ("camper_id_created_at_id", [("camper_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], {}),
+        ("invoice_id", [("invoice_id", ASCENDING)], {}),
+        ("created_at", [("created_at", ASCENDING)], {}),
+    ],
+    "fake_checkout_sessions": [
+        ("session_id_unique", [("session_id", ASCENDING)], {"unique": True}),
+    ],
+    "financial_rollups": [
+        ("day_kind", [("day", ASCENDING), ("kind", ASCENDING)], {}),
+    ],
+    "stripe_events": [
+        ("id_unique", [("id", ASCENDING)], {"unique": True}),
+        ("event_id_unique", [("event_id", ASCENDING)], {"unique": True}),
+        ("status_next_attempt_at", [("status", ASCENDING), ("next_attempt_at", ASCENDING)], {}),
+        ("received_at_id", [("received_at", DESCENDING), ("id", DESCENDING)], {}),
+    ],
+    "payment_transactions": [
+        ("id_unique", [("id", ASCENDING)], {"unique": True}),
+        ("stripe_session_id_unique", [("stripe_session_id", ASCENDING)], {"unique": True, "partialFilterExpression": {"stripe_session_id": {"$type": "string"}}}),
+        ("invoice_id", [("invoice_id", ASCENDING)], {}),
+    ],
+    "activity_logs": [
+        ("id_unique", [("id", ASCENDING)], {"unique": True}),
+        ("entity_created_at_id", [("entity_type", ASCENDING), ("entity_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ("action_created_at_id", [("action", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ("created_at_id", [("created_at", DESCENDING), ("id", DESCENDING)], {}),
+    ],
+    "activity_log_archive": [
+        ("month_last_created_at", [("month", DESCENDING), ("last_created_at", DESCENDING)], {}),
+        ("entity_ids_last_created_at", [("entity_ids", ASCENDING), ("last_created_at", DESCENDING)], {}),
+    ],
+    "communications": [
+        ("id_unique", [("id", ASCENDING)], {"unique": True}),
+        ("camper_id_created_at", [("camper_id", ASCENDING), ("created_at", DESCENDING)], {}),
+        ("type_created_at", [("type", ASCENDING), ("created_at", DESCENDING)], {}),
+        ("created_at_id", [("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ("status", [("status", ASCENDING)], {}),
+    ],
+    "groups": [
+        ("id_unique", [("id", ASCENDING)], {"unique": True}),
+        ("parent_id", [("parent_id", ASCENDING)], {}),
+        ("ancestors", [("ancestors", ASCENDING)], {}),
+        ("type", [("type", ASCENDING)], {}),
+    ],
+    "rooms": [
+        ("id_unique", [("id", ASCENDING)], {"unique": True}),
+    ],
+    "email_templates": [
+        ("id_unique", [("id", ASCENDING)], {"unique": True}),
+        ("trigger", [("trigger", ASCENDING)], {}),
+    ],
+    "expenses": [
+        ("id_unique", [("id", ASCENDING)], {"unique": True}),
+        ("category", [("category", ASCENDING)], {}),
+        ("created_at_id", [("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ("date_id", [("date", ASCENDING), ("id", ASCENDING)], {}),
+        ("amount_id", [("amount", ASCENDING), ("id", ASCENDING)], {}),
+    ],
+    "saved_reports": [
+        ("id_unique", [("id", ASCENDING)], {"unique": True}),
+    ],
+}
+
+# Index options that matter when comparing a declared index with what is in the database
+INDEX_COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+def _index_drift(name: str, keys: list, options: dict, existing: dict) -> Optional[str]:
+    """Describe how an existing index differs from its declaration, or None if it matches"""
+    existing_keys = [(k, int(v)) for k, v in existing.get("key", [])]
+    if existing_keys != [(k, int(v)) for k, v in keys]:
+        return f"keys {existing_keys} != declared {keys}"
+    for opt in INDEX_COMPARED_OPTIONS:
+        if existing.get(opt) != options.get(opt):
+            return f"{opt}={existing.get(opt)!r} != declared {options.get(opt)!r}"
+    return None
+
+async def ensure_indexes() -> Dict[str, Any]:
+    """Create any missing declared indexes and report drift against what already exists.
+
+    Safe to run on every startup: existing indexes that match are left alone, and
+    mismatched or undeclared indexes are reported rather than dropped.
+    """
+    report = {"created": [], "drift": [], "undeclared": [], "errors": []}
+
+    for collection_name, declared in REQUIRED_INDEXES.items():
+        collection = db[collection_name]
+        try:
+            existing = await collection.index_information()
+        except OperationFailure:
+            existing = {}
+
+        missing = []
+        for name, keys, options in declared:
+            if name in existing:
+                drift = _index_drift(name, keys, options, existing[name])
+                if drift:
+                    report["drift"].append({"collection": collection_name, "index": name, "detail": drift})
+            else:
+                missing.append(IndexModel(keys, name=name, **options))
+
+        declared_names = {name for name, _, _ in declared}
+        for name in existing:
+            if name != "_id_" and name not in declared_names:
+                report["undeclared"].append({"collection": collection_name, "index": name})
+
+        # Create one at a time so a single failure (e.g. duplicate data under a unique index)
+        # doesn't prevent the rest from being built
+        for model in missing:
+            try:
+                await collection.create_indexes([model])
+                report["created"].append({"collection": collection_name, "index": model.document["name"]})
+            except OperationFailure as e:
+                report["errors"].append({"collection": collection_name, "index": model.document["name"], "error": str(e)})
+
+    for item in report["created"]:
+        logger.info(f"Created index {item['collection']}.{item['index']}")
+    for item in report["drift"]:
+        logger.warning(f"Index drift on {item['collection']}.{item['index']}: {item['detail']}")
+    for item in report["undeclared"]:
+        logger.info(f"Undeclared index {item['collection']}.{item['index']}")
+    for item in report["errors"]:
+        logger.error(f"Failed to create index {item['collection']}.{item['index']}: {item['error']}")
+
+    return report
+
+@api_router.get("/system/indexes")
+async def get_index_report(admin=Depends(get_current_admin)):
+    """Re-run the index bootstrapper and return what was created and any drift"""
+    return await ensure_indexes()
+
+@api_router.get("/system/metrics")
+async def get_system_metrics(admin=Depends(get_current_admin)):
+    """In-process cache and worker counters for this API worker"""
+    return {
+        "admin_cache": {**admin_cache.stats(), "shared_backend": redis_client is not None},
+        "actor_name_cache": actor_name_cache.stats(),
+        "password_pool": password_pool_metrics(),
+        "template_cache": {**template_cache.stats(), "compiled": len(compiled_templates)},
+        "dashboard_cache": dashboard_cache.stats(),
+        "activity_writer": activity_writer.stats(),
+        "jobs": {"worker_id": WORKER_ID, **job_stats},
+        "stripe_webhooks": webhook_metrics(),
+        "payment_provider": payment_provider.stats() if payment_provider else {"provider": PAYMENT_PROVIDER}
     }
 
 # ==================== HEALTH CHECK ====================
@@ -3090,6 +6231,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "Content-Disposition"],
 )
 
 logging.basicConfig(
@@ -3098,6 +6240,42 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Long-running tasks started at startup and cancelled at shutdown
+background_tasks: List[asyncio.Task] = []
+
+@app.on_event("startup")
+async def startup_db_client():
+    await ensure_indexes()
+    await camper_search_index.rebuild()
+    await backfill_group_ancestors()
+    await backfill_room_occupancy()
+    if await db.financial_rollups.estimated_document_count() == 0:
+        # First start with rollups: backfill from existing payments and expenses
+        await rebuild_financial_rollups()
+    background_tasks.append(asyncio.create_task(refresh_search_index_periodically()))
+    background_tasks.append(asyncio.create_task(activity_writer.run()))
+    # Workers start before the first sweep so events left pending by a restart are requeued
+    background_tasks.extend(start_webhook_workers())
+    if redis_client is not None:
+        background_tasks.append(asyncio.create_task(listen_for_cache_invalidations()))
+    background_tasks.append(asyncio.create_task(run_scheduled_job(
+        "balance_reconciliation", lambda: reconcile_camper_balances(apply=RECONCILE_APPLY),
+        every=timedelta(days=1), at_hour_utc=RECONCILE_RUN_HOUR_UTC
+    )))
+    background_tasks.append(asyncio.create_task(run_scheduled_job(
+        "activity_archival", archive_activity_logs, every=timedelta(days=1), at_hour_utc=ACTIVITY_ARCHIVE_RUN_HOUR_UTC
+    )))
+    if REMINDER_SCHEDULER_ENABLED:
+        background_tasks.append(asyncio.create_task(run_scheduled_job(
+            "invoice_reminders", send_due_invoice_reminders, every=timedelta(days=1), at_hour_utc=REMINDER_RUN_HOUR_UTC
+        )))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    # Buffered activity entries must reach Mongo before the client closes
+    await activity_writer.drain()
+    password_executor.shutdown(wait=False)
     client.close()
@@ -0,0 +1,124 @@
+"""
+Camp Baraisa Backend Tests - Payment concurrency
+Testing that payment application is atomic:
+- Hundreds of parallel manual payments on one invoice lose no updates
+- A checkout.session.completed event delivered many times at once is applied exactly once
+"""
+
+import pytest
+import requests
+import os
+import uuid
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+ADMIN_EMAIL = "admin@campbaraisa.com"
+ADMIN_PASSWORD = "testpassword123"
+
+PARALLEL_PAYMENTS = 200
+WORKERS = 32
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Headers with auth token"""
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "email": ADMIN_EMAIL,
+        "password": ADMIN_PASSWORD
+    })
+    if response.status_code != 200:
+        pytest.skip("Authentication failed - skipping authenticated tests")
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def create_invoice(auth_headers, amount):
+    unique_name = f"TEST_{uuid.uuid4().hex[:8]}"
+    camper = requests.post(f"{BASE_URL}/api/campers", json={
+        "first_name": unique_name,
+        "last_name": "Concurrency",
+        "parent_email": f"{unique_name.lower()}@test.com"
+    }, headers=auth_headers).json()
+    response = requests.post(f"{BASE_URL}/api/invoices", json={
+        "camper_id": camper["id"],
+        "description": "TEST concurrent payments",
+        "line_items": [{"description": "Tuition", "amount": amount}]
+    }, headers=auth_headers)
+    assert response.status_code == 200, response.text
+    return camper, response.json()
+
+
+def get_invoice(auth_headers, invoice_id):
+    return requests.get(f"{BASE_URL}/api/invoices/{invoice_id}", headers=auth_headers).json()
+
+
+class TestParallelPayments:
+    """Manual payments recorded concurrently against the same invoice"""
+
+    def test_no_lost_updates(self, auth_headers):
+        camper, invoice = create_invoice(auth_headers, PARALLEL_PAYMENTS * 10.0)
+
+        def pay(_):
+            return requests.post(f"{BASE_URL}/api/payments", json={
+                "invoice_id": invoice["id"], "camper_id": camper["id"], "amount": 5.0, "method": "check"
+            }, headers=auth_headers).status_code
+
+        with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+            statuses = list(pool.map(pay, range(PARALLEL_PAYMENTS)))
+        assert statuses == [200] * PARALLEL_PAYMENTS
+
+        updated = get_invoice(auth_headers, invoice["id"])
+        assert updated["paid_amount"] == PARALLEL_PAYMENTS * 5.0
+        assert updated["status"] == "partial"
+
+        camper_after = requests.get(f"{BASE_URL}/api/campers/{camper['id']}", headers=auth_headers).json()
+        assert camper_after["total_paid"] == PARALLEL_PAYMENTS * 5.0
+
+    def test_status_flips_to_paid_exactly_at_total(self, auth_headers):
+        _, invoice = create_invoice(auth_headers, 100.0)
+
+        def pay(_):
+            return requests.post(f"{BASE_URL}/api/payments", json={
+                "invoice_id": invoice["id"], "amount": 10.0, "method": "cash"
+            }, headers=auth_headers).status_code
+
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            list(pool.map(pay, range(10)))
+
+        updated = get_invoice(auth_headers, invoice["id"])
+        assert updated["paid_amount"] == 100.0
+        assert updated["status"] == "paid"
+
+
+class TestDuplicateStripeEvents:
+    """The same checkout completion delivered concurrently must only be applied once"""
+
+    def test_duplicate_webhooks_apply_once(self, auth_headers):
+        _, invoice = create_invoice(auth_headers, 300.0)
+        session_id = f"cs_test_{uuid.uuid4().hex}"
+        event = {
+            "type": "checkout.session.completed",
+            "data": {"object": {
+                "id": session_id,
+                "amount_total": 12000,
+                "metadata": {"invoice_id": invoice["id"]}
+            }}
+        }
+
+        with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+            list(pool.map(lambda _: requests.post(f"{BASE_URL}/api/stripe/webhook", json=event), range(50)))
+
+        # Webhooks are acknowledged before they're applied
+        deadline = time.time() + 30
+        updated = get_invoice(auth_headers, invoice["id"])
+        while updated["paid_amount"] == 0 and time.time() < deadline:
+            time.sleep(0.5)
+            updated = get_invoice(auth_headers, invoice["id"])
+        time.sleep(1)
+        updated = get_invoice(auth_headers, invoice["id"])
+        assert updated["paid_amount"] == 120.0
+        assert updated["status"] == "partial"
+
+        payments = requests.get(f"{BASE_URL}/api/payments", params={"invoice_id": invoice["id"]}, headers=auth_headers).json()
+        assert len([p for p in payments if p.get("stripe_session_id") == session_id]) == 1
@@ -0,0 +1,950 @@
+"""
+Camp Baraisa Backend Tests - Iteration 11
+Testing scaling features:
+- Indexed camper search (prefix/token matching, kept in sync on create/update/delete)
+- Aggregation-built Kanban board with per-column pagination
+- Keyset pagination (X-Next-Cursor) and fields= projection on list endpoints
+- Streaming CSV/NDJSON/IIF exports
+- Cached admin principal resolution
+- Compiled template rendering with save-time merge field validation
+- Bulk Kanban status transitions
+- Scheduled invoice reminder job (dry run and manual run)
+- Billing ledger with materialized camper balances and reconciliation
+- Atomic invoice number sequences and batch invoice creation
+- Single-aggregation dashboard stats with a write-invalidated snapshot
+- Financial summary from $group pipelines and incremental rollups, with date/season filters
+- Batched actor-name enrichment for activity feeds (admins and system actors)
+- Write-behind activity log buffer
+- Keyset-paged activity feeds with action/time filters and a compressed monthly archive
+- Diff-based group membership sync
+- Group hierarchy via materialized ancestor paths (tree endpoint, subtree delete)
+- Capacity-enforcing room assignment with denormalized occupancy
+- Batch room/group allocation solver (preferences, keep together/apart, dry run)
+- Compiled saved reports: whitelisted filters, server-side sort/projection, paging, explain
+"""
+
+import pytest
+import requests
+import os
+import csv
+import io
+import json
+import uuid
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+# Test credentials
+ADMIN_EMAIL = "admin@campbaraisa.com"
+ADMIN_PASSWORD = "testpassword123"
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Headers with auth token"""
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "email": ADMIN_EMAIL,
+        "password": ADMIN_PASSWORD
+    })
+    if response.status_code != 200:
+        pytest.skip("Authentication failed - skipping authenticated tests")
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def create_test_camper(auth_headers, **overrides):
+    unique_name = f"TEST_{uuid.uuid4().hex[:8]}"
+    payload = {
+        "first_name": unique_name,
+        "last_name": "Scaling",
+        "parent_email": f"{unique_name.lower()}@test.com",
+        "father_first_name": "Test",
+        "father_last_name": "Father",
+        "father_cell": "555-0000",
+        **overrides
+    }
+    response = requests.post(f"{BASE_URL}/api/campers", json=payload, headers=auth_headers)
+    assert response.status_code == 200, f"Create camper failed: {response.text}"
+    return response.json()
+
+
+class TestSearchIndex:
+    """Search index API tests"""
+
+    def test_prefix_search_finds_new_camper(self, auth_headers):
+        """A camper is searchable by name prefix right after creation"""
+        camper = create_test_camper(auth_headers)
+        prefix = camper["first_name"][:10]
+        response = requests.get(f"{BASE_URL}/api/search", params={"q": prefix}, headers=auth_headers)
+        assert response.status_code == 200
+        ids = [c["id"] for c in response.json()["campers"]]
+        assert camper["id"] in ids
+        print(f"✓ Prefix search '{prefix}' finds new camper")
+
+    def test_multi_token_search(self, auth_headers):
+        """All query tokens must match, in any field"""
+        camper = create_test_camper(auth_headers, yeshiva="TEST Yeshiva Tokens")
+        response = requests.get(f"{BASE_URL}/api/search", params={
+            "q": f"{camper['first_name']} tokens"
+        }, headers=auth_headers)
+        ids = [c["id"] for c in response.json()["campers"]]
+        assert camper["id"] in ids
+
+        response = requests.get(f"{BASE_URL}/api/search", params={
+            "q": f"{camper['first_name']} nomatchtoken"
+        }, headers=auth_headers)
+        ids = [c["id"] for c in response.json()["campers"]]
+        assert camper["id"] not in ids
+
+    def test_search_tracks_update_and_delete(self, auth_headers):
+        """Updated names are searchable and deleted campers drop out of results"""
+        camper = create_test_camper(auth_headers)
+        new_last_name = f"Renamed{uuid.uuid4().hex[:6]}"
+        update_payload = {k: v for k, v in camper.items() if k not in ("id", "status", "created_at")}
+        update_payload["last_name"] = new_last_name
+        response = requests.put(f"{BASE_URL}/api/campers/{camper['id']}", json=update_payload, headers=auth_headers)
+        assert response.status_code == 200
+
+        response = requests.get(f"{BASE_URL}/api/search", params={"q": new_last_name}, headers=auth_headers)
+        assert camper["id"] in [c["id"] for c in response.json()["campers"]]
+
+        requests.delete(f"{BASE_URL}/api/campers/{camper['id']}", headers=auth_headers)
+        response = requests.get(f"{BASE_URL}/api/search", params={"q": new_last_name}, headers=auth_headers)
+        assert camper["id"] not in [c["id"] for c in response.json()["campers"]]
+        print("✓ Search index follows update and delete")
+
+    def test_search_limit(self, auth_headers):
+        """The limit parameter caps the number of results"""
+        response = requests.get(f"{BASE_URL}/api/search", params={"q": "test", "limit": 2}, headers=auth_headers)
+        assert response.status_code == 200
+        assert len(response.json()["campers"]) <= 2
+
+
+class TestKanbanAggregation:
+    """Kanban board API tests"""
+
+    def test_board_has_counts_and_balances(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/kanban", headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert set(data["board"].keys()) == set(data["statuses"])
+        for status, cards in data["board"].items():
+            assert data["counts"][status] == len(cards)
+            for card in cards:
+                assert "balance" in card
+                assert "parent_name" in card
+
+    def test_per_column_pagination(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/kanban", params={"limit": 1}, headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        for status, cards in data["board"].items():
+            assert len(cards) <= 1
+            assert data["counts"][status] >= len(cards)
+
+    def test_single_column(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/kanban", params={"status": "Applied", "limit": 5}, headers=auth_headers)
+        assert response.status_code == 200
+        assert list(response.json()["board"].keys()) == ["Applied"]
+
+        response = requests.get(f"{BASE_URL}/api/kanban", params={"status": "Bogus"}, headers=auth_headers)
+        assert response.status_code == 400
+
+
+class TestKeysetPagination:
+    """Cursor pagination and projection on list endpoints"""
+
+    def test_cursor_walks_all_campers_without_duplicates(self, auth_headers):
+        for _ in range(3):
+            create_test_camper(auth_headers)
+
+        full = requests.get(f"{BASE_URL}/api/campers", headers=auth_headers).json()
+        seen = []
+        cursor = None
+        while True:
+            params = {"limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = requests.get(f"{BASE_URL}/api/campers", params=params, headers=auth_headers)
+            assert response.status_code == 200
+            page = response.json()
+            assert len(page) <= 2
+            seen.extend(c["id"] for c in page)
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+        assert len(seen) == len(set(seen))
+        assert set(seen) == {c["id"] for c in full}
+        print(f"✓ Walked {len(seen)} campers in pages of 2")
+
+    def test_fields_projection(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/campers", params={
+            "fields": "first_name,last_name", "limit": 5
+        }, headers=auth_headers)
+        assert response.status_code == 200
+        for camper in response.json():
+            assert set(camper.keys()) <= {"id", "first_name", "last_name", "created_at"}
+
+    def test_invalid_cursor_and_sort(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/invoices", params={"cursor": "not-a-cursor"}, headers=auth_headers)
+        assert response.status_code == 400
+        response = requests.get(f"{BASE_URL}/api/invoices", params={"sort": "password_hash"}, headers=auth_headers)
+        assert response.status_code == 400
+
+    @pytest.mark.parametrize("endpoint", [
+        "/api/invoices", "/api/payments", "/api/communications",
+        "/api/expenses", "/api/campers/trash/list", "/api/invoices/trash/list"
+    ])
+    def test_list_endpoints_accept_limit(self, auth_headers, endpoint):
+        response = requests.get(f"{BASE_URL}{endpoint}", params={"limit": 1}, headers=auth_headers)
+        assert response.status_code == 200
+        assert len(response.json()) <= 1
+
+
+class TestStreamingExports:
+    """Streaming export API tests"""
+
+    def test_campers_csv_export(self, auth_headers):
+        camper = create_test_camper(auth_headers)
+        response = requests.get(f"{BASE_URL}/api/exports/campers", params={"format": "csv"}, headers=auth_headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        assert "campers_export.csv" in response.headers["content-disposition"]
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert camper["id"] in [r["Camper ID"] for r in rows]
+
+    def test_billing_ndjson_column_selection(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/exports/billing", params={
+            "format": "ndjson", "columns": "Invoice ID,Amount"
+        }, headers=auth_headers)
+        assert response.status_code == 200
+        for line in response.text.splitlines():
+            assert set(json.loads(line).keys()) == {"Invoice ID", "Amount"}
+
+        response = requests.get(f"{BASE_URL}/api/exports/billing", params={
+            "format": "csv", "columns": "Not A Column"
+        }, headers=auth_headers)
+        assert response.status_code == 400
+
+    def test_gzip_export(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/exports/campers", params={
+            "format": "csv", "gzip": "true"
+        }, headers=auth_headers)
+        assert response.status_code == 200
+        assert gzip.decompress(response.content).decode().startswith("Camper ID,")
+
+    def test_legacy_json_export(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/exports/campers", headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["filename"] == "campers_export.csv"
+        assert isinstance(data["data"], list)
+
+    def test_quickbooks_iif(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/financial/quickbooks-export", params={"format": "iif"}, headers=auth_headers)
+        assert response.status_code == 200
+        lines = response.text.splitlines()
+        assert lines[0].startswith("!TRNS\t")
+        assert lines[2] == "!ENDTRNS"
+        # Checks post the (negative) bank side on TRNS and the expense side on SPL
+        for trns, spl in zip(lines, lines[1:]):
+            if trns.split("\t")[:3] == ["TRNS", "", "CHECK"]:
+                assert float(trns.split("\t")[6]) <= 0
+                assert float(spl.split("\t")[6]) >= 0
+
+
+class TestAdminCache:
+    """Admin cache counters and invalidation"""
+
+    def test_repeated_requests_hit_cache(self, auth_headers):
+        for _ in range(3):
+            requests.get(f"{BASE_URL}/api/auth/me", headers=auth_headers)
+        response = requests.get(f"{BASE_URL}/api/system/metrics", headers=auth_headers)
+        assert response.status_code == 200
+        stats = response.json()["admin_cache"]
+        assert stats["hits"] >= 1
+        assert "misses" in stats
+
+    def test_deleted_admin_loses_access(self, auth_headers):
+        email = f"test_cache_{uuid.uuid4().hex[:6]}@test.com"
+        response = requests.post(f"{BASE_URL}/api/admins", json={
+            "name": "TEST Cache Admin", "email": email, "password": "cachepass123"
+        }, headers=auth_headers)
+        assert response.status_code == 200
+        admin_id = response.json()["id"]
+
+        login = requests.post(f"{BASE_URL}/api/auth/login", json={"email": email, "password": "cachepass123"})
+        other_headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        assert requests.get(f"{BASE_URL}/api/auth/me", headers=other_headers).status_code == 200
+
+        requests.delete(f"{BASE_URL}/api/admins/{admin_id}", headers=auth_headers)
+        assert requests.get(f"{BASE_URL}/api/auth/me", headers=other_headers).status_code == 401
+
+
+class TestTemplateEngine:
+    """Template compile/cache/validation tests"""
+
+    def test_unknown_merge_field_rejected(self, auth_headers):
+        response = requests.post(f"{BASE_URL}/api/email-templates", json={
+            "name": "TEST Bad Fields",
+            "subject": "Hi {{camper_first_name}}",
+            "body": "Your {{not_a_field}} is ready"
+        }, headers=auth_headers)
+        assert response.status_code == 400
+        assert "not_a_field" in response.json()["detail"]
+
+    def test_status_merge_field_accepted(self, auth_headers):
+        response = requests.post(f"{BASE_URL}/api/email-templates", json={
+            "name": "TEST Status Field",
+            "subject": "Status update",
+            "body": "{{camper_first_name}} is now {{status}}"
+        }, headers=auth_headers)
+        assert response.status_code == 200
+        requests.delete(f"{BASE_URL}/api/email-templates/{response.json()['id']}", headers=auth_headers)
+
+    def test_update_invalidates_compiled_template(self, auth_headers):
+        response = requests.post(f"{BASE_URL}/api/email-templates", json={
+            "name": "TEST Versioned",
+            "subject": "v1 {{camper_first_name}}",
+            "body": "Body v1"
+        }, headers=auth_headers)
+        assert response.status_code == 200
+        template_id = response.json()["id"]
+
+        preview = requests.post(f"{BASE_URL}/api/templates/preview", params={"template_id": template_id}, headers=auth_headers)
+        assert preview.json()["subject"] == "v1 Sample"
+
+        requests.put(f"{BASE_URL}/api/email-templates/{template_id}", json={
+            "name": "TEST Versioned",
+            "subject": "v2 {{camper_last_name}}",
+            "body": "Body v2"
+        }, headers=auth_headers)
+        preview = requests.post(f"{BASE_URL}/api/templates/preview", params={"template_id": template_id}, headers=auth_headers)
+        assert preview.json()["subject"] == "v2 Camper"
+
+        requests.delete(f"{BASE_URL}/api/email-templates/{template_id}", headers=auth_headers)
+
+
+class TestBulkStatus:
+    """Bulk status transition tests"""
+
+    def test_bulk_status_update(self, auth_headers):
+        campers = [create_test_camper(auth_headers) for _ in range(3)]
+        ids = [c["id"] for c in campers]
+        missing_id = str(uuid.uuid4())
+        response = requests.post(f"{BASE_URL}/api/campers/status:bulk", json={
+            "camper_ids": ids + [missing_id],
+            "status": "Check/Unknown",
+            "skip_email": True
+        }, headers=auth_headers)
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["updated"] == 3
+        assert data["not_found"] == 1
+        by_id = {r["camper_id"]: r for r in data["results"]}
+        assert by_id[missing_id]["updated"] is False
+        for camper_id in ids:
+            assert by_id[camper_id]["old_status"] == "Applied"
+            camper = requests.get(f"{BASE_URL}/api/campers/{camper_id}", headers=auth_headers).json()
+            assert camper["status"] == "Check/Unknown"
+
+        # Re-applying the same status is a no-op
+        response = requests.post(f"{BASE_URL}/api/campers/status:bulk", json={
+            "camper_ids": ids, "status": "Check/Unknown", "skip_email": True
+        }, headers=auth_headers)
+        assert response.json()["updated"] == 0
+        assert response.json()["unchanged"] == 3
+
+    def test_bulk_status_logs_activity(self, auth_headers):
+        camper = create_test_camper(auth_headers)
+        requests.post(f"{BASE_URL}/api/campers/status:bulk", json={
+            "camper_ids": [camper["id"]], "status": "Sending Check", "skip_email": True
+        }, headers=auth_headers)
+        logs = requests.get(f"{BASE_URL}/api/activity/camper/{camper['id']}", headers=auth_headers).json()
+        assert any(log["action"] == "status_changed" and log["details"]["new_status"] == "Sending Check" for log in logs)
+
+    def test_bulk_status_invalid(self, auth_headers):
+        response = requests.post(f"{BASE_URL}/api/campers/status:bulk", json={
+            "camper_ids": [], "status": "Bogus"
+        }, headers=auth_headers)
+        assert response.status_code == 400
+
+
+class TestReminderJob:
+    """Automatic reminders: invoices whose next_reminder_date has arrived"""
+
+    def _overdue_invoice(self, auth_headers):
+        camper = create_test_camper(auth_headers)
+        # Due 3 days ago -> the first post-due reminder is due today
+        due_date = (date.today() - timedelta(days=3)).isoformat()
+        response = requests.post(f"{BASE_URL}/api/invoices", json={
+            "camper_id": camper["id"],
+            "description": "TEST reminder job",
+            "due_date": due_date,
+            "line_items": [{"description": "Tuition", "amount": 100.0}]
+        }, headers=auth_headers)
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    def test_dry_run_lists_due_invoice(self, auth_headers):
+        invoice = self._overdue_invoice(auth_headers)
+        response = requests.post(f"{BASE_URL}/api/invoices/reminders/run", params={"dry_run": "true"}, headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["dry_run"] is True
+        assert invoice["id"] in [r["invoice_id"] for r in data["reminders"]]
+
+        # Dry run leaves the invoice untouched
+        after = requests.get(f"{BASE_URL}/api/invoices/{invoice['id']}", headers=auth_headers).json()
+        assert after["next_reminder_date"] == invoice["next_reminder_date"]
+
+    def test_run_advances_next_reminder(self, auth_headers):
+        invoice = self._overdue_invoice(auth_headers)
+        response = requests.post(f"{BASE_URL}/api/invoices/reminders/run", headers=auth_headers)
+        if response.status_code == 409:
+            pytest.skip("Reminder job is running on another worker")
+        assert response.status_code == 200
+
+        after = requests.get(f"{BASE_URL}/api/invoices/{invoice['id']}", headers=auth_headers).json()
+        assert after["next_reminder_date"] > date.today().isoformat()
+
+        comms = requests.get(f"{BASE_URL}/api/communications", params={"camper_id": invoice["camper_id"]}, headers=auth_headers).json()
+        assert len(comms) == 1
+        assert comms[0]["status"] == "pending"
+
+
+class TestBillingLedger:
+    """Every money movement writes a ledger entry and moves the camper balance by the same amount"""
+
+    def _camper_totals(self, auth_headers, camper_id):
+        camper = requests.get(f"{BASE_URL}/api/campers/{camper_id}", headers=auth_headers).json()
+        return camper["total_balance"], camper["total_paid"]
+
+    def test_camper_form_save_keeps_balance(self, auth_headers):
+        camper = create_test_camper(auth_headers)
+        requests.post(f"{BASE_URL}/api/invoices", json={
+            "camper_id": camper["id"],
+            "description": "TEST ledger",
+            "line_items": [{"description": "Tuition", "amount": 80.0}]
+        }, headers=auth_headers)
+
+        # The form sends back the balances it loaded before the invoice existed
+        response = requests.put(f"{BASE_URL}/api/campers/{camper['id']}", json={
+            **{k: v for k, v in camper.items() if k not in ("id", "status", "created_at")},
+            "notes": "TEST edited", "total_balance": 0.0, "total_paid": 0.0
+        }, headers=auth_headers)
+        assert response.status_code == 200
+        assert self._camper_totals(auth_headers, camper["id"]) == (80.0, 0.0)
+
+    def test_invoice_lifecycle_keeps_balance(self, auth_headers):
+        camper = create_test_camper(auth_headers)
+        invoice = requests.post(f"{BASE_URL}/api/invoices", json={
+            "camper_id": camper["id"],
+            "description": "TEST ledger",
+            "line_items": [{"description": "Tuition", "amount": 100.0}]
+        }, headers=auth_headers).json()
+        assert self._camper_totals(auth_headers, camper["id"]) == (100.0, 0.0)
+
+        # Changing the amount now moves the balance too
+        response = requests.put(f"{BASE_URL}/api/invoices/{invoice['id']}", json={
+            "line_items": [{"description": "Tuition", "amount": 150.0}]
+        }, headers=auth_headers)
+        assert response.status_code == 200
+        assert self._camper_totals(auth_headers, camper["id"]) == (150.0, 0.0)
+
+        response = requests.post(f"{BASE_URL}/api/payments", json={
+            "invoice_id": invoice["id"], "camper_id": camper["id"], "amount": 50.0, "method": "check"
+        }, headers=auth_headers)
+        assert response.status_code == 200
+        assert self._camper_totals(auth_headers, camper["id"]) == (150.0, 50.0)
+
+        # Deleting keeps only the paid part; deleting twice doesn't reduce it again
+        requests.delete(f"{BASE_URL}/api/invoices/{invoice['id']}", headers=auth_headers)
+        requests.delete(f"{BASE_URL}/api/invoices/{invoice['id']}", headers=auth_headers)
+        assert self._camper_totals(auth_headers, camper["id"]) == (50.0, 50.0)
+
+        requests.post(f"{BASE_URL}/api/invoices/{invoice['id']}/restore", headers=auth_headers)
+        assert self._camper_totals(auth_headers, camper["id"]) == (150.0, 50.0)
+
+        ledger = requests.get(f"{BASE_URL}/api/campers/{camper['id']}/ledger", headers=auth_headers).json()
+        assert [e["entry_type"] for e in ledger] == [
+            "invoice_created", "invoice_adjusted", "payment", "invoice_deleted", "invoice_restored"
+        ]
+        assert sum(e["charge"] for e in ledger) == 150.0
+        assert sum(e["paid"] for e in ledger) == 50.0
+
+    def test_reconcile_report(self, auth_headers):
+        camper = create_test_camper(auth_headers)
+        requests.post(f"{BASE_URL}/api/invoices", json={
+            "camper_id": camper["id"],
+            "description": "TEST reconcile",
+            "line_items": [{"description": "Tuition", "amount": 75.0}]
+        }, headers=auth_headers)
+
+        response = requests.post(f"{BASE_URL}/api/billing/reconcile", headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["applied"] is False
+        assert data["campers_checked"] >= 1
+        assert camper["id"] not in [row["camper_id"] for row in data["camper_drift"]]
+        assert camper["id"] not in [row["camper_id"] for row in data["ledger_drift"]]
+
+
+class TestInvoiceNumbers:
+    """Invoice numbers come from a per-year counter, never from a document count"""
+
+    def _create_invoice(self, auth_headers, camper_id):
+        response = requests.post(f"{BASE_URL}/api/invoices", json={
+            "camper_id": camper_id,
+            "description": "TEST numbering",
+            "line_items": [{"description": "Tuition", "amount": 10.0}]
+        }, headers=auth_headers)
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    def test_concurrent_creates_get_unique_numbers(self, auth_headers):
+        camper = create_test_camper(auth_headers)
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            invoices = list(pool.map(lambda _: self._create_invoice(auth_headers, camper["id"]), range(40)))
+        numbers = [inv["invoice_number"] for inv in invoices]
+        assert len(set(numbers)) == len(numbers)
+        year = date.today().year
+        assert all(n.startswith(f"INV-{year}-") for n in numbers)
+
+    def test_batch_reserves_consecutive_block(self, auth_headers):
+        campers = [create_test_camper(auth_headers) for _ in range(3)]
+        response = requests.post(f"{BASE_URL}/api/invoices/batch", json={
+            "camper_ids": [c["id"] for c in campers] + ["nonexistent-camper"],
+            "description": "TEST batch",
+            "line_items": [{"description": "Tuition", "amount": 250.0}]
+        }, headers=auth_headers)
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["created"] == 3
+        assert data["missing_campers"] == ["nonexistent-camper"]
+
+        sequence = sorted(int(inv["invoice_number"].rsplit("-", 1)[1]) for inv in data["invoices"])
+        assert sequence == list(range(sequence[0], sequence[0] + 3))
+
+        # Batch invoices move balances like single ones
+        camper = requests.get(f"{BASE_URL}/api/campers/{campers[0]['id']}", headers=auth_headers).json()
+        assert camper["total_balance"] == 250.0
+
+    def test_batch_requires_campers(self, auth_headers):
+        response = requests.post(f"{BASE_URL}/api/invoices/batch", json={
+            "camper_ids": [], "description": "TEST batch"
+        }, headers=auth_headers)
+        assert response.status_code == 400
+
+
+class TestDashboardSnapshot:
+    """Dashboard stats come from a cached snapshot that writes invalidate"""
+
+    def test_shape(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/dashboard/stats", headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        for key in ("total_campers", "campers_by_status", "total_invoiced", "total_collected",
+                    "outstanding", "recent_campers", "recent_payments", "pending_communications"):
+            assert key in data
+        assert sum(data["campers_by_status"].values()) <= data["total_campers"]
+        assert data["outstanding"] == round(data["total_invoiced"] - data["total_collected"], 2)
+
+    def test_snapshot_is_reused_then_invalidated(self, auth_headers):
+        first = requests.get(f"{BASE_URL}/api/dashboard/stats", params={"refresh": "true"}, headers=auth_headers).json()
+        second = requests.get(f"{BASE_URL}/api/dashboard/stats", headers=auth_headers).json()
+        assert second["generated_at"] == first["generated_at"]
+
+        camper = create_test_camper(auth_headers)
+        after = requests.get(f"{BASE_URL}/api/dashboard/stats", headers=auth_headers).json()
+        assert after["total_campers"] == first["total_campers"] + 1
+        assert camper["id"] in [c["id"] for c in after["recent_campers"]]
+
+        requests.post(f"{BASE_URL}/api/invoices", json={
+            "camper_id": camper["id"],
+            "description": "TEST dashboard",
+            "line_items": [{"description": "Tuition", "amount": 40.0}]
+        }, headers=auth_headers)
+        after_invoice = requests.get(f"{BASE_URL}/api/dashboard/stats", headers=auth_headers).json()
+        assert after_invoice["total_invoiced"] == round(after["total_invoiced"] + 40.0, 2)
+
+
+class TestFinancialSummary:
+    """Financial totals come from server-side aggregation over daily rollups"""
+
+    def test_expense_updates_rollup(self, auth_headers):
+        category = f"TEST_{uuid.uuid4().hex[:6]}"
+        today = date.today().isoformat()
+        before = requests.get(f"{BASE_URL}/api/financial/summary", headers=auth_headers).json()
+
+        response = requests.post(f"{BASE_URL}/api/expenses", json={
+            "category": category, "amount": 123.45, "description": "TEST rollup", "date": today
+        }, headers=auth_headers)
+        assert response.status_code == 200
+
+        after = requests.get(f"{BASE_URL}/api/financial/summary", headers=auth_headers).json()
+        assert after["expense_by_category"][category] == 123.45
+        assert after["total_expenses"] == round(before["total_expenses"] + 123.45, 2)
+
+    def test_date_range_and_season_filters(self, auth_headers):
+        category = f"TEST_{uuid.uuid4().hex[:6]}"
+        requests.post(f"{BASE_URL}/api/expenses", json={
+            "category": category, "amount": 50.0, "description": "TEST old expense", "date": "2019-07-04"
+        }, headers=auth_headers)
+
+        in_range = requests.get(f"{BASE_URL}/api/financial/summary", params={
+            "start_date": "2019-07-01", "end_date": "2019-07-31"
+        }, headers=auth_headers).json()
+        assert in_range["expense_by_category"].get(category) == 50.0
+
+        other_range = requests.get(f"{BASE_URL}/api/financial/summary", params={
+            "start_date": "2019-08-01", "end_date": "2019-08-31"
+        }, headers=auth_headers).json()
+        assert category not in other_range["expense_by_category"]
+
+        season = requests.get(f"{BASE_URL}/api/financial/summary", params={"season": 2019}, headers=auth_headers).json()
+        assert season["season"] == 2019
+        assert season["start_date"] <= "2019-07-04" <= season["end_date"]
+
+    def test_invalid_date(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/financial/summary", params={"start_date": "July"}, headers=auth_headers)
+        assert response.status_code == 400
+
+    def test_rebuild_matches_incremental(self, auth_headers):
+        before = requests.get(f"{BASE_URL}/api/financial/summary", headers=auth_headers).json()
+        response = requests.post(f"{BASE_URL}/api/financial/rollups/rebuild", headers=auth_headers)
+        assert response.status_code in (200, 409)
+        after = requests.get(f"{BASE_URL}/api/financial/summary", headers=auth_headers).json()
+        assert after["total_expenses"] == before["total_expenses"]
+
+    def test_undated_expense_same_day_after_rebuild(self, auth_headers):
+        category = f"TEST_{uuid.uuid4().hex[:6]}"
+        today = date.today().isoformat()
+        requests.post(f"{BASE_URL}/api/expenses", json={
+            "category": category, "amount": 10.0, "description": "TEST undated", "date": ""
+        }, headers=auth_headers)
+        params = {"start_date": today, "end_date": today}
+
+        incremental = requests.get(f"{BASE_URL}/api/financial/summary", params=params, headers=auth_headers).json()
+        assert incremental["expense_by_category"].get(category) == 10.0
+
+        response = requests.post(f"{BASE_URL}/api/financial/rollups/rebuild", headers=auth_headers)
+        assert response.status_code in (200, 409)
+        rebuilt = requests.get(f"{BASE_URL}/api/financial/summary", params=params, headers=auth_headers).json()
+        assert rebuilt["expense_by_category"].get(category) == 10.0
+
+
+class TestActivityActorNames:
+    """performed_by_name is resolved in one batch, including non-admin system actors"""
+
+    def test_admin_and_system_actor_names(self, auth_headers):
+        me = requests.get(f"{BASE_URL}/api/auth/me", headers=auth_headers).json()
+        camper = create_test_camper(auth_headers)
+        requests.post(f"{BASE_URL}/api/activities/note", json={
+            "entity_type": "camper", "entity_id": camper["id"], "note": "TEST actor names"
+        }, headers=auth_headers)
+
+        # A reminder run logs its entries as the scheduler
+        due_date = (date.today() - timedelta(days=3)).isoformat()
+        requests.post(f"{BASE_URL}/api/invoices", json={
+            "camper_id": camper["id"], "description": "TEST actor", "due_date": due_date,
+            "line_items": [{"description": "Tuition", "amount": 20.0}]
+        }, headers=auth_headers)
+        run = requests.post(f"{BASE_URL}/api/invoices/reminders/run", headers=auth_headers)
+
+        logs = requests.get(f"{BASE_URL}/api/activity/camper/{camper['id']}", headers=auth_headers).json()
+        notes = [log for log in logs if log["action"] == "note_added"]
+        assert notes and notes[0]["performed_by_name"] == me["name"]
+
+        if run.status_code == 200:
+            reminders = [log for log in logs if log["action"] == "reminder_sent"]
+            assert reminders and reminders[0]["performed_by_name"] == "Automatic Reminders"
+
+        feed = requests.get(f"{BASE_URL}/api/activities", params={"entity_id": camper["id"]}, headers=auth_headers).json()
+        assert all(log.get("performed_by_name") != "Unknown" for log in feed if log.get("performed_by"))
+
+
+class TestActivityWriter:
+    """Activity entries are buffered, but feeds still show them right away"""
+
+    def test_buffered_entries_visible_in_feed(self, auth_headers):
+        camper = create_test_camper(auth_headers)
+        requests.put(f"{BASE_URL}/api/campers/{camper['id']}/status", params={"status": "Check/Unknown", "skip_email": "true"}, headers=auth_headers)
+
+        logs = requests.get(f"{BASE_URL}/api/activity/camper/{camper['id']}", headers=auth_headers).json()
+        actions = [log["action"] for log in logs]
+        assert "camper_created" in actions
+        assert "status_changed" in actions
+
+    def test_writer_metrics(self, auth_headers):
+        metrics = requests.get(f"{BASE_URL}/api/system/metrics", headers=auth_headers).json()
+        writer = metrics["activity_writer"]
+        assert writer["running"] is True
+        assert writer["pending"] >= 0
+
+
+class TestActivityPaging:
+    """Activity feeds page by cursor and filter by action and time range"""
+
+    def test_cursor_and_filters(self, auth_headers):
+        camper = create_test_camper(auth_headers)
+        for i in range(5):
+            requests.post(f"{BASE_URL}/api/activities/note", json={
+                "entity_type": "camper", "entity_id": camper["id"], "note": f"TEST note {i}"
+            }, headers=auth_headers)
+
+        seen = []
+        cursor = None
+        while True:
+            params = {"entity_type": "camper", "entity_id": camper["id"], "action": "note_added", "limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = requests.get(f"{BASE_URL}/api/activities", params=params, headers=auth_headers)
+            assert response.status_code == 200
+            page = response.json()
+            assert len(page) <= 2
+            seen.extend(log["id"] for log in page)
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+        assert len(seen) == 5
+        assert len(set(seen)) == 5
+
+        tomorrow = (date.today() + timedelta(days=1)).isoformat()
+        future = requests.get(f"{BASE_URL}/api/activities", params={
+            "entity_id": camper["id"], "since": tomorrow
+        }, headers=auth_headers).json()
+        assert future == []
+
+    def test_invalid_time_range(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/activities", params={"since": "last week"}, headers=auth_headers)
+        assert response.status_code == 400
+
+    def test_archive(self, auth_headers):
+        response = requests.post(f"{BASE_URL}/api/activities/archive/run", headers=auth_headers)
+        assert response.status_code in (200, 409)
+        if response.status_code == 200:
+            assert response.json()["archived"] >= 0
+
+        response = requests.get(f"{BASE_URL}/api/activities/archive", params={"month": "2020-01", "limit": 5}, headers=auth_headers)
+        assert response.status_code == 200
+        assert isinstance(response.json(), list)
+        assert len(response.json()) <= 5
+
+        response = requests.get(f"{BASE_URL}/api/activities/archive", params={"month": "2020-01", "cursor": "not-a-cursor"}, headers=auth_headers)
+        assert response.status_code == 400
+
+        response = requests.get(f"{BASE_URL}/api/activities/archive", headers=auth_headers)
+        assert response.status_code == 400
+
+
+class TestGroupMembership:
+    """Replacing a group's members only touches campers that joined or left"""
+
+    def test_membership_diff(self, auth_headers):
+        group = requests.post(f"{BASE_URL}/api/groups", json={"name": f"TEST_Shiur_{uuid.uuid4().hex[:6]}"}, headers=auth_headers).json()
+        campers = [create_test_camper(auth_headers) for _ in range(4)]
+        ids = [c["id"] for c in campers]
+
+        response = requests.put(f"{BASE_URL}/api/groups/{group['id']}/campers", json={"camper_ids": ids[:3]}, headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json()["added"] == 3
+        assert response.json()["removed"] == 0
+
+        response = requests.put(f"{BASE_URL}/api/groups/{group['id']}/campers", json={"camper_ids": ids[1:]}, headers=auth_headers)
+        result = response.json()
+        assert result["added"] == 1
+        assert result["removed"] == 1
+        assert result["campers_updated"] == 2
+
+        fetched = requests.get(f"{BASE_URL}/api/groups/{group['id']}", headers=auth_headers).json()
+        assert fetched["camper_ids"] == ids[1:]
+        first = requests.get(f"{BASE_URL}/api/campers/{ids[0]}", headers=auth_headers).json()
+        last = requests.get(f"{BASE_URL}/api/campers/{ids[3]}", headers=auth_headers).json()
+        assert group["id"] not in first.get("groups", [])
+        assert group["id"] in last.get("groups", [])
+
+        requests.delete(f"{BASE_URL}/api/groups/{group['id']}", headers=auth_headers)
+
+
+class TestGroupTree:
+    """Nested groups are returned as a tree and deleted as a subtree"""
+
+    def test_tree_and_subtree_delete(self, auth_headers):
+        tag = uuid.uuid4().hex[:6]
+        root = requests.post(f"{BASE_URL}/api/groups", json={"name": f"TEST_Root_{tag}"}, headers=auth_headers).json()
+        child = requests.post(f"{BASE_URL}/api/groups", json={"name": f"TEST_Child_{tag}", "parent_id": root["id"]}, headers=auth_headers).json()
+        grandchild = requests.post(f"{BASE_URL}/api/groups", json={"name": f"TEST_Grandchild_{tag}", "parent_id": child["id"]}, headers=auth_headers).json()
+        assert grandchild["ancestors"] == [root["id"], child["id"]]
+
+        camper = create_test_camper(auth_headers)
+        requests.put(f"{BASE_URL}/api/groups/{grandchild['id']}/campers", json={"camper_ids": [camper["id"]]}, headers=auth_headers)
+
+        tree = requests.get(f"{BASE_URL}/api/groups/tree", headers=auth_headers).json()
+        node = next(n for n in tree if n["id"] == root["id"])
+        assert node["member_count"] == 0
+        assert node["subtree_member_count"] == 1
+        assert node["children"][0]["children"][0]["id"] == grandchild["id"]
+
+        response = requests.delete(f"{BASE_URL}/api/groups/{root['id']}", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json()["groups_deleted"] == 3
+        assert requests.get(f"{BASE_URL}/api/groups/{grandchild['id']}", headers=auth_headers).status_code == 404
+        updated = requests.get(f"{BASE_URL}/api/campers/{camper['id']}", headers=auth_headers).json()
+        assert grandchild["id"] not in updated.get("groups", [])
+
+    def test_unknown_parent(self, auth_headers):
+        response = requests.post(f"{BASE_URL}/api/groups", json={"name": "TEST_Orphan", "parent_id": str(uuid.uuid4())}, headers=auth_headers)
+        assert response.status_code == 400
+
+
+class TestRoomAssignment:
+    """Room assignment never overfills a room, even under concurrent drag-and-drop"""
+
+    def test_concurrent_assignments_respect_capacity(self, auth_headers):
+        room = requests.post(f"{BASE_URL}/api/rooms", json={"name": f"TEST_Bunk_{uuid.uuid4().hex[:6]}", "capacity": 3}, headers=auth_headers).json()
+        campers = [create_test_camper(auth_headers) for _ in range(8)]
+
+        def assign(camper):
+            return requests.put(f"{BASE_URL}/api/rooms/{room['id']}/assign", params={"camper_id": camper["id"]}, headers=auth_headers).status_code
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            statuses = list(pool.map(assign, campers))
+        assert statuses.count(200) == 3
+        assert statuses.count(409) == 5
+
+        rooms = requests.get(f"{BASE_URL}/api/rooms", headers=auth_headers).json()
+        stored = next(r for r in rooms if r["id"] == room["id"])
+        assert len(stored["assigned_campers"]) == 3
+        assert stored["occupancy"] == 3
+
+    def test_move_releases_previous_room(self, auth_headers):
+        first = requests.post(f"{BASE_URL}/api/rooms", json={"name": f"TEST_Bunk_{uuid.uuid4().hex[:6]}", "capacity": 2}, headers=auth_headers).json()
+        second = requests.post(f"{BASE_URL}/api/rooms", json={"name": f"TEST_Bunk_{uuid.uuid4().hex[:6]}", "capacity": 2}, headers=auth_headers).json()
+        camper = create_test_camper(auth_headers)
+
+        requests.put(f"{BASE_URL}/api/rooms/{first['id']}/assign", params={"camper_id": camper["id"]}, headers=auth_headers)
+        response = requests.put(f"{BASE_URL}/api/rooms/{second['id']}/assign", params={"camper_id": camper["id"]}, headers=auth_headers)
+        assert response.status_code == 200
+
+        rooms = {r["id"]: r for r in requests.get(f"{BASE_URL}/api/rooms", headers=auth_headers).json()}
+        assert camper["id"] not in rooms[first["id"]]["assigned_campers"]
+        assert rooms[first["id"]]["occupancy"] == 0
+        assert rooms[second["id"]]["assigned_campers"] == [camper["id"]]
+
+        updated = requests.get(f"{BASE_URL}/api/campers/{camper['id']}", headers=auth_headers).json()
+        assert updated["room_id"] == second["id"]
+        assert updated["room_name"] == second["name"]
+
+        # A form save with a stale (empty) room doesn't detach the camper from their bed
+        response = requests.put(f"{BASE_URL}/api/campers/{camper['id']}", json={
+            **{k: v for k, v in updated.items() if k not in ("id", "status", "created_at")},
+            "room_id": None, "room_name": None
+        }, headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json()["room_id"] == second["id"]
+
+
+class TestAllocation:
+    """Batch allocation of campers into rooms with constraints"""
+
+    def test_dry_run_then_commit(self, auth_headers):
+        rooms = [
+            requests.post(f"{BASE_URL}/api/rooms", json={"name": f"TEST_Bunk_{uuid.uuid4().hex[:6]}", "capacity": 4}, headers=auth_headers).json()
+            for _ in range(3)
+        ]
+        campers = [create_test_camper(auth_headers, grade=str(9 + i % 2)) for i in range(10)]
+        ids = [c["id"] for c in campers]
+        payload = {
+            "target_type": "rooms",
+            "target_ids": [r["id"] for r in rooms],
+            "camper_ids": ids,
+            "group_by": ["grade"],
+            "keep_together": [[ids[0], ids[1]]],
+            "keep_apart": [[ids[2], ids[4]]],
+        }
+
+        preview = requests.post(f"{BASE_URL}/api/allocations", json=payload, headers=auth_headers)
+        assert preview.status_code == 200, preview.text
+        result = preview.json()
+        assert result["dry_run"] is True
+        assert result["placed"] == 10
+        room_of = {cid: a["target_id"] for a in result["assignments"] for cid in a["camper_ids"]}
+        assert room_of[ids[0]] == room_of[ids[1]]
+        assert room_of[ids[2]] != room_of[ids[4]]
+        assert all(len(a["camper_ids"]) <= 4 for a in result["assignments"])
+
+        # Nothing is written by a dry run
+        listed = {r["id"]: r for r in requests.get(f"{BASE_URL}/api/rooms", headers=auth_headers).json()}
+        assert all(listed[r["id"]]["assigned_campers"] == [] for r in rooms)
+
+        committed = requests.post(f"{BASE_URL}/api/allocations", json={**payload, "dry_run": False}, headers=auth_headers)
+        assert committed.status_code == 200
+        listed = {r["id"]: r for r in requests.get(f"{BASE_URL}/api/rooms", headers=auth_headers).json()}
+        assert sum(listed[r["id"]]["occupancy"] for r in rooms) == 10
+        camper = requests.get(f"{BASE_URL}/api/campers/{ids[0]}", headers=auth_headers).json()
+        assert camper["room_id"] in listed
+
+    def test_conflicting_constraints(self, auth_headers):
+        room = requests.post(f"{BASE_URL}/api/rooms", json={"name": f"TEST_Bunk_{uuid.uuid4().hex[:6]}", "capacity": 4}, headers=auth_headers).json()
+        a, b = create_test_camper(auth_headers), create_test_camper(auth_headers)
+        response = requests.post(f"{BASE_URL}/api/allocations", json={
+            "target_type": "rooms", "target_ids": [room["id"]], "camper_ids": [a["id"], b["id"]],
+            "keep_together": [[a["id"], b["id"]]], "keep_apart": [[a["id"], b["id"]]]
+        }, headers=auth_headers)
+        assert response.status_code == 400
+
+
+class TestSavedReports:
+    """Saved reports compile to whitelisted, index-backed, paginated queries"""
+
+    def test_report_pages_and_projects(self, auth_headers):
+        tag = uuid.uuid4().hex[:6]
+        for _ in range(3):
+            create_test_camper(auth_headers, yeshiva=f"TEST_Yeshiva_{tag}")
+        created = requests.post(f"{BASE_URL}/api/reports", json={
+            "name": f"TEST_Report_{tag}",
+            "columns": ["first_name", "last_name", "yeshiva"],
+            "filters": {"yeshiva": f"TEST_Yeshiva_{tag}"},
+            "sort_by": "last_name",
+        }, headers=auth_headers)
+        assert created.status_code == 200, created.text
+        report_id = created.json()["id"]
+
+        rows, cursor = [], None
+        while True:
+            params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+            response = requests.get(f"{BASE_URL}/api/reports/{report_id}", params=params, headers=auth_headers)
+            assert response.status_code == 200
+            rows.extend(response.json()["data"])
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+        assert len(rows) == 3
+        assert set(rows[0]) == {"id", "first_name", "last_name", "yeshiva"}
+
+        plan = requests.get(f"{BASE_URL}/api/reports/{report_id}/explain", headers=auth_headers).json()
+        assert "collection_scan" in plan
+        assert isinstance(plan["indexes"], list)
+
+        requests.delete(f"{BASE_URL}/api/reports/{report_id}", headers=auth_headers)
+
+    def test_rejects_unsafe_filters(self, auth_headers):
+        for filters in (
+            {"$where": "sleep(1000)"},
+            {"first_name": {"$regex": ".*"}},
+            {"first_name": {"$eq": {"$gt": ""}}},
+            {"password_hash": "x"},
+        ):
+            response = requests.post(f"{BASE_URL}/api/reports", json={
+                "name": "TEST_Unsafe", "columns": ["first_name"], "filters": filters
+            }, headers=auth_headers)
+            assert response.status_code == 400, filters
+
+    def test_rejects_unindexed_sort(self, auth_headers):
+        for sort_by in ("groups", "city"):
+            response = requests.post(f"{BASE_URL}/api/reports", json={
+                "name": "TEST_Unsorted", "columns": ["first_name"], "sort_by": sort_by
+            }, headers=auth_headers)
+            assert response.status_code == 400, sort_by
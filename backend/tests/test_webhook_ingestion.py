@@ -0,0 +1,170 @@
+"""
+Camp Baraisa Backend Tests - Stripe webhook ingestion
+Testing the queued webhook intake with a local fake event generator:
+- Events are acknowledged immediately and applied by background workers
+- Stripe retries (same event id) are deduplicated
+- A deadline-day burst across many invoices is fully applied, exactly once
+- The fake payment provider (PAYMENT_PROVIDER=fake) drives the full checkout path offline
+"""
+
+import pytest
+import requests
+import os
+import uuid
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+ADMIN_EMAIL = "admin@campbaraisa.com"
+ADMIN_PASSWORD = "testpassword123"
+
+BURST_INVOICES = 20
+PAYMENTS_PER_INVOICE = 10
+PAYMENT_CENTS = 2500
+REDELIVERIES = 2
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Headers with auth token"""
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "email": ADMIN_EMAIL,
+        "password": ADMIN_PASSWORD
+    })
+    if response.status_code != 200:
+        pytest.skip("Authentication failed - skipping authenticated tests")
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def create_invoice(auth_headers, amount):
+    unique_name = f"TEST_{uuid.uuid4().hex[:8]}"
+    camper = requests.post(f"{BASE_URL}/api/campers", json={
+        "first_name": unique_name,
+        "last_name": "Webhook",
+        "parent_email": f"{unique_name.lower()}@test.com"
+    }, headers=auth_headers).json()
+    response = requests.post(f"{BASE_URL}/api/invoices", json={
+        "camper_id": camper["id"],
+        "description": "TEST webhook burst",
+        "line_items": [{"description": "Tuition", "amount": amount}]
+    }, headers=auth_headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def fake_checkout_completed(invoice_id, amount_cents):
+    """A minimal checkout.session.completed event, shaped like Stripe's"""
+    return {
+        "id": f"evt_test_{uuid.uuid4().hex}",
+        "type": "checkout.session.completed",
+        "data": {"object": {
+            "id": f"cs_test_{uuid.uuid4().hex}",
+            "amount_total": amount_cents,
+            "metadata": {"invoice_id": invoice_id}
+        }}
+    }
+
+
+def wait_for_paid_amount(auth_headers, invoice_id, expected, timeout=60):
+    deadline = time.time() + timeout
+    while True:
+        invoice = requests.get(f"{BASE_URL}/api/invoices/{invoice_id}", headers=auth_headers).json()
+        if invoice["paid_amount"] >= expected or time.time() > deadline:
+            return invoice
+        time.sleep(0.5)
+
+
+class TestWebhookIntake:
+    """Acknowledge-then-process intake"""
+
+    def test_redelivered_event_applied_once(self, auth_headers):
+        invoice = create_invoice(auth_headers, 500.0)
+        event = fake_checkout_completed(invoice["id"], 10000)
+
+        for _ in range(3):
+            response = requests.post(f"{BASE_URL}/api/stripe/webhook", json=event)
+            assert response.status_code == 200
+            assert response.json()["status"] == "success"
+
+        updated = wait_for_paid_amount(auth_headers, invoice["id"], 100.0)
+        time.sleep(1)
+        updated = requests.get(f"{BASE_URL}/api/invoices/{invoice['id']}", headers=auth_headers).json()
+        assert updated["paid_amount"] == 100.0
+
+        events = requests.get(f"{BASE_URL}/api/stripe/events", headers=auth_headers).json()
+        stored = [e for e in events if e["event_id"] == event["id"]]
+        assert len(stored) == 1
+        assert stored[0]["status"] == "processed"
+
+    def test_invalid_payload(self):
+        response = requests.post(f"{BASE_URL}/api/stripe/webhook", data="not json")
+        assert response.status_code == 200
+        assert response.json()["status"] == "error"
+
+
+class TestWebhookBurst:
+    """Deadline-day burst from the fake generator, with every event delivered more than once"""
+
+    def test_burst_is_applied_exactly_once(self, auth_headers):
+        invoices = [create_invoice(auth_headers, 1000.0) for _ in range(BURST_INVOICES)]
+        events = [
+            fake_checkout_completed(invoice["id"], PAYMENT_CENTS)
+            for invoice in invoices
+            for _ in range(PAYMENTS_PER_INVOICE)
+        ]
+        deliveries = events * REDELIVERIES
+
+        def deliver(event):
+            started = time.time()
+            response = requests.post(f"{BASE_URL}/api/stripe/webhook", json=event, timeout=10)
+            return response.status_code, time.time() - started
+
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            results = list(pool.map(deliver, deliveries))
+
+        assert all(status == 200 for status, _ in results)
+        # Acknowledgement doesn't wait for the payment writes
+        assert max(elapsed for _, elapsed in results) < 5
+
+        expected = PAYMENTS_PER_INVOICE * PAYMENT_CENTS / 100
+        for invoice in invoices:
+            updated = wait_for_paid_amount(auth_headers, invoice["id"], expected)
+            assert updated["paid_amount"] == expected
+            assert updated["status"] == "partial"
+
+        metrics = requests.get(f"{BASE_URL}/api/system/metrics", headers=auth_headers).json()
+        assert "stripe_webhooks" in metrics
+
+
+class TestFakePaymentProvider:
+    """Checkout -> customer pays -> webhook -> invoice, without Stripe"""
+
+    def test_fake_checkout_end_to_end(self, auth_headers):
+        invoice = create_invoice(auth_headers, 400.0)
+        response = requests.post(f"{BASE_URL}/api/stripe/checkout", params={
+            "invoice_id": invoice["id"], "amount": 150.0, "origin_url": BASE_URL, "include_fee": "false"
+        })
+        assert response.status_code == 200, response.text
+        session_id = response.json()["session_id"]
+        if not session_id.startswith("cs_fake_"):
+            pytest.skip("Server is not running with PAYMENT_PROVIDER=fake")
+
+        status = requests.get(f"{BASE_URL}/api/stripe/status/{session_id}").json()
+        assert status["payment_status"] == "unpaid"
+
+        response = requests.post(f"{BASE_URL}/api/payment/fake/sessions/{session_id}/complete")
+        assert response.status_code == 200
+        assert response.json()["payment_status"] == "paid"
+
+        updated = wait_for_paid_amount(auth_headers, invoice["id"], 150.0)
+        assert updated["paid_amount"] == 150.0
+
+        # Polling the status afterwards doesn't apply the payment a second time
+        requests.get(f"{BASE_URL}/api/stripe/status/{session_id}")
+        updated = requests.get(f"{BASE_URL}/api/invoices/{invoice['id']}", headers=auth_headers).json()
+        assert updated["paid_amount"] == 150.0
+
+        # A session can only be completed once
+        response = requests.post(f"{BASE_URL}/api/payment/fake/sessions/{session_id}/complete")
+        assert response.status_code == 404
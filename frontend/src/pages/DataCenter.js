@@ -49,6 +49,9 @@ import {
 
 const API_URL = process.env.REACT_APP_BACKEND_URL;
 
+// Reports can only be sorted on indexed fields (see REPORT_SORT_KEYS in the backend)
+const SORTABLE_FIELDS = ['last_name', 'first_name', 'status', 'grade', 'created_at'];
+
 // All available fields organized by category
 const ALL_FIELDS = {
   camper: [
@@ -391,7 +394,7 @@ function DataCenter() {
                     </SelectTrigger>
                     <SelectContent>
                       <SelectItem value="none">None</SelectItem>
-                      {selectedColumns.map(col => (
+                      {selectedColumns.filter(col => SORTABLE_FIELDS.includes(col)).map(col => (
                         <SelectItem key={col} value={col}>{getFieldLabel(col)}</SelectItem>
                       ))}
                     </SelectContent>
@@ -50,33 +50,17 @@ const Exports = () => {
   const handleExport = async (exportType) => {
     setExporting({ ...exporting, [exportType.id]: true });
     try {
+      // The server streams the CSV, so the full export never has to be built in memory
       const response = await axios.get(`${API_URL}${exportType.endpoint}`, {
-        headers: { Authorization: `Bearer ${token}` }
+        headers: { Authorization: `Bearer ${token}` },
+        params: { format: 'csv' },
+        responseType: 'blob'
       });
 
-      const { data, filename } = response.data;
-      
-      if (data.length === 0) {
-        toast.info('No data to export');
-        setExporting({ ...exporting, [exportType.id]: false });
-        return;
-      }
-
-      // Convert to CSV
-      const headers = Object.keys(data[0]);
-      const csvContent = [
-        headers.join(','),
-        ...data.map(row => 
-          headers.map(header => {
-            const value = row[header];
-            // Escape commas and quotes
-            if (typeof value === 'string' && (value.includes(',') || value.includes('"'))) {
-              return `"${value.replace(/"/g, '""')}"`;
-            }
-            return value ?? '';
-          }).join(',')
-        )
-      ].join('\n');
+      const disposition = response.headers['content-disposition'] || '';
+      const match = disposition.match(/filename="?([^"]+)"?/);
+      const filename = match ? match[1] : `${exportType.id}_export.csv`;
+      const csvContent = response.data;
 
       // Download file
       const blob = new Blob([csvContent], { type: 'text/csv;charset=utf-8;' });